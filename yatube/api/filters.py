@@ -0,0 +1,18 @@
+from rest_framework import filters
+
+from posts.search import search_posts
+
+
+class PostSearchFilter(filters.SearchFilter):
+    """
+    Поиск записей по параметру search через полнотекстовый индекс.
+
+    Ищет по тексту записи и именам автора, результаты упорядочены
+    по релевантности (см. posts.search).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return search_posts(queryset, ' '.join(search_terms))
@@ -0,0 +1,301 @@
+"""
+Получение картинок записей по ссылкам и из строк base64.
+
+Картинка скачивается через общую сессию requests с пулом соединений,
+с ограничением времени соединения, чтения и всей загрузки
+(settings.API_IMAGE_FETCH_TIMEOUT, API_IMAGE_FETCH_DEADLINE). Ответ
+читается потоком во временный файл и обрывается, как только превышен
+settings.API_IMAGE_MAX_SIZE или первые байты не похожи на картинку,
+поэтому большие файлы не держатся в памяти целиком.
+
+Строка data:image/...;base64,... декодируется по частям (decode_data_uri):
+в памяти одновременно оказываются только исходная строка и одна часть.
+
+При settings.API_IMAGE_FETCH_DEFERRED запись сохраняется сразу без
+картинки, а картинка скачивается в фоновом потоке и прикрепляется
+к записи после загрузки (см. attach_later).
+"""
+import base64
+import binascii
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import close_old_connections, transaction
+from requests.adapters import HTTPAdapter
+
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Размер части строки base64, кратный 4.
+BASE64_CHUNK_SIZE = 4 * 16 * 1024
+BASE64_PREFIX = ';base64,'
+# Сигнатуры в начале файла: (смещение, байты, расширение).
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (8, b'WEBP', 'webp'),
+    (0, b'BM', 'bmp'),
+)
+HEADER_SIZE = 12
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+class ImageError(ValueError):
+    """Картинка не подходит: не картинка, слишком большая или битая."""
+
+
+class ImageFetchError(ImageError):
+    """Картинку по ссылке загрузить не удалось."""
+
+
+class DeferredImage(str):
+    """Ссылка на картинку, которая будет загружена в фоне."""
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=settings.API_IMAGE_FETCH_WORKERS,
+                pool_maxsize=settings.API_IMAGE_FETCH_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def is_remote_image(data):
+    return (isinstance(data, str)
+            and urlsplit(data).scheme in settings.API_IMAGE_URL_SCHEMES)
+
+
+def sniff(header):
+    """Расширение картинки по первым байтам или None."""
+    for offset, signature, extension in SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return extension
+    return None
+
+
+def check_headers(response, max_size):
+    content_type = response.headers.get('Content-Type', '')
+    content_type = content_type.split(';')[0].strip()
+    if content_type and not content_type.startswith('image/'):
+        raise ImageFetchError(f'По ссылке не картинка, а {content_type}.')
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > max_size:
+        raise ImageFetchError(
+            f'Картинка больше {max_size} байт.')
+    return content_type or 'application/octet-stream'
+
+
+def write_image(chunks, file, max_size, deadline=None):
+    """
+    Пишет части картинки в file, возвращает (размер, расширение).
+
+    Бросает ImageError, как только размер превысил max_size, первые байты
+    не похожи на картинку или прошел срок deadline (time.monotonic()).
+    """
+    header, size, extension = b'', 0, None
+    for chunk in chunks:
+        if deadline is not None and time.monotonic() > deadline:
+            raise ImageFetchError('Картинка загружается слишком долго.')
+        size += len(chunk)
+        if size > max_size:
+            raise ImageError(f'Картинка больше {max_size} байт.')
+        if extension is None:
+            header += chunk[:HEADER_SIZE]
+            if len(header) >= HEADER_SIZE:
+                extension = sniff(header)
+                if extension is None:
+                    raise ImageError('Формат картинки не распознан.')
+        file.write(chunk)
+    if extension is None:
+        extension = sniff(header)
+        if extension is None:
+            raise ImageError('Формат картинки не распознан.')
+    return size, extension
+
+
+def finish(file, size, extension):
+    file.size = size
+    file.name = f'{uuid.uuid4()}.{extension}'
+    file.seek(0)
+    return file
+
+
+def fetch(url):
+    """
+    Скачивает картинку во временный файл.
+
+    Возвращает TemporaryUploadedFile, который удаляется при закрытии.
+    При ошибке сети, превышении времени или размера и для не картинок
+    бросает ImageFetchError.
+    """
+    max_size = settings.API_IMAGE_MAX_SIZE
+    deadline = time.monotonic() + settings.API_IMAGE_FETCH_DEADLINE
+    try:
+        with get_session().get(url, stream=True,
+                               timeout=settings.API_IMAGE_FETCH_TIMEOUT
+                               ) as response:
+            response.raise_for_status()
+            content_type = check_headers(response, max_size)
+            file = TemporaryUploadedFile('image', content_type, 0, None)
+            try:
+                size, extension = write_image(
+                    response.iter_content(CHUNK_SIZE), file, max_size,
+                    deadline)
+            except BaseException:
+                file.close()
+                raise
+    except requests.RequestException as error:
+        raise ImageFetchError(
+            f'Не удалось загрузить картинку: {error}') from error
+    except ImageFetchError:
+        raise
+    except ImageError as error:
+        # Для ссылки любая неподходящая картинка - ошибка загрузки.
+        raise ImageFetchError(str(error)) from error
+    return finish(file, size, extension)
+
+
+def decode_base64_chunks(data, start):
+    """
+    Декодирует строку base64 с позиции start частями.
+
+    Строка может быть разбита на строки (base64.encodebytes, MIME),
+    поэтому из части убираются пробельные символы, а хвост, не кратный
+    4 символам, переносится в следующую часть.
+    """
+    rest = ''
+    try:
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[position:position + BASE64_CHUNK_SIZE].split())
+            end = len(chunk) - len(chunk) % 4
+            rest = chunk[end:]
+            yield base64.b64decode(chunk[:end])
+        if rest:
+            base64.b64decode(rest)
+    except (binascii.Error, ValueError) as error:
+        raise ImageError(f'Неверная строка base64: {error}') from error
+
+
+def decode_data_uri(data):
+    """
+    Декодирует картинку из строки data:image/...;base64,... по частям.
+
+    Слишком большая картинка отклоняется по длине строки еще до
+    декодирования, формат проверяется по первой части. Небольшие
+    картинки (до settings.FILE_UPLOAD_MAX_MEMORY_SIZE) декодируются
+    в память, остальные - во временный файл, как обычные загрузки Django.
+    """
+    prefix_end = data.find(BASE64_PREFIX, 0, 100)
+    if prefix_end == -1:
+        raise ImageError('Ожидается строка data:image/...;base64,...')
+    content_type = data[len('data:'):prefix_end]
+    start = prefix_end + len(BASE64_PREFIX)
+    max_size = settings.API_IMAGE_MAX_SIZE
+    # Переводы строк в base64 не считаются.
+    length = len(data) - start - data.count('\n', start)
+    size_estimate = length * 3 // 4
+    if size_estimate > max_size + 2:
+        raise ImageError(f'Картинка больше {max_size} байт.')
+    if size_estimate <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        file = InMemoryUploadedFile(BytesIO(), None, 'image', content_type,
+                                    0, None)
+    else:
+        file = TemporaryUploadedFile('image', content_type, 0, None)
+    try:
+        size, extension = write_image(decode_base64_chunks(data, start),
+                                      file, max_size)
+    except BaseException:
+        file.close()
+        raise
+    return finish(file, size, extension)
+
+
+def fetch_many(urls):
+    """Скачивает картинки параллельно.
+
+    Возвращает {ссылка: файл или ImageError}.
+    """
+    def fetch_or_error(url):
+        try:
+            return url, fetch(url)
+        except ImageError as error:
+            return url, error
+
+    urls = set(urls)
+    if len(urls) == 1:
+        return dict([fetch_or_error(urls.pop())])
+    with ThreadPoolExecutor(settings.API_IMAGE_FETCH_WORKERS) as executor:
+        return dict(executor.map(fetch_or_error, urls))
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.API_IMAGE_FETCH_WORKERS,
+                thread_name_prefix='image-fetch')
+        return _executor
+
+
+def pop_deferred(validated_data, field='image'):
+    """Убирает из данных сериализатора отложенную картинку и возвращает
+    ссылку на нее или None."""
+    if isinstance(validated_data.get(field), DeferredImage):
+        return str(validated_data.pop(field))
+    return None
+
+
+def attach(post_id, url):
+    """Скачивает картинку и сохраняет ее в запись."""
+    try:
+        file = fetch(url)
+    except ImageError as error:
+        logger.warning('Картинка записи %s не загружена: %s', post_id, error)
+        return
+    with file:
+        post = Post.objects.filter(pk=post_id).first()
+        if post is not None:
+            # save() записи запускает сигналы: миниатюры, кэш лент.
+            # Сохраняется только картинка, чтобы не затереть правки,
+            # сделанные, пока она скачивалась.
+            post.image.save(file.name, file, save=False)
+            post.save(update_fields=('image',))
+
+
+def _attach_in_worker(post_id, url):
+    try:
+        attach(post_id, url)
+    except Exception:
+        logger.exception('Не удалось прикрепить картинку к записи %s',
+                         post_id)
+    finally:
+        close_old_connections()
+
+
+def attach_later(post, url):
+    """Загружает картинку в фоне после фиксации транзакции."""
+    transaction.on_commit(
+        lambda: get_executor().submit(_attach_in_worker, post.pk, url))
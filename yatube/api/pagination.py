@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from posts.paginators import CursorPaginator
+
+
+class PostCursorPagination(BasePagination):
+    """
+    Постраничный вывод записей по курсору на ключе (pub_date, id).
+
+    Использует CursorPaginator из posts.paginators: любая страница стоит
+    столько же, сколько первая, COUNT не выполняется. Размер страницы
+    задается параметром limit, но не больше max_page_size.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    date_field = 'pub_date'
+
+    def is_descending(self, request):
+        return True
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = CursorPaginator(queryset, self.get_page_size(request),
+                                    date_field=self.date_field,
+                                    descending=self.is_descending(request))
+        self.page = paginator.get_page(
+            request.query_params.get(self.cursor_query_param))
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True,
+                         'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True,
+                             'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы из ссылок next и previous',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Число записей на странице',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class CommentCursorPagination(PostCursorPagination):
+    """
+    Постраничный вывод комментариев по курсору на ключе (created, id).
+
+    По умолчанию от старых к новым, при ordering=-created - от новых
+    к старым.
+    """
+
+    date_field = 'created'
+    orderings = ('created', '-created')
+
+    def is_descending(self, request):
+        return request.query_params.get('ordering') == '-created'
@@ -1,22 +1,57 @@
-import base64
-import uuid
-
-import requests
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.utils.functional import cached_property
 from rest_framework import serializers
 
+from api import images
 from posts.models import Comment, Follow, Group, Post
 
 
+def fetch_images(items, field='image'):
+    """
+    Загружает картинки по ссылкам из списка объектов параллельно.
+
+    Возвращает копии объектов, в которых ссылки заменены файлами (или
+    ошибками загрузки), чтобы проверка каждого объекта не ждала загрузки.
+    При settings.API_IMAGE_FETCH_DEFERRED ничего не загружает.
+    """
+    if settings.API_IMAGE_FETCH_DEFERRED:
+        return items
+    items = [dict(item) if isinstance(item, dict) else item
+             for item in items]
+    urls = [item[field] for item in items if isinstance(item, dict)
+            and images.is_remote_image(item.get(field))]
+    if not urls:
+        return items
+    files = images.fetch_many(urls)
+    used = set()
+    for item in items:
+        if isinstance(item, dict) and item.get(field) in files:
+            url = item[field]
+            file = files[url]
+            if url in used and not isinstance(file, Exception):
+                # Одна ссылка в нескольких объектах: каждому нужен свой
+                # файл, потому что хранилище забирает файл при сохранении.
+                file.seek(0)
+                file = ContentFile(file.read(), name=file.name)
+            used.add(url)
+            item[field] = file
+    return items
+
+
 class GetImage(serializers.ImageField):
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        elif isinstance(data, str) and data.startswith('https://'):
-            image_data = requests.get(data).content
-            data = ContentFile(image_data, name=str(uuid.uuid4()) + '.jpg')
+        if isinstance(data, Exception):
+            raise serializers.ValidationError(str(data))
+        try:
+            if isinstance(data, str) and data.startswith('data:image'):
+                data = images.decode_data_uri(data)
+            elif images.is_remote_image(data):
+                if settings.API_IMAGE_FETCH_DEFERRED:
+                    return images.DeferredImage(data)
+                data = images.fetch(data)
+        except images.ImageError as error:
+            raise serializers.ValidationError(str(error))
         return super().to_internal_value(data)
 
 
@@ -27,7 +62,120 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = '__all__'
+        exclude = ('text_html', 'thumbnails')
+        read_only_fields = ('excerpt',)
+
+    def create(self, validated_data):
+        url = images.pop_deferred(validated_data)
+        post = super().create(validated_data)
+        if url:
+            images.attach_later(post, url)
+        return post
+
+    def update(self, instance, validated_data):
+        url = images.pop_deferred(validated_data)
+        post = super().update(instance, validated_data)
+        if url:
+            images.attach_later(post, url)
+        return post
+
+
+class PostListSerializer(serializers.BaseSerializer):
+    """
+    Быстрое представление записей для списка, только для чтения.
+
+    Дает те же данные, что и PostSerializer, но собирает их напрямую из
+    атрибутов записи, без построения и обхода полей ModelSerializer.
+    Автор должен быть загружен через select_related.
+
+    Набор полей можно сузить списком context['fields'], а context['include']
+    добавляет связанные данные: group - сообщество вместо его id,
+    comments_count - число комментариев. Записи могут быть загружены
+    только с колонками нужных полей (см. get_columns), обращений к
+    отложенным полям сериализатор не делает.
+    """
+
+    field_names = ('id', 'author', 'image', 'text', 'pub_date', 'excerpt',
+                   'comments_count', 'group')
+    include_names = ('group', 'comments_count')
+    # Колонки модели, нужные каждому полю, для QuerySet.only().
+    columns = {
+        'id': ('id',),
+        'author': ('author', 'author__username'),
+        'image': ('image',),
+        'text': ('text',),
+        'pub_date': ('pub_date',),
+        'excerpt': ('excerpt',),
+        'comments_count': ('comments_count',),
+        'group': ('group',),
+    }
+
+    pub_date_field = serializers.DateTimeField()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.groups = {}
+
+    @classmethod
+    def get_columns(cls, fields, include=()):
+        """Колонки для QuerySet.only() под выбранные поля."""
+        names = {*fields, *include}
+        return sorted({column for name in names
+                       for column in cls.columns[name]})
+
+    @cached_property
+    def getters(self):
+        fields = self.context.get('fields') or self.field_names
+        include = self.context.get('include') or ()
+        names = {*fields, *include}
+        getters = [(name, getattr(self, f'get_{name}'))
+                   for name in self.field_names if name in names]
+        if 'group' in include:
+            getters = [(name, self.get_group_data if name == 'group'
+                        else getter) for name, getter in getters]
+        return getters
+
+    def to_representation(self, post):
+        return {name: getter(post) for name, getter in self.getters}
+
+    def get_id(self, post):
+        return post.pk
+
+    def get_author(self, post):
+        return post.author.username
+
+    def get_image(self, post):
+        if not post.image:
+            return None
+        image = post.image.url
+        request = self.context.get('request')
+        if request is not None:
+            image = request.build_absolute_uri(image)
+        return image
+
+    def get_text(self, post):
+        return post.text
+
+    def get_pub_date(self, post):
+        return self.pub_date_field.to_representation(post.pub_date)
+
+    def get_excerpt(self, post):
+        return post.excerpt
+
+    def get_comments_count(self, post):
+        return post.comments_count
+
+    def get_group(self, post):
+        return post.group_id
+
+    def get_group_data(self, post):
+        # Сообщества загружены одним запросом через prefetch_related,
+        # каждое сериализуется один раз.
+        if post.group_id is None:
+            return None
+        if post.group_id not in self.groups:
+            self.groups[post.group_id] = GroupSerializer(post.group).data
+        return self.groups[post.group_id]
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -42,7 +190,7 @@ class GroupSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Group
-        fields = ('id', 'title', 'description')
+        fields = ('id', 'title', 'description', 'posts_count')
 
 
 class GroupDetailSerializer(serializers.ModelSerializer):
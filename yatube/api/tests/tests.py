@@ -1,13 +1,28 @@
+import base64
+import gzip
+import json
 import shutil
 import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import override_settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
+from api import images
+from posts import catalogue
 from posts.models import Comment, Follow, Group, Post
 
 User = get_user_model()
@@ -257,3 +272,382 @@ class TestMyAPI(APITestCase):
         post = Post.objects.first()
         self.assertTrue(post.image.path)
         self.assertEqual(Post.objects.count(), 2)
+
+    def test_post_search(self):
+        """Поиск записей работает по тексту и имени автора."""
+        post = Post.objects.create(text='Ёжик в тумане', author=self.admin)
+        url = reverse('api:post-list')
+        for query in ('ежик', 'ТУМ', 'admin'):
+            with self.subTest(query=query):
+                response = self.anon_client.get(url, {'search': query})
+                self.assertEqual(
+                    [item['id'] for item in response.json()['results']],
+                    [post.id])
+
+    def test_post_list_cursor_pagination(self):
+        """Список записей выводится по курсору, число запросов не зависит
+        от числа записей на странице."""
+        Post.objects.bulk_create(
+            Post(text=f'post_{i}', author=self.admin) for i in range(7))
+        url = reverse('api:post-list')
+        with self.assertNumQueries(1):
+            response = self.anon_client.get(url)
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), settings.REST_FRAMEWORK[
+            'PAGE_SIZE'])
+        self.assertEqual(data['results'][0]['author'],
+                         self.admin.username)
+        response = self.anon_client.get(data['next'])
+        ids = [item['id'] for item in data['results']
+               + response.json()['results']]
+        self.assertEqual(
+            ids, list(Post.objects.values_list('id', flat=True)))
+
+        response = self.anon_client.get(url, {'limit': 2, 'offset': 2})
+        self.assertEqual(response.json()['count'], 8)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_post_sparse_fields_and_include(self):
+        """Параметр fields сужает поля ответа и загружаемые колонки,
+        include=group встраивает сообщества одним запросом."""
+        second_group = Group.objects.create(title='second', slug='second',
+                                            description='second')
+        Post.objects.bulk_create(
+            Post(text=f'post_{i}', author=self.admin,
+                 group=(self.group, second_group)[i % 2])
+            for i in range(4))
+        url = reverse('api:post-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.anon_client.get(url, {'fields': 'id,excerpt'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"text"', queries[0]['sql'])
+        for item in response.json()['results']:
+            self.assertEqual(set(item), {'id', 'excerpt'})
+        with self.assertNumQueries(2):
+            response = self.anon_client.get(
+                url, {'fields': 'id', 'include': 'group,comments_count'})
+        results = response.json()['results']
+        self.assertEqual(set(results[0]), {'id', 'group', 'comments_count'})
+        self.assertEqual(results[0]['group']['title'], second_group.title)
+        self.assertIsNone(results[-1]['group'])
+        response = self.anon_client.get(
+            reverse('api:post-detail', kwargs={'pk': self.post.id}),
+            {'fields': 'id,author'})
+        self.assertEqual(response.json(),
+                         {'id': self.post.id, 'author': self.user.username})
+        response = self.anon_client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conditional_get_for_posts_groups_and_comments(self):
+        """Списки и объекты API отдают 304, пока данные не менялись."""
+        urls = (
+            reverse('api:post-list'),
+            reverse('api:post-detail', kwargs={'pk': self.post.id}),
+            reverse('api:group-list'),
+            reverse('api:comment-list', kwargs={'post_id': self.post.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.anon_client.get(url)['ETag']
+                response = self.anon_client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 status.HTTP_304_NOT_MODIFIED)
+        url = reverse('api:comment-list', kwargs={'post_id': self.post.id})
+        etag = self.anon_client.get(url)['ETag']
+        Comment.objects.create(text='new', post=self.post, author=self.user)
+        response = self.anon_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_post_list_etag_changes_with_comments_count(self):
+        """Новый комментарий меняет comments_count, и список записей
+        отдается заново."""
+        url = reverse('api:post-list')
+        etag = self.anon_client.get(url)['ETag']
+        sparse_etag = self.anon_client.get(url, {'fields': 'id'})['ETag']
+        Comment.objects.create(text='new', post=self.post, author=self.user)
+        response = self.anon_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.anon_client.get(url, {'fields': 'id'},
+                                        HTTP_IF_NONE_MATCH=sparse_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_comment_list_paginated_by_cursor(self):
+        """Комментарии выводятся по курсору в обоих направлениях, для
+        несуществующей записи - 404."""
+        url = reverse('api:comment-list', kwargs={'post_id': self.post.id})
+        for number in range(3):
+            Comment.objects.create(text=f'comment_{number}', post=self.post,
+                                   author=self.user)
+        ids = list(self.post.comments.order_by('created', 'id')
+                   .values_list('id', flat=True))
+        first = self.anon_client.get(url, {'limit': 2}).json()
+        self.assertEqual([item['id'] for item in first['results']], ids[:2])
+        self.assertIsNone(first['previous'])
+        second = self.anon_client.get(first['next']).json()
+        self.assertEqual([item['id'] for item in second['results']],
+                         ids[2:])
+        self.assertIsNone(second['next'])
+        newest = self.anon_client.get(
+            url, {'limit': 2, 'ordering': '-created'}).json()
+        self.assertEqual([item['id'] for item in newest['results']],
+                         ids[:-3:-1])
+        response = self.anon_client.get(
+            reverse('api:comment-list', kwargs={'post_id': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_streams_ndjson(self):
+        """Выгрузка доступна администратору, отдается потоком и
+        начинается после водяного знака."""
+        url = reverse('api:export')
+        response = self.user_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        first = Post.objects.create(text='first', author=self.user)
+        second = Post.objects.create(text='second', author=self.user,
+                                     group=self.group)
+        response = self.admin_client.get(
+            url, {'types': 'post', 'after': f'post:{first.id}'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(
+            response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{
+            'type': 'post', 'id': second.id, 'author': self.user.username,
+            'group': self.group.slug, 'text': 'second', 'image': '',
+            'pub_date': second.pub_date.isoformat(),
+        }])
+        response = self.admin_client.get(url, {'gzip': '1'})
+        lines = gzip.decompress(
+            b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), Post.objects.count()
+                         + Comment.objects.count())
+        response = self.admin_client.get(url, {'after': 'post:x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_group_list_served_from_catalogue(self):
+        """Список сообществ отдается из каталога без запросов к базе и
+        обновляется при изменении сообщества."""
+        # Снимок мог остаться от данных, откаченных в других тестах.
+        catalogue.invalidate()
+        url = reverse('api:group-list')
+        self.anon_client.get(url)
+        with self.assertNumQueries(0):
+            response = self.anon_client.get(url)
+        self.assertEqual(response.json(), [{
+            'id': self.group.id, 'title': self.group.title,
+            'description': self.group.description, 'posts_count': 0,
+        }])
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'new_title'
+        group.save(update_fields=('title',))
+        data = self.anon_client.get(url).json()
+        self.assertEqual(data[0]['title'], 'new_title')
+        response = self.anon_client.get(url, {'search': 'nothing'})
+        self.assertEqual(response.json(), [])
+
+    def test_group_posts_count_refreshed_without_invalidation(self):
+        """Новая запись не сбрасывает каталог, а счетчик записей в списке
+        и ETag обновляются после перечитывания счетчиков."""
+        catalogue.invalidate()
+        url = reverse('api:group-list')
+        etag = self.anon_client.get(url)['ETag']
+        snapshot = catalogue.get_catalogue()
+        Post.objects.create(text='post', author=self.user, group=self.group)
+        with override_settings(GROUP_CATALOGUE_CHECK_INTERVAL=0):
+            self.assertIs(catalogue.get_catalogue(), snapshot)
+        with override_settings(GROUP_CATALOGUE_CHECK_INTERVAL=0,
+                               GROUP_POSTS_COUNT_INTERVAL=0):
+            response = self.anon_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['posts_count'], 1)
+
+    def test_bulk_create_posts_and_comments(self):
+        """Записи и комментарии создаются списком за один запрос; если
+        хотя бы один объект неверен, ничего не создается."""
+        url = reverse('api:post-bulk')
+        data = [{'text': 'bulk_1', 'group': self.group.id}, {'text': ''}]
+        response = self.user_client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['errors'][0], {})
+        self.assertIn('text', response.json()['errors'][1])
+        self.assertEqual(Post.objects.count(), 1)
+
+        data[1]['text'] = 'bulk_2'
+        response = self.user_client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.json()
+        self.assertEqual([item['text'] for item in created],
+                         ['bulk_1', 'bulk_2'])
+        post = Post.objects.get(pk=created[0]['id'])
+        self.assertEqual(post.text, 'bulk_1')
+        self.assertTrue(post.text_html)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+
+        response = self.user_client.post(
+            reverse('api:comment-bulk', kwargs={'post_id': post.id}),
+            [{'text': 'comment_1'}, {'text': 'comment_2'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 2)
+
+        response = self.anon_client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Локальная замена стороннего сервера с картинками."""
+
+    png = None
+
+    def do_GET(self):
+        if self.path == '/slow.png':
+            time.sleep(1)
+        if self.path == '/page.html':
+            body, content_type = b'<html></html>', 'text/html'
+        elif self.path == '/fake.png':
+            body, content_type = b'not an image at all', 'image/png'
+        else:
+            body, content_type = self.png, 'image/png'
+        if self.path == '/big.png':
+            body += b'\0' * 2048
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   API_IMAGE_URL_SCHEMES=('http', 'https'),
+                   API_IMAGE_MAX_SIZE=1024,
+                   API_IMAGE_FETCH_TIMEOUT=(1, 0.3))
+class TestImageFetch(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with BytesIO() as output:
+            Image.new('RGB', (4, 4)).save(output, 'PNG')
+            ImageHandler.png = output.getvalue()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+        cls.user = User.objects.create_user(username='user')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_fetch_checks_type_size_and_timeout(self):
+        """Картинка скачивается во временный файл; страницы, подделки,
+        большие и медленные ответы отклоняются."""
+        with images.fetch(f'{self.base_url}/image.png') as file:
+            self.assertTrue(file.name.endswith('.png'))
+            self.assertEqual(file.size, len(ImageHandler.png))
+        for path in ('page.html', 'fake.png', 'big.png', 'slow.png'):
+            with self.subTest(path=path):
+                with self.assertRaises(images.ImageFetchError):
+                    images.fetch(f'{self.base_url}/{path}')
+
+    def test_fetch_many_returns_errors(self):
+        """Подделки и большие картинки в пачке - ошибки своих ссылок,
+        а не исключение всей пачки."""
+        urls = [f'{self.base_url}/{path}' for path in ('fake.png', 'big.png')]
+        files = images.fetch_many(urls)
+        for url in urls:
+            self.assertIsInstance(files[url], images.ImageFetchError)
+
+    def test_bulk_posts_fetch_images_concurrently(self):
+        """В пачке записей картинки скачиваются до проверки, ошибка
+        загрузки относится к своему объекту."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('api:post-bulk')
+        data = [{'text': 'one', 'image': f'{self.base_url}/image.png'},
+                {'text': 'two', 'image': f'{self.base_url}/page.html'}]
+        response = client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.json()['errors'][1])
+
+        data[1]['image'] = data[0]['image']
+        response = client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 2)
+
+    @override_settings(API_IMAGE_FETCH_DEFERRED=True)
+    def test_deferred_image_attached_after_commit(self):
+        """В отложенном режиме запись создается без картинки, картинка
+        прикрепляется после загрузки."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.post(
+                reverse('api:post-list'),
+                {'text': 'deferred', 'image': f'{self.base_url}/image.png'},
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post = Post.objects.get(pk=response.json()['id'])
+        self.assertFalse(post.image)
+        self.assertEqual(len(callbacks), 1)
+        images.attach(post.pk, f'{self.base_url}/image.png')
+        post.refresh_from_db()
+        self.assertTrue(post.image.name.endswith('.png'))
+
+
+@override_settings(API_IMAGE_MAX_SIZE=4096)
+class TestDecodeDataUri(SimpleTestCase):
+    @staticmethod
+    def make_data_uri(size):
+        with BytesIO() as output:
+            Image.new('RGB', size).save(output, 'BMP')
+            data = base64.b64encode(output.getvalue()).decode()
+        return f'data:image/bmp;base64,{data}'
+
+    def test_small_image_decoded_in_memory(self):
+        """Небольшая картинка декодируется в память."""
+        with images.decode_data_uri(self.make_data_uri((8, 8))) as file:
+            self.assertIsInstance(file, InMemoryUploadedFile)
+            self.assertTrue(file.name.endswith('.bmp'))
+            self.assertEqual(file.read(2), b'BM')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_large_image_decoded_to_temporary_file(self):
+        """Большая картинка декодируется во временный файл по частям."""
+        with patch.object(images, 'BASE64_CHUNK_SIZE', 64):
+            file = images.decode_data_uri(self.make_data_uri((16, 16)))
+        with file:
+            self.assertIsInstance(file, TemporaryUploadedFile)
+            with Image.open(file.temporary_file_path()) as image:
+                self.assertEqual(image.size, (16, 16))
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_wrapped_base64_decoded(self):
+        """Строка base64 с переводами строк декодируется по частям."""
+        with BytesIO() as output:
+            Image.new('RGB', (16, 16)).save(output, 'BMP')
+            content = output.getvalue()
+        for newline in ('\n', '\r\n'):
+            data = base64.encodebytes(content).decode().replace('\n',
+                                                                newline)
+            with self.subTest(newline=newline):
+                with patch.object(images, 'BASE64_CHUNK_SIZE', 64):
+                    file = images.decode_data_uri(
+                        f'data:image/bmp;base64,{data}')
+                with file:
+                    self.assertEqual(file.read(), content)
+
+    def test_invalid_data_rejected_early(self):
+        """Слишком большие строки и не картинки отклоняются."""
+        text = base64.b64encode(b'just some text here').decode()
+        for data in (self.make_data_uri((64, 64)),
+                     f'data:image/png;base64,{text}',
+                     'data:image/png;base64,###',
+                     self.make_data_uri((8, 8))[:-1]):
+            with self.subTest(data=data[:40]):
+                with self.assertRaises(images.ImageError):
+                    images.decode_data_uri(data)
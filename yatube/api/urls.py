@@ -2,7 +2,8 @@ from django.urls import include, path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from rest_framework.routers import DefaultRouter
 
-from api.views import CommentViewSet, FollowViewSet, GroupViewSet, PostViewSet
+from api.views import (CommentViewSet, FollowViewSet, GroupViewSet,
+                       PostViewSet, export_data)
 
 app_name = 'api'
 
@@ -17,6 +18,7 @@ router_v1.register('follow', FollowViewSet, basename='follow')
 urlpatterns = [
     path('v1/auth/', include('djoser.urls')),
     path('v1/auth/', include('djoser.urls.jwt')),
+    path('v1/export/', export_data, name='export'),
     path('v1/', include(router_v1.urls)),
     path('v1/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('v1/docs/', SpectacularSwaggerView.as_view(url_name='api:schema'),
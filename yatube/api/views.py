@@ -1,20 +1,238 @@
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, mixins, serializers, viewsets
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (OpenApiParameter, extend_schema,
+                                   extend_schema_view)
+from rest_framework import filters, mixins, serializers, status, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from api import images
+from api.filters import PostSearchFilter
+from api.pagination import CommentCursorPagination, PostCursorPagination
 from api.permissions import (AdminOnlyPermission, IsAuthenticatedAuthor,
                              IsAuthorOrReadOnly)
 from api.serializers import (CommentSerializer, FollowSerializer,
                              GroupDetailSerializer, GroupSerializer,
-                             PostSerializer)
+                             PostListSerializer, PostSerializer,
+                             fetch_images)
+from core import export
+from posts import bulk, catalogue
+from posts.cache import make_etag
 from posts.models import Comment, Follow, Group, Post, User
 
 
-class PostViewSet(viewsets.ModelViewSet):
+class ConditionalMixin:
+    """
+    Ответ 304 на list и retrieve, если данные не менялись.
+
+    ETag строится по версиям пространств имен кэша из get_etag_namespaces
+    (см. posts.cache), поэтому проверка не трогает данные ответа. В ETag
+    входит формат ответа, а для браузерного API еще и пользователь:
+    в HTML выводятся его имя и формы.
+    """
+
+    def get_etag_namespaces(self):
+        raise NotImplementedError
+
+    def get_etag_parts(self):
+        """Части ETag, которые не выражаются версиями пространств имен."""
+        return ()
+
+    def get_etag(self, request):
+        namespaces = self.get_etag_namespaces()
+        if namespaces is None:
+            return None
+        renderer_format = request.accepted_renderer.format
+        user = request.user if renderer_format == 'api' else None
+        return quote_etag(make_etag(
+            namespaces, user, (renderer_format, *self.get_etag_parts())))
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class CursorPaginationMixin:
+    """
+    Постраничный вывод по курсору pagination_class, а для запросов,
+    порядок которых курсор не поддерживает, - по limit и offset.
+    """
+
+    def is_cursor_supported(self, params):
+        return 'offset' not in params
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = getattr(self.request, 'query_params', {})
+            if self.is_cursor_supported(params):
+                self._paginator = self.pagination_class()
+            else:
+                self._paginator = LimitOffsetPagination()
+        return self._paginator
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа list и retrieve параметрами fields и include.
+
+    fields=id,excerpt оставляет в ответе только перечисленные поля,
+    и из базы загружаются только их колонки (QuerySet.only()).
+    include=group,comments_count добавляет связанные данные, которые
+    загружаются одним запросом на страницу (prefetch_related).
+    Поля, их колонки и допустимые include описывает sparse_serializer_class
+    (см. PostListSerializer).
+    """
+
+    sparse_serializer_class = None
+    # Колонки, без которых не работает постраничный вывод.
+    required_columns = ()
+    # include, которые загружаются через prefetch_related.
+    prefetch_includes = ()
+
+    def get_query_list(self, param, allowed):
+        params = getattr(self.request, 'query_params', {})
+        names = [name.strip() for name in params.get(param, '').split(',')
+                 if name.strip()]
+        unknown = sorted(set(names) - set(allowed))
+        if unknown:
+            raise serializers.ValidationError(
+                {param: f'Неизвестные значения: {", ".join(unknown)}.'})
+        return names or None
+
+    @cached_property
+    def sparse_fields(self):
+        if self.action not in ('list', 'retrieve'):
+            return None
+        return self.get_query_list(
+            'fields', self.sparse_serializer_class.field_names)
+
+    @cached_property
+    def includes(self):
+        if self.action not in ('list', 'retrieve'):
+            return ()
+        return self.get_query_list(
+            'include', self.sparse_serializer_class.include_names) or ()
+
+    def is_sparse(self):
+        return self.sparse_fields is not None or bool(self.includes)
+
+    def get_serializer_class(self):
+        if self.is_sparse():
+            return self.sparse_serializer_class
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.is_sparse():
+            context.update(fields=self.sparse_fields, include=self.includes)
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.sparse_fields is not None:
+            columns = self.sparse_serializer_class.get_columns(
+                (*self.sparse_fields, *self.required_columns), self.includes)
+            if 'author' not in columns:
+                queryset = queryset.select_related(None)
+            queryset = queryset.only(*columns)
+        prefetch = [name for name in self.includes
+                    if name in self.prefetch_includes]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class BulkCreateMixin:
+    """
+    Массовое создание объектов запросом POST .../bulk/ со списком.
+
+    Все объекты проверяются сериализатором. Если хотя бы один не прошел
+    проверку, ничего не создается, а в ответе 400 по списку errors видно
+    ошибки каждого объекта ({} для верных). Иначе объекты создаются одним
+    bulk_create в транзакции (см. perform_bulk_create), ответ - список
+    созданных объектов в том же порядке.
+    """
+
+    def prepare_items(self, items):
+        return items
+
+    def build_object(self, validated_data):
+        return self.get_serializer_class().Meta.model(**validated_data)
+
+    def perform_bulk_create(self, objects):
+        """Сохраняет объекты. Представления, которым нужно обновить
+        производные данные (счетчики, ленты), переопределяют метод."""
+        return bulk.bulk_insert(type(objects[0]), objects)
+
+    @action(detail=False, methods=('post',))
+    def bulk(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError(
+                'Передайте непустой список объектов.')
+        if len(items) > settings.API_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'За один запрос можно создать не больше '
+                f'{settings.API_BULK_MAX_ITEMS} объектов.')
+        item_serializers = [self.get_serializer(data=item)
+                            for item in self.prepare_items(items)]
+        errors = [{} if serializer.is_valid() else serializer.errors
+                  for serializer in item_serializers]
+        if any(errors):
+            return Response({'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            objects = self.perform_bulk_create(
+                [self.build_object(serializer.validated_data)
+                 for serializer in item_serializers])
+        return Response(self.get_serializer(objects, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+
+SPARSE_PARAMETERS = [
+    OpenApiParameter(
+        'fields', str,
+        description='Поля записи через запятую, например id,excerpt'),
+    OpenApiParameter(
+        'include', str,
+        description='Связанные данные через запятую: group, comments_count'),
+]
+
+
+@extend_schema_view(
+    list=extend_schema(responses=PostSerializer(many=True),
+                       parameters=SPARSE_PARAMETERS),
+    retrieve=extend_schema(parameters=SPARSE_PARAMETERS),
+)
+class PostViewSet(ConditionalMixin, SparseFieldsMixin, CursorPaginationMixin,
+                  BulkCreateMixin, viewsets.ModelViewSet):
     """
     Информация о записях.
 
@@ -22,22 +240,73 @@ class PostViewSet(viewsets.ModelViewSet):
     только аутентифицированный пользователь. Изменять запись может только
     автор. Картинки передаются в строках как ссылки "http://.....", либо
     в формате base64 ""data:image/png;base64....."
+    Несколько записей создаются одним запросом POST на posts/bulk/.
+    Список выводится постранично по курсору (ссылки next и previous).
+    Для поиска и запросов с параметром offset используется постраничный
+    вывод по limit и offset.
+    Параметр fields ограничивает поля ответа, include=group встраивает
+    сообщество записи вместо его id.
     """
 
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('author')
     serializer_class = PostSerializer
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend)
-    search_fields = ('author__username', 'text')
+    filter_backends = (PostSearchFilter, DjangoFilterBackend)
     filterset_fields = ('author__username', 'group')
     ordering_fields = '__all__'
-    pagination_class = LimitOffsetPagination
+    pagination_class = PostCursorPagination
+    sparse_serializer_class = PostListSerializer
+    required_columns = ('id', 'pub_date')
+    prefetch_includes = ('group',)
+
+    def is_cursor_supported(self, params):
+        # Курсор задает порядок по дате, а результаты поиска упорядочены
+        # по релевантности, поэтому их выводим по limit и offset.
+        return (super().is_cursor_supported(params)
+                and PostSearchFilter.search_param not in params)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return PostListSerializer
+        return super().get_serializer_class()
+
+    def get_etag_namespaces(self):
+        # Изменение сообщества сбрасывает 'posts', но не 'post:<id>'.
+        if self.action == 'retrieve' and 'group' not in self.includes:
+            return (f'post:{self.kwargs["pk"]}',)
+        # Комментарии меняют comments_count в списке, но не 'posts',
+        # чтобы не сбрасывать кэш HTML-лент, где число не выводится.
+        fields = {*(self.sparse_fields or ('comments_count',)),
+                  *self.includes}
+        if 'comments_count' in fields:
+            return ('posts', 'comments')
+        return ('posts',)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def prepare_items(self, items):
+        return fetch_images(items)
+
+    def build_object(self, validated_data):
+        url = images.pop_deferred(validated_data)
+        post = super().build_object(validated_data)
+        post.deferred_image_url = url
+        return post
+
+    def perform_bulk_create(self, objects):
+        posts = bulk.create_posts(self.request.user, objects)
+        for post in posts:
+            if post.deferred_image_url:
+                images.attach_later(post, post.deferred_image_url)
+        return posts
+
+
+def render_groups(groups):
+    return JSONRenderer().render(GroupSerializer(groups, many=True).data)
+
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ConditionalMixin, viewsets.ModelViewSet):
     """
     Информация о сообществах.
 
@@ -46,6 +315,8 @@ class GroupViewSet(viewsets.ModelViewSet):
     методы. При запросе списка сообществ загружаются только названия и
     описания сообществ. При запросе детальной информации о сообществе
     загружаются все поля из модели.
+    Список в JSON без поиска отдается готовым из каталога сообществ
+    (см. posts.catalogue).
     """
 
     queryset = Group.objects.all()
@@ -59,13 +330,47 @@ class GroupViewSet(viewsets.ModelViewSet):
             return GroupDetailSerializer
         return GroupSerializer
 
+    def get_etag_namespaces(self):
+        if self.action == 'retrieve':
+            return (f'group:{self.kwargs["pk"]}',)
+        if self.is_catalogue_request():
+            return (catalogue.NAMESPACE,)
+        # Поиск и браузерный API читают счетчики записей из базы, а версия
+        # каталога их изменения не отражает.
+        return None
+
+    def get_etag_parts(self):
+        if self.action == 'list':
+            return (catalogue.get_catalogue().counts_stamp,)
+        return ()
+
+    def is_catalogue_request(self):
+        return (self.request.accepted_renderer.format == 'json'
+                and filters.SearchFilter.search_param
+                not in self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        if self.is_catalogue_request():
+            return self.conditional(self.list_from_catalogue, request)
+        return super().list(request, *args, **kwargs)
+
+    def list_from_catalogue(self, request):
+        content = catalogue.get_catalogue().derive('api:groups',
+                                                   render_groups)
+        return HttpResponse(content, content_type='application/json')
 
-class CommentViewSet(viewsets.ModelViewSet):
+
+class CommentViewSet(ConditionalMixin, CursorPaginationMixin,
+                     BulkCreateMixin, viewsets.ModelViewSet):
     """
     Комментарии к записям.
 
     Комментировать может только авторизованный пользователь.
-    Изменять комментарии может только их автор.
+    Изменять комментарии может только их автор. Несколько комментариев
+    создаются одним запросом POST на comments/bulk/.
+    Список выводится постранично по курсору от старых к новым, при
+    ordering=-created - от новых к старым. Для другого порядка и запросов
+    с параметром offset используется постраничный вывод по limit и offset.
     """
 
     queryset = Comment.objects.none()
@@ -76,17 +381,40 @@ class CommentViewSet(viewsets.ModelViewSet):
     search_fields = ('author__username', 'text', '^created')
     filterset_fields = ('author__username', )
     ordering_fields = '__all__'
-    pagination_class = None
+    ordering = ('created', 'id')
+    pagination_class = CommentCursorPagination
+
+    def is_cursor_supported(self, params):
+        return (super().is_cursor_supported(params)
+                and params.get('ordering', 'created')
+                in CommentCursorPagination.orderings)
+
+    def paginate_queryset(self, queryset):
+        # Запись не запрашивается отдельно: пустая страница бывает и у
+        # записи без комментариев, и у несуществующей записи.
+        page = super().paginate_queryset(queryset)
+        if not page and not Post.objects.filter(
+                pk=self.kwargs['post_id']).exists():
+            raise Http404('Запись не найдена')
+        return page
 
     def perform_create(self, serializer):
         post_id = self.kwargs.get('post_id')
         post = get_object_or_404(Post, id=post_id)
         serializer.save(author=self.request.user, post=post)
 
+    def get_etag_namespaces(self):
+        return (f'post:{self.kwargs["post_id"]}',)
+
+    def perform_bulk_create(self, objects):
+        post = get_object_or_404(Post, id=self.kwargs.get('post_id'))
+        for comment in objects:
+            comment.author = self.request.user
+        return bulk.create_comments(post, objects)
+
     def get_queryset(self):
-        post_id = self.kwargs.get('post_id')
-        post = get_object_or_404(Post, id=post_id)
-        return post.comments.all()
+        return (Comment.objects.filter(post_id=self.kwargs.get('post_id'))
+                .select_related('author'))
 
 
 class FollowViewSet(GenericViewSet,
@@ -125,3 +453,46 @@ class FollowViewSet(GenericViewSet,
             raise serializers.ValidationError(
                 f'Нельзя подписываться на самого себя и создавать'
                 f' одинаковые подписки, {e}')
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            'types', str,
+            description='Типы объектов через запятую: post, comment, '
+                        'message (по умолчанию все)'),
+        OpenApiParameter(
+            'after', str,
+            description='Водяной знак: выгрузить объекты с id больше '
+                        'указанных, например post:120,comment:560'),
+        OpenApiParameter('gzip', bool, description='Сжать выгрузку gzip'),
+    ],
+    responses={(200, 'application/x-ndjson'): OpenApiTypes.STR},
+)
+@api_view(('GET',))
+@permission_classes((IsAdminUser,))
+def export_data(request):
+    """
+    Потоковая выгрузка записей, комментариев и сообщений чата в NDJSON.
+
+    Доступна только администратору. Ответ формируется по мере чтения базы,
+    память сервера не зависит от объема выгрузки (см. core.export).
+    """
+    try:
+        names = export.parse_types(request.query_params.get('types'))
+        watermark = export.parse_watermark(
+            request.query_params.get('after'))
+    except ValueError as error:
+        raise serializers.ValidationError(str(error))
+    content = export.export(names, watermark)
+    filename = 'export.ndjson'
+    content_type = 'application/x-ndjson; charset=utf-8'
+    if request.query_params.get('gzip') in ('1', 'true'):
+        content = export.gzip_stream(content)
+        filename += '.gz'
+        content_type = 'application/gzip'
+    if isinstance(request._request, ASGIRequest):
+        content = export.stream_in_thread(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
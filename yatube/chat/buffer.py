@@ -0,0 +1,183 @@
+"""
+Отложенная запись сообщений чата пачками.
+
+ChatConsumer не ждет записи каждого сообщения в базу: сообщение
+рассылается сразу, а в базу попадает через буфер процесса, который
+сбрасывается одним bulk_create, когда в нем набралось
+settings.CHAT_BUFFER_SIZE сообщений или прошло settings.CHAT_FLUSH_INTERVAL
+секунд с первого сообщения пачки. Автора и группу ChatConsumer
+определяет при подключении, поэтому пачка - это один INSERT.
+
+При settings.CHAT_DURABLE_MESSAGES сообщение рассылается только после
+записи его пачки (add(..., wait=True)), но пачки по-прежнему общие для
+всех соединений процесса.
+
+При остановке сервера буфер сбрасывается, и пачки в работе дописываются
+по событию lifespan.shutdown (см. chat.lifespan). Серверы без lifespan
+(daphne) останавливают цикл событий без него, тогда остаток записывает
+обработчик atexit (MessageBuffer.close).
+"""
+import asyncio
+import atexit
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+
+
+def write_messages(entries):
+    """Записывает сообщения [(id автора, id группы, текст), ...]."""
+    Message.objects.bulk_create(
+        [Message(user_id=user_id, group_id=group_id, text=text)
+         for user_id, group_id, text in entries])
+
+
+class MessageBuffer:
+    """Буфер сообщений одного цикла событий (см. модуль)."""
+
+    def __init__(self, loop, max_size, interval):
+        self.loop = loop
+        self.max_size = max_size
+        self.interval = interval
+        self.entries = []
+        self.waiters = []
+        self.timer = None
+        self.tasks = set()
+
+    def add(self, user_id, group_id, text, wait=False):
+        """
+        Ставит сообщение в очередь на запись.
+
+        При wait возвращает future, который завершается после записи
+        пачки с этим сообщением, иначе None.
+        """
+        self.entries.append((user_id, group_id, text))
+        future = None
+        if wait:
+            future = self.loop.create_future()
+            self.waiters.append(future)
+        if len(self.entries) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.interval, self.flush)
+        return future
+
+    def flush(self):
+        """Запускает запись накопленной пачки в фоне."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.entries:
+            return
+        entries, waiters = self.entries, self.waiters
+        self.entries, self.waiters = [], []
+        task = self.loop.create_task(self.write(entries, waiters))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def write(self, entries, waiters):
+        try:
+            await sync_to_async(write_messages)(entries)
+        except Exception as error:
+            logger.exception('Не удалось записать сообщений чата: %s',
+                             len(entries))
+            for waiter in waiters:
+                resolve(waiter, error)
+        else:
+            for waiter in waiters:
+                resolve(waiter)
+
+    async def aclose(self):
+        """Сбрасывает буфер и дожидается записи всех пачек."""
+        self.flush()
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def adopt(self, previous):
+        """
+        Забирает сообщения буфера другого цикла событий (например, в тестах).
+
+        Ожидающие записи переходят вместе с сообщениями и завершаются
+        в своем цикле (см. resolve). Пачки в работе остаются в старом
+        цикле: если он еще работает, они допишутся там.
+        """
+        if previous.timer is not None:
+            previous.timer.cancel()
+            previous.timer = None
+        entries, waiters = previous.entries, previous.waiters
+        previous.entries, previous.waiters = [], []
+        self.waiters.extend(waiters)
+        for entry in entries:
+            self.add(*entry)
+        if previous.tasks and not previous.loop.is_running():
+            logger.warning('Пачки чата не дописаны в остановленном цикле '
+                           'событий: %s', len(previous.tasks))
+
+    def close(self):
+        """
+        Записывает оставшиеся сообщения, когда цикл событий уже
+        остановлен (atexit).
+
+        Если цикл не закрыт, в нем сначала завершаются пачки в работе.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.tasks and not (self.loop.is_closed()
+                               or self.loop.is_running()):
+            self.loop.run_until_complete(asyncio.gather(
+                *self.tasks, return_exceptions=True))
+        entries, self.entries, self.waiters = self.entries, [], []
+        if entries:
+            try:
+                write_messages(entries)
+            except Exception:
+                logger.exception('Сообщения чата при остановке не '
+                                 'записаны: %s', len(entries))
+
+
+def resolve(waiter, error=None):
+    """Завершает future ожидающего, в том числе из другого цикла событий."""
+    def set_result():
+        if waiter.done():
+            return
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+    loop = waiter.get_loop()
+    if loop.is_closed():
+        # Цикл закрыт, и future уже никто не ждет.
+        return
+    if loop is asyncio.get_running_loop():
+        set_result()
+    else:
+        loop.call_soon_threadsafe(set_result)
+
+
+def get_buffer():
+    """Буфер текущего цикла событий."""
+    global _buffer
+    loop = asyncio.get_running_loop()
+    if _buffer is None or _buffer.loop is not loop:
+        previous = _buffer
+        _buffer = MessageBuffer(loop, settings.CHAT_BUFFER_SIZE,
+                                settings.CHAT_FLUSH_INTERVAL)
+        if previous is None:
+            atexit.register(lambda: _buffer.close())
+        else:
+            _buffer.adopt(previous)
+    return _buffer
+
+
+async def shutdown():
+    """Записывает буфер текущего цикла событий при остановке сервера."""
+    if _buffer is not None and _buffer.loop is asyncio.get_running_loop():
+        await _buffer.aclose()
@@ -2,17 +2,49 @@ import json
 
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 
-from posts.models import Group
+from posts.catalogue import get_catalogue
 
-from .models import Message
+from . import history
+from .buffer import get_buffer
+
+
+def encode_message(message, username, group):
+    """Кадр веб-сокета с сообщением чата."""
+    return json.dumps({
+        'message': message,
+        'username': username,
+        'group': group,
+    })
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Чат группы.
+
+    Автор берется из scope['user'] (AuthMiddlewareStack), группа - из
+    адреса; оба определяются один раз при подключении, имя автора и
+    группа из сообщений клиента не используются. Анонимные пользователи и
+    подключения к несуществующим группам отклоняются.
+
+    Сообщение {'type': 'history', 'before': id, 'limit': n} запрашивает
+    страницу истории до сообщения id (см. chat.history); ответ
+    {'type': 'history', 'messages': [...], 'has_more': ...} получает
+    только запросившее соединение.
+    """
+
+    group_group_name = None
+
     async def connect(self):
-        self.group_name = self.scope['url_route']['kwargs']['group_name']
-        self.group_group_name = 'chat_%s' % self.group_name
+        self.user = self.scope['user']
+        group_name = self.scope['url_route']['kwargs']['group_name']
+        self.group = await self.get_group(group_name)
+        if not self.user.is_authenticated or self.group is None:
+            await self.close()
+            return
+        self.group_group_name = 'chat_%s' % self.group.slug
 
         await self.channel_layer.group_add(
             self.group_group_name,
@@ -21,43 +53,49 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
-    async def disconnect(self):
+    async def disconnect(self, close_code):
+        if self.group_group_name is None:
+            return
         await self.channel_layer.group_discard(
             self.group_group_name,
             self.channel_name
         )
 
+    @sync_to_async
+    def get_group(self, slug):
+        return get_catalogue().by_slug.get(slug)
+
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if data.get('type') == 'history':
+            await self.send_history(data.get('before'), data.get('limit'))
+            return
         message = data['message']
-        username = data['username']
-        group = data['group']
 
-        await self.save_message(username, group, message)
+        # Сообщение записывается в базу пачкой вместе с другими
+        # (см. chat.buffer), а рассылается сразу или, при
+        # CHAT_DURABLE_MESSAGES, после записи своей пачки.
+        saved = get_buffer().add(self.user.pk, self.group.pk, message,
+                                 wait=settings.CHAT_DURABLE_MESSAGES)
+        if saved is not None:
+            await saved
 
+        # Кадр кодируется один раз и через слой каналов доходит до всех
+        # соединений группы готовым (см. chat_message).
         await self.channel_layer.group_send(
             self.group_group_name,
             {
                 'type': 'chat_message',
-                'message': message,
-                'username': username,
-                'group': group,
+                'frame': encode_message(message, self.user.username,
+                                        self.group.slug),
             }
         )
 
-    async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
-        group = event['group']
-
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username,
-            'group': group,
-        }))
+    async def send_history(self, before, limit):
+        page = await sync_to_async(history.get_page)(self.group.pk, before,
+                                                     limit)
+        await self.send(text_data=json.dumps({'type': 'history', **page},
+                                             cls=DjangoJSONEncoder))
 
-    @sync_to_async
-    def save_message(self, username, group, message):
-        user = User.objects.get(username=username)
-        group = Group.objects.get(slug=group)
-        Message.objects.create(user=user, group=group, text=message)
+    async def chat_message(self, event):
+        await self.send(text_data=event['frame'])
@@ -0,0 +1,63 @@
+"""
+История сообщений чата страницами.
+
+Клиент запрашивает страницу сообщений до сообщения с известным id
+(before), первая страница - последние сообщения группы. Страница
+выбирается по индексу (group, date_added, id): условие
+(date_added, id) < (date_added и id сообщения before) и обратный
+порядок по тем же полям, поэтому любая страница стоит столько же,
+сколько первая, а дата сообщения before берется подзапросом в том же
+запросе. Условие записано диапазоном по дате с исключением, как в
+posts.paginators.CursorPaginator: с OR SQLite не сужает индекс по дате.
+Размер страницы ограничен settings.CHAT_HISTORY_MAX_PAGE_SIZE.
+
+Страница отдается и через веб-сокет (ChatConsumer, {'type': 'history'}),
+и в JSON (chat:group_chat_history) в одном виде: сообщения по
+возрастанию даты и признак has_more.
+"""
+from django.conf import settings
+from django.db.models import Q, Subquery
+
+from .models import Message
+
+FIELDS = ('id', 'text', 'date_added', 'username')
+
+
+def parse_int(value):
+    """Положительное целое из параметра клиента или None."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def get_page_size(limit=None):
+    limit = parse_int(limit) or settings.CHAT_HISTORY_PAGE_SIZE
+    return min(limit, settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+
+
+def get_page(group_id, before=None, limit=None):
+    """
+    Страница сообщений группы до сообщения before.
+
+    Возвращает {'messages': [{'id', 'text', 'date_added', 'username'},
+    ...], 'has_more': есть ли сообщения раньше}. Сообщения идут по
+    возрастанию даты.
+    """
+    limit = get_page_size(limit)
+    before = parse_int(before)
+    messages = Message.objects.filter(group_id=group_id)
+    if before is not None:
+        date_added = Subquery(Message.objects.filter(pk=before)
+                              .values('date_added')[:1])
+        messages = messages.filter(
+            Q(date_added__lte=date_added)
+            & ~Q(date_added=date_added, pk__gte=before))
+    rows = list(messages.order_by('-date_added', '-pk')
+                .values_list('id', 'text', 'date_added', 'user__username')
+                [:limit + 1])
+    return {
+        'messages': [dict(zip(FIELDS, row)) for row in reversed(rows[:limit])],
+        'has_more': len(rows) > limit,
+    }
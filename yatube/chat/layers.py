@@ -0,0 +1,370 @@
+"""
+Слой каналов channels для нескольких процессов на одном сервере без Redis.
+
+Сообщения и участники групп хранятся в общей базе SQLite в режиме WAL
+(обязательный параметр path в CONFIG), которую открывают все процессы
+daphne. Каталог базы должен быть доступен только пользователю, от
+которого запущен проект, поэтому общий временный каталог не подходит:
+другой пользователь может заранее создать там базу. Каждый процесс
+обращается к базе из одного своего потока, цикл событий запросами не
+блокируется.
+
+Каналы процесса (new_channel, имена вида specific.<процесс>!<канал>)
+читает один опрос на процесс: он забирает все строки своего процесса
+и раскладывает сообщения по очередям каналов в памяти. group_send пишет
+одну строку на процесс с участниками группы, а не строку на каждого
+участника, поэтому рассылка в большую группу - несколько вставок.
+Обычные каналы (без '!') опрашиваются каждый своим receive. Пока
+сообщения идут, опрос повторяется сразу, без них пауза растет до
+poll_interval секунд - это верхняя граница задержки доставки.
+
+Поведение как у слоев из спецификации channels: сообщение живет expiry
+секунд, участие в группе - group_expiry секунд с последнего group_add;
+send в заполненный канал (capacity, channel_capacity) бросает ChannelFull,
+а group_send заполненные каналы пропускает. Сообщения - словари из
+JSON-типов и bytes.
+"""
+import asyncio
+import base64
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+# inbox - канал или, для каналов процесса, общая часть имени до '!'.
+# Строка group_send для каналов процесса: channel пустой, group_name
+# указывает, каким участникам группы в процессе ее доставить.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    inbox TEXT NOT NULL,
+    channel TEXT,
+    group_name TEXT,
+    expires REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_inbox_idx ON message (inbox, id);
+CREATE TABLE IF NOT EXISTS membership (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    inbox TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+"""
+BYTES_KEY = '__bytes__'
+# Сколько строк забирает за раз опрос каналов процесса.
+READ_BATCH_SIZE = 500
+# Как часто удаляются просроченные сообщения и участники групп, секунд.
+CLEANUP_INTERVAL = 10
+
+
+def encode_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {BYTES_KEY: base64.b64encode(value).decode()}
+    raise TypeError(f'{type(value).__name__} нельзя передать через слой '
+                    f'каналов.')
+
+
+def decode_bytes(value):
+    if len(value) == 1 and BYTES_KEY in value:
+        return base64.b64decode(value[BYTES_KEY])
+    return value
+
+
+def encode(message):
+    return json.dumps(message, default=encode_bytes, separators=(',', ':'))
+
+
+def decode(data):
+    return json.loads(data, object_hook=decode_bytes)
+
+
+@contextmanager
+def immediate(connection):
+    """Транзакция, которая сразу берет блокировку записи."""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """Слой каналов поверх общей базы SQLite (см. модуль)."""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, poll_interval=0.01,
+                 busy_timeout=5):
+        super().__init__(expiry=expiry, capacity=capacity,
+                         channel_capacity=channel_capacity)
+        if not path:
+            raise ImproperlyConfigured(
+                'Укажите path базы SQLiteChannelLayer в CONFIG '
+                'CHANNEL_LAYERS (см. chat.layers).')
+        self.path = path
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.busy_timeout = busy_timeout
+        self.client = uuid.uuid4().hex
+        self.inboxes = set()
+        # База доступна только из этого потока.
+        self.executor = ThreadPoolExecutor(
+            1, thread_name_prefix='channel-layer')
+        self.connection = None
+        self.cleaned = 0.0
+        self.loop = None
+        self.queues = {}
+        self.reader = None
+
+    # Запросы к базе, выполняются в потоке слоя.
+
+    def get_connection(self):
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def insert(self, channel, data, capacity):
+        connection = self.get_connection()
+        now = time.time()
+        inbox = self.non_local_name(channel)
+        with immediate(connection):
+            count, = connection.execute(
+                'SELECT COUNT(*) FROM message WHERE inbox = ? '
+                'AND channel = ? AND expires > ?',
+                (inbox, channel, now)).fetchone()
+            if count >= capacity:
+                return False
+            connection.execute(
+                'INSERT INTO message (inbox, channel, expires, data) '
+                'VALUES (?, ?, ?, ?)', (inbox, channel, now + self.expiry,
+                                        data))
+        return True
+
+    def insert_group(self, group, data):
+        connection = self.get_connection()
+        now = time.time()
+        expires = now + self.expiry
+        with immediate(connection):
+            # Каналы процессов: одна строка на процесс.
+            connection.execute(
+                'INSERT INTO message (inbox, group_name, expires, data) '
+                'SELECT DISTINCT inbox, ?, ?, ? FROM membership '
+                'WHERE group_name = ? AND expires > ? AND inbox != channel',
+                (group, expires, data, group, now))
+            # Обычные каналы: строка на канал, если в нем есть место.
+            channels = connection.execute(
+                'SELECT channel FROM membership WHERE group_name = ? '
+                'AND expires > ? AND inbox = channel', (group, now))
+            for channel, in channels.fetchall():
+                count, = connection.execute(
+                    'SELECT COUNT(*) FROM message WHERE inbox = ? '
+                    'AND expires > ?', (channel, now)).fetchone()
+                if count < self.get_capacity(channel):
+                    connection.execute(
+                        'INSERT INTO message (inbox, channel, expires, '
+                        'data) VALUES (?, ?, ?, ?)',
+                        (channel, channel, expires, data))
+
+    def pop(self, channel):
+        """Забирает первое сообщение обычного канала."""
+        connection = self.get_connection()
+        while True:
+            row = connection.execute(
+                'SELECT id, data FROM message WHERE inbox = ? '
+                'AND expires > ? ORDER BY id LIMIT 1',
+                (channel, time.time())).fetchone()
+            if row is None:
+                return None
+            # Сообщение могли забрать из другого процесса.
+            deleted = connection.execute('DELETE FROM message WHERE id = ?',
+                                         (row[0],))
+            if deleted.rowcount:
+                return decode(row[1])
+
+    def fetch(self, inboxes):
+        """Забирает сообщения каналов процесса: [(канал, срок, данные)]."""
+        connection = self.get_connection()
+        now = time.time()
+        self.cleanup(now)
+        placeholders = ', '.join('?' * len(inboxes))
+        rows = connection.execute(
+            f'SELECT id, inbox, channel, group_name, expires, data '
+            f'FROM message WHERE inbox IN ({placeholders}) '
+            f'ORDER BY id LIMIT ?', (*inboxes, READ_BATCH_SIZE)).fetchall()
+        if not rows:
+            return []
+        # Строки пишутся по возрастанию id, а читает их только этот
+        # процесс, поэтому все строки до последней прочитанной - его.
+        connection.execute(
+            f'DELETE FROM message WHERE inbox IN ({placeholders}) '
+            f'AND id <= ?', (*inboxes, rows[-1][0]))
+        deliveries = []
+        members = {}
+        for _, inbox, channel, group, expires, data in rows:
+            if expires <= now:
+                continue
+            if channel is not None:
+                deliveries.append((channel, expires, data))
+                continue
+            if (group, inbox) not in members:
+                members[group, inbox] = [channel for channel, in (
+                    connection.execute(
+                        'SELECT channel FROM membership WHERE '
+                        'group_name = ? AND inbox = ? AND expires > ?',
+                        (group, inbox, now)))]
+            deliveries.extend((channel, expires, data)
+                              for channel in members[group, inbox])
+        return deliveries
+
+    def cleanup(self, now):
+        if now - self.cleaned < CLEANUP_INTERVAL:
+            return
+        self.cleaned = now
+        connection = self.get_connection()
+        connection.execute('DELETE FROM message WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM membership WHERE expires <= ?',
+                           (now,))
+
+    def execute(self, sql, parameters=()):
+        self.get_connection().execute(sql, parameters)
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args)
+
+    # Каналы.
+
+    def check_loop(self):
+        # Очереди и опрос привязаны к циклу событий; при смене цикла
+        # (например, в тестах) начинаем заново.
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop, self.queues, self.reader = loop, {}, None
+
+    async def new_channel(self, prefix='specific'):
+        self.check_loop()
+        inbox = f'{prefix}.{self.client}!'
+        self.inboxes.add(inbox)
+        channel = inbox + uuid.uuid4().hex
+        self.queues[channel] = asyncio.Queue()
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        if not await self.run(self.insert, channel, encode(message),
+                              self.get_capacity(channel)):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        # valid_channel_name(..., receive=True) ждет только общую часть
+        # имени до '!', а здесь читается конкретный канал процесса.
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        self.check_loop()
+        if '!' not in channel:
+            return await self.receive_polling(channel)
+        queue = self.queues.setdefault(channel, asyncio.Queue())
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.ensure_future(self.read())
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires > time.time():
+                    return message
+        except asyncio.CancelledError:
+            # Канал больше не читают: потребитель завершился.
+            self.queues.pop(channel, None)
+            raise
+
+    async def receive_polling(self, channel):
+        delay = 0
+        while True:
+            message = await self.run(self.pop, channel)
+            if message is not None:
+                return message
+            delay = min(max(delay * 2, 0.001), self.poll_interval)
+            await asyncio.sleep(delay)
+
+    async def read(self):
+        """Раскладывает сообщения каналов процесса по очередям, пока их
+        кто-то читает."""
+        delay = 0
+        while self.queues:
+            try:
+                deliveries = await self.run(self.fetch, tuple(self.inboxes))
+            except sqlite3.Error:
+                logger.exception('Не удалось прочитать сообщения каналов')
+                deliveries = []
+            self.deliver(deliveries)
+            if deliveries:
+                delay = 0
+                await asyncio.sleep(0)
+                continue
+            delay = min(max(delay * 2, 0.001), self.poll_interval)
+            await asyncio.sleep(delay)
+
+    def deliver(self, deliveries):
+        # Одна строка group_send декодируется один раз на процесс.
+        decoded = {}
+        for channel, expires, data in deliveries:
+            queue = self.queues.get(channel)
+            if queue is None:
+                continue
+            if queue.qsize() >= self.get_capacity(channel):
+                logger.debug('Канал %s заполнен, сообщение пропущено',
+                             channel)
+                continue
+            if data not in decoded:
+                decoded[data] = decode(data)
+            queue.put_nowait((expires, dict(decoded[data])))
+
+    # Группы.
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self.run(
+            self.execute,
+            'INSERT OR REPLACE INTO membership (group_name, channel, inbox, '
+            'expires) VALUES (?, ?, ?, ?)',
+            (group, channel, self.non_local_name(channel),
+             time.time() + self.group_expiry))
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self.run(
+            self.execute,
+            'DELETE FROM membership WHERE group_name = ? AND channel = ?',
+            (group, channel))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        await self.run(self.insert_group, group, encode(message))
+
+    async def flush(self):
+        await self.run(self.execute, 'DELETE FROM message')
+        await self.run(self.execute, 'DELETE FROM membership')
+        for queue in self.queues.values():
+            while not queue.empty():
+                queue.get_nowait()
@@ -0,0 +1,19 @@
+"""
+Обработчик протокола ASGI lifespan.
+
+Серверы с поддержкой lifespan (uvicorn, hypercorn) сообщают о запуске
+и остановке приложения. При остановке дописываются отложенные сообщения
+чата (см. chat.buffer).
+"""
+from . import buffer
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await buffer.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.consumers import ChatConsumer, encode_message
+
+
+class PerSocketConsumer(ChatConsumer):
+    """Прежняя рассылка: каждое соединение кодирует сообщение само."""
+
+    async def chat_message(self, event):
+        await self.send(text_data=json.dumps({
+            'message': event['message'],
+            'username': event['username'],
+            'group': event['group'],
+        }))
+
+
+async def discard(message):
+    pass
+
+
+def make_consumers(consumer_class, count):
+    consumers = [consumer_class() for _ in range(count)]
+    for consumer in consumers:
+        consumer.base_send = discard
+    return consumers
+
+
+async def broadcast_once(consumers, text):
+    event = {'type': 'chat_message',
+             'frame': encode_message(text, 'user', 'group')}
+    for consumer in consumers:
+        await consumer.chat_message(event)
+
+
+async def broadcast_per_socket(consumers, text):
+    event = {'type': 'chat_message', 'message': text, 'username': 'user',
+             'group': 'group'}
+    for consumer in consumers:
+        await consumer.chat_message(event)
+
+
+async def measure(broadcast, consumers, text, repeat):
+    """Процессорное время на одну рассылку, секунд."""
+    start = time.process_time()
+    for _ in range(repeat):
+        await broadcast(consumers, text)
+    return (time.process_time() - start) / repeat
+
+
+class Command(BaseCommand):
+    help = ('Замеряет процессорное время доставки одной рассылки чата '
+            'соединениям группы в зависимости от размера группы: кадр, '
+            'закодированный один раз, против кодирования в каждом '
+            'соединении. Слой каналов и сеть в замер не входят.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,5000',
+                            help='Размеры групп через запятую')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Число рассылок на каждый размер')
+        parser.add_argument('--length', type=int, default=200,
+                            help='Длина сообщения, символов')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        text = ('сообщение ' * (options['length'] // 10 + 1))[
+            :options['length']]
+        results = {}
+        for size in sizes:
+            once = asyncio.run(measure(
+                broadcast_once, make_consumers(ChatConsumer, size), text,
+                options['repeat']))
+            per_socket = asyncio.run(measure(
+                broadcast_per_socket, make_consumers(PerSocketConsumer, size),
+                text, options['repeat']))
+            results[size] = {'encode_once': once,
+                             'encode_per_socket': per_socket}
+            self.stdout.write(
+                f'{size:6} соединений: один кадр {once * 1000:8.2f} мс  '
+                f'кодирование в каждом {per_socket * 1000:8.2f} мс  '
+                f'(x{per_socket / once:.1f})')
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({'length': options['length'],
+                           'repeat': options['repeat'],
+                           'results': results}, file, indent=2)
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from queue import Empty
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import SQLiteChannelLayer
+
+GROUP = 'benchmark'
+
+
+async def receive_messages(path, channels, expected, ready, results,
+                           timeout):
+    layer = SQLiteChannelLayer(path, capacity=expected)
+    names = [await layer.new_channel() for _ in range(channels)]
+    for name in names:
+        await layer.group_add(GROUP, name)
+    ready.put(len(names))
+    latencies = []
+    last = None
+
+    async def receive(name):
+        nonlocal last
+        for _ in range(expected):
+            message = await layer.receive(name)
+            last = time.time()
+            latencies.append(last - message['sent'])
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(receive(name) for name in names)), timeout)
+    except asyncio.TimeoutError:
+        pass
+    results.put((latencies, last))
+
+
+async def send_messages(path, count, size, rate):
+    layer = SQLiteChannelLayer(path)
+    payload = 'x' * size
+    start = time.monotonic()
+    for number in range(count):
+        if rate:
+            delay = start + number / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await layer.group_send(GROUP, {'type': 'chat.message',
+                                       'sent': time.time(),
+                                       'payload': payload})
+
+
+def run_receiver(*args):
+    asyncio.run(receive_messages(*args))
+
+
+def run_sender(*args):
+    asyncio.run(send_messages(*args))
+
+
+def get_percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность и задержку слоя каналов '
+            'chat.layers.SQLiteChannelLayer между несколькими процессами: '
+            'отправители рассылают сообщения в группу, в которую входят '
+            'каналы процессов-получателей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--receivers', type=int, default=4,
+                            help='Число процессов-получателей')
+        parser.add_argument('--channels', type=int, default=50,
+                            help='Число каналов в каждом получателе')
+        parser.add_argument('--senders', type=int, default=2,
+                            help='Число процессов-отправителей')
+        parser.add_argument('--messages', type=int, default=500,
+                            help='Число рассылок каждого отправителя')
+        parser.add_argument('--size', type=int, default=100,
+                            help='Размер сообщения, символов')
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Рассылок в секунду у каждого отправителя, 0 - без паузы')
+        parser.add_argument('--timeout', type=float, default=120,
+                            help='Сколько ждать доставки, секунд')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        expected = options['senders'] * options['messages']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'channels.sqlite3')
+            receivers = [
+                context.Process(target=run_receiver, args=(
+                    path, options['channels'], expected, ready, results,
+                    options['timeout']))
+                for _ in range(options['receivers'])
+            ]
+            for process in receivers:
+                process.start()
+            for _ in receivers:
+                ready.get(timeout=options['timeout'])
+            start = time.time()
+            senders = [
+                context.Process(target=run_sender, args=(
+                    path, options['messages'], options['size'],
+                    options['rate']))
+                for _ in range(options['senders'])
+            ]
+            for process in senders:
+                process.start()
+            received = []
+            try:
+                for _ in receivers:
+                    received.append(results.get(
+                        timeout=options['timeout'] + 10))
+            except Empty:
+                raise CommandError('Получатели не ответили.')
+            for process in senders + receivers:
+                process.join()
+        self.report(options, start, received)
+
+    def report(self, options, start, received):
+        latencies = [latency for values, _ in received for latency in values]
+        if not latencies:
+            raise CommandError('Ни одно сообщение не доставлено.')
+        elapsed = max(last for _, last in received if last) - start
+        expected = (options['senders'] * options['messages']
+                    * options['receivers'] * options['channels'])
+        results = {
+            'delivered': len(latencies),
+            'expected': expected,
+            'elapsed': elapsed,
+            'broadcasts_per_second': (options['senders']
+                                      * options['messages'] / elapsed),
+            'deliveries_per_second': len(latencies) / elapsed,
+            'latency_mean': statistics.mean(latencies),
+            'latency_p50': get_percentile(latencies, 50),
+            'latency_p95': get_percentile(latencies, 95),
+            'latency_p99': get_percentile(latencies, 99),
+            'latency_max': max(latencies),
+        }
+        self.stdout.write(
+            f'доставлено {results["delivered"]} из {expected} '
+            f'за {elapsed:.2f} с: '
+            f'{results["broadcasts_per_second"]:.0f} рассылок/с, '
+            f'{results["deliveries_per_second"]:.0f} доставок/с')
+        self.stdout.write(
+            'задержка, мс: '
+            + '  '.join(f'{name} {results["latency_" + name] * 1000:.1f}'
+                        for name in ('mean', 'p50', 'p95', 'p99', 'max')))
+        if options['output']:
+            report = {'options': {name: options[name] for name in (
+                'receivers', 'channels', 'senders', 'messages', 'size',
+                'rate')}, 'results': results}
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+        if results['delivered'] < expected:
+            raise CommandError('Доставлены не все сообщения.')
@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_auto_20230310_2118'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['group', 'date_added', 'id'], name='message_group_date_idx'),
+        ),
+    ]
@@ -13,6 +13,11 @@ class Message(models.Model):
 
     class Meta:
         ordering = ('-date_added',)
+        indexes = (
+            # Страницы истории чата (см. chat.history).
+            models.Index(fields=('group', 'date_added', 'id'),
+                         name='message_group_date_idx'),
+        )
 
     def __str__(self):
         return str(self.id)
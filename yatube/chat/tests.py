@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.catalogue import get_catalogue
+from posts.models import Group
+
+from . import history
+from . import buffer as message_buffer
+from .buffer import MessageBuffer
+from .layers import SQLiteChannelLayer
+from .lifespan import lifespan
+from .models import Message
+from .routing import websocket_urlpatterns
+
+User = get_user_model()
+
+
+class TestMessageBuffer(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='group', slug='group')
+
+    def test_messages_written_in_batches(self):
+        """Полная пачка записывается одним INSERT, остаток - при закрытии
+        буфера."""
+        async def send():
+            buffer = MessageBuffer(asyncio.get_running_loop(), max_size=3,
+                                   interval=60)
+            saved = [buffer.add(self.user.pk, self.group.pk,
+                                f'message_{number}', wait=True)
+                     for number in range(3)]
+            await asyncio.gather(*saved)
+            buffer.add(self.user.pk, self.group.pk, 'last')
+            return buffer
+
+        with self.assertNumQueries(1):
+            buffer = async_to_sync(send)()
+        self.assertEqual(
+            list(Message.objects.order_by('pk').values_list('text',
+                                                            flat=True)),
+            ['message_0', 'message_1', 'message_2'])
+        buffer.close()
+        self.assertEqual(Message.objects.filter(text='last').count(), 1)
+
+    @override_settings(CHAT_BUFFER_SIZE=10, CHAT_FLUSH_INTERVAL=60)
+    def test_lifespan_shutdown_writes_pending_messages(self):
+        """При остановке сервера дописываются пачка в работе и остаток
+        буфера."""
+        async def run():
+            buffer = message_buffer.get_buffer()
+            saved = buffer.add(self.user.pk, self.group.pk, 'in_flight',
+                               wait=True)
+            buffer.flush()
+            buffer.add(self.user.pk, self.group.pk, 'pending')
+            events = asyncio.Queue()
+            for event in ('lifespan.startup', 'lifespan.shutdown'):
+                events.put_nowait({'type': event})
+            sent = []
+
+            async def send(message):
+                sent.append(message['type'])
+
+            await lifespan({'type': 'lifespan'}, events.get, send)
+            return saved.done(), sent
+
+        saved, sent = async_to_sync(run)()
+        self.assertTrue(saved)
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+        self.assertEqual(
+            set(Message.objects.values_list('text', flat=True)),
+            {'in_flight', 'pending'})
+
+    def test_waiters_follow_messages_to_new_loop(self):
+        """При смене цикла событий ожидающие записи переходят в новый
+        буфер вместе с сообщениями и завершаются в своем цикле."""
+        old_loop = asyncio.new_event_loop()
+        self.addCleanup(old_loop.close)
+        old = MessageBuffer(old_loop, max_size=10, interval=60)
+        saved = old.add(self.user.pk, self.group.pk, 'moved', wait=True)
+
+        async def adopt():
+            buffer = MessageBuffer(asyncio.get_running_loop(), max_size=10,
+                                   interval=60)
+            buffer.adopt(old)
+            await buffer.aclose()
+
+        async_to_sync(adopt)()
+        self.assertIsNone(old_loop.run_until_complete(saved))
+        self.assertEqual(Message.objects.filter(text='moved').count(), 1)
+
+
+class TestSQLiteChannelLayer(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    def test_path_required(self):
+        """Без пути к базе слой не создается."""
+        with self.assertRaises(ImproperlyConfigured):
+            SQLiteChannelLayer()
+
+    def test_group_send_reaches_other_processes(self):
+        """Рассылку получают каналы других экземпляров слоя, кроме
+        покинувших группу; send в заполненный канал отклоняется."""
+        async def exchange():
+            first = SQLiteChannelLayer(self.path, capacity=1)
+            second = SQLiteChannelLayer(self.path, capacity=1)
+            channels = [await first.new_channel(),
+                        await second.new_channel(),
+                        await second.new_channel()]
+            for channel in channels:
+                await first.group_add('chat', channel)
+            await second.group_discard('chat', channels[2])
+            await second.group_send('chat', {'type': 'hello', 'data': b'1'})
+            received = [
+                await asyncio.wait_for(layer.receive(channel), 5)
+                for layer, channel in ((first, channels[0]),
+                                       (second, channels[1]))]
+            await first.send('named', {'type': 'one'})
+            try:
+                await second.send('named', {'type': 'two'})
+            except ChannelFull:
+                received.append('full')
+            received.append(await first.receive('named'))
+            return received
+
+        self.assertEqual(async_to_sync(exchange)(), [
+            {'type': 'hello', 'data': b'1'},
+            {'type': 'hello', 'data': b'1'},
+            'full',
+            {'type': 'one'},
+        ])
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=2, CHAT_HISTORY_MAX_PAGE_SIZE=3)
+class TestHistory(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='group', slug='group')
+        other = Group.objects.create(title='other', slug='other')
+        Message.objects.bulk_create(
+            [Message(user=cls.user, group=cls.group, text=f'message_{number}')
+             for number in range(5)]
+            + [Message(user=cls.user, group=other, text='other')])
+        # Одинаковые даты: порядок внутри даты задает id.
+        Message.objects.update(date_added=timezone.now())
+        cls.ids = list(Message.objects.filter(group=cls.group)
+                       .order_by('pk').values_list('pk', flat=True))
+
+    def get_ids(self, page):
+        return [message['id'] for message in page['messages']]
+
+    def test_pages_before_message(self):
+        """Страницы идут от последних сообщений к ранним, размер
+        страницы ограничен."""
+        with self.assertNumQueries(1):
+            page = history.get_page(self.group.pk)
+        self.assertEqual(self.get_ids(page), self.ids[3:])
+        self.assertTrue(page['has_more'])
+        self.assertEqual(page['messages'][0]['username'], 'user')
+        page = history.get_page(self.group.pk, before=self.ids[3],
+                                limit=100)
+        self.assertEqual(self.get_ids(page), self.ids[:3])
+        self.assertFalse(page['has_more'])
+
+    def test_history_json(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('chat:group_chat_history', args=('group',)),
+            {'before': self.ids[1]})
+        self.assertEqual(self.get_ids(response.json()), self.ids[:1])
+        response = self.client.get(
+            reverse('chat:group_chat_history', args=('unknown',)))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CHAT_DURABLE_MESSAGES=True)
+class TestChatConsumer(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='group', slug='group')
+
+    async def connect(self, user, slug):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f'/ws/chat/{slug}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    def test_author_and_group_taken_from_connection(self):
+        """Автор и группа берутся из подключения, а не из сообщения;
+        анонимы и несуществующие группы отклоняются."""
+        get_catalogue()
+
+        async def chat():
+            _, anonymous = await self.connect(AnonymousUser(), 'group')
+            _, unknown = await self.connect(self.user, 'unknown')
+            communicator, connected = await self.connect(self.user, 'group')
+            await communicator.send_json_to(
+                {'message': 'hello', 'username': 'admin', 'group': 'other'})
+            response = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return anonymous, unknown, connected, response
+
+        anonymous, unknown, connected, response = async_to_sync(chat)()
+        self.assertFalse(anonymous)
+        self.assertFalse(unknown)
+        self.assertTrue(connected)
+        self.assertEqual(response, {'message': 'hello', 'username': 'user',
+                                    'group': 'group'})
+        message = Message.objects.get()
+        self.assertEqual((message.user, message.group, message.text),
+                         (self.user, self.group, 'hello'))
+
+    def test_history_sent_to_requester(self):
+        get_catalogue()
+        Message.objects.create(user=self.user, group=self.group, text='old')
+
+        async def chat():
+            communicator, _ = await self.connect(self.user, 'group')
+            await communicator.send_json_to(
+                {'type': 'history', 'limit': 5})
+            response = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return response
+
+        response = async_to_sync(chat)()
+        self.assertEqual(response['type'], 'history')
+        self.assertEqual([message['text'] for message in response['messages']],
+                         ['old'])
+        self.assertFalse(response['has_more'])
+
+    def broadcast(self):
+        get_catalogue()
+
+        async def chat():
+            sender, _ = await self.connect(self.user, 'group')
+            listener, _ = await self.connect(self.user, 'group')
+            await sender.send_json_to({'message': 'hello'})
+            frames = [await sender.receive_from(),
+                      await listener.receive_from()]
+            await sender.disconnect()
+            await listener.disconnect()
+            return frames
+
+        return async_to_sync(chat)()
+
+    def test_broadcast_frame_sent_unchanged(self):
+        """Рассылка кодируется один раз: все соединения группы получают
+        один и тот же кадр, в том числе через слой каналов SQLite."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sqlite_layer = {'default': {
+            'BACKEND': 'chat.layers.SQLiteChannelLayer',
+            'CONFIG': {'path': os.path.join(directory.name, 'layer.db')},
+        }}
+        for layers in (None, sqlite_layer):
+            with self.subTest(layers=layers):
+                if layers is None:
+                    frames = self.broadcast()
+                else:
+                    with override_settings(CHANNEL_LAYERS=layers):
+                        frames = self.broadcast()
+                    self.assertTrue(os.path.exists(
+                        layers['default']['CONFIG']['path']))
+                self.assertEqual(frames[0], frames[1])
+                self.assertEqual(json.loads(frames[0]), {
+                    'message': 'hello', 'username': 'user',
+                    'group': 'group'})
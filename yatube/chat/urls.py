@@ -7,4 +7,6 @@ app_name = 'chat'
 urlpatterns = [
     path('', views.get_chats_list, name='chats_list'),
     path('<slug:group_slug>/', views.get_group_chat, name='group_chat'),
+    path('<slug:group_slug>/history/', views.get_group_chat_history,
+         name='group_chat_history'),
 ]
@@ -1,25 +1,43 @@
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, render
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
 from django.utils import timezone
 
-from posts.models import Group
+from posts.catalogue import get_catalogue
 from users.models import UserProfile
 
+from . import history
+
 
 @login_required
 def get_chats_list(request):
-    chats_list = Group.objects.all()
+    chats_list = get_catalogue().groups
     return render(request, 'chat/chats_list.html', {'chats_list': chats_list})
 
 
+def get_group_or_404(group_slug):
+    group = get_catalogue().by_slug.get(group_slug)
+    if group is None:
+        raise Http404('Чат не найден')
+    return group
+
+
 @login_required
 def get_group_chat(request, group_slug):
     profile = UserProfile.objects.filter(user=request.user).first()
     time_zone = (timezone.get_current_timezone().zone
                  if not profile else profile.timezone)
-    group = get_object_or_404(Group, slug=group_slug)
-    messages = (group.group_chat.select_related('user').
-                order_by('-date_added')[:20])
-    messages = list(reversed(messages))
-    context = {'messages': messages, 'group': group, 'time_zone': time_zone}
+    group = get_group_or_404(group_slug)
+    page = history.get_page(group.pk)
+    context = {'messages': page['messages'], 'has_more': page['has_more'],
+               'group': group, 'time_zone': time_zone}
     return render(request, 'chat/group_chat.html', context)
+
+
+@login_required
+def get_group_chat_history(request, group_slug):
+    """Страница истории чата до сообщения ?before=<id> в JSON."""
+    group = get_group_or_404(group_slug)
+    return JsonResponse(history.get_page(group.pk,
+                                         request.GET.get('before'),
+                                         request.GET.get('limit')))
@@ -0,0 +1,316 @@
+"""
+Потоковая выгрузка записей, комментариев и сообщений чата в NDJSON
+и загрузка выгрузки обратно.
+
+Каждая строка выгрузки - JSON-объект с полем type (post, comment,
+message) и полями объекта; авторы записаны именами пользователей,
+сообщества - slug. Объекты выбираются пачками по возрастанию id
+(следующая пачка начинается после последнего id предыдущей), строки
+пачки читаются из курсора через iterator(), поэтому память не зависит
+от объема выгрузки, а любая пачка стоит столько же, сколько первая.
+
+Водяной знак {тип: последний выгруженный id} позволяет продолжить
+прерванную выгрузку или выгрузить только новые объекты (параметр after
+в виде post:120,comment:560). Загрузка пропускает объекты с уже
+существующими id, поэтому ее тоже можно повторять.
+"""
+import json
+import threading
+import zlib
+from collections import namedtuple
+from itertools import groupby
+from queue import Full, Queue
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from chat.models import Message
+from posts import bulk, cache
+from posts.models import Comment, Group, Post, User
+
+# Поля строки выгрузки и соответствующие им колонки для values_list().
+ExportType = namedtuple('ExportType', 'model fields columns')
+
+TYPES = {
+    'post': ExportType(
+        Post,
+        ('id', 'author', 'group', 'text', 'image', 'pub_date'),
+        ('id', 'author__username', 'group__slug', 'text', 'image',
+         'pub_date'),
+    ),
+    'comment': ExportType(
+        Comment,
+        ('id', 'post', 'author', 'text', 'created'),
+        ('id', 'post_id', 'author__username', 'text', 'created'),
+    ),
+    'message': ExportType(
+        Message,
+        ('id', 'group', 'user', 'text', 'date_added'),
+        ('id', 'group__slug', 'user__username', 'text', 'date_added'),
+    ),
+}
+
+
+def parse_types(value):
+    """Список типов из строки 'post,comment'; пустая строка - все типы."""
+    names = [name.strip() for name in (value or '').split(',')
+             if name.strip()]
+    unknown = sorted(set(names) - set(TYPES))
+    if unknown:
+        raise ValueError(f'Неизвестные типы: {", ".join(unknown)}.')
+    # Порядок TYPES: комментарии загружаются после своих записей.
+    return [name for name in TYPES if not names or name in names]
+
+
+def parse_watermark(value):
+    """Водяной знак из строки 'post:120,comment:560'."""
+    watermark = {}
+    for part in (value or '').split(','):
+        if not part.strip():
+            continue
+        name, _, last_id = part.partition(':')
+        name = name.strip()
+        if name not in TYPES or not last_id.strip().isdigit():
+            raise ValueError(f'Неверный водяной знак: {part}.')
+        watermark[name] = int(last_id)
+    return watermark
+
+
+def format_watermark(watermark):
+    return ','.join(f'{name}:{last_id}'
+                    for name, last_id in watermark.items())
+
+
+def encode_value(value):
+    # В строках выгрузки из не JSON-типов бывают только даты. В отличие
+    # от DjangoJSONEncoder, isoformat() не отбрасывает микросекунды.
+    return value.isoformat()
+
+
+def iter_rows(name, after=0, chunk_size=None):
+    """Строки объектов типа name с id больше after, по возрастанию id."""
+    export_type = TYPES[name]
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = export_type.model.objects.order_by('pk')
+    while True:
+        rows = (queryset.filter(pk__gt=after)
+                .values_list(*export_type.columns)[:chunk_size])
+        count = 0
+        for row in rows.iterator(chunk_size=chunk_size):
+            count += 1
+            after = row[0]
+            yield dict(zip(export_type.fields, row))
+        if count < chunk_size:
+            return
+
+
+def export(names, watermark=None, chunk_size=None):
+    """
+    Строки NDJSON объектов типов names, по пачке строк в каждой части.
+
+    watermark ({тип: id}) задает, после какого id начинать, и по ходу
+    выгрузки обновляется последними выгруженными id.
+    """
+    watermark = {} if watermark is None else watermark
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = json.JSONEncoder(ensure_ascii=False, default=encode_value)
+    for name in names:
+        lines = []
+        for row in iter_rows(name, watermark.get(name, 0), chunk_size):
+            row['type'] = name
+            lines.append(encoder.encode(row))
+            watermark[name] = row['id']
+            if len(lines) == chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+
+def gzip_stream(chunks):
+    """Сжимает поток строк в gzip по частям."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ThreadedStream:
+    """
+    Части chunks, которые готовит отдельный поток.
+
+    ASGIHandler в Django 3.2 перебирает StreamingHttpResponse прямо
+    в цикле событий, где запросы к базе запрещены. Поток читает базу сам
+    и держит в очереди не больше queue_size частей; если клиент отключился,
+    поток останавливается.
+    """
+
+    done = object()
+
+    def __init__(self, chunks, queue_size=4):
+        self.chunks = chunks
+        self.queue = Queue(queue_size)
+        self.stop = threading.Event()
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce(self):
+        try:
+            for chunk in self.chunks:
+                if not self.put(chunk):
+                    return
+            self.put(self.done)
+        except Exception as error:
+            self.put(error)
+        finally:
+            connections.close_all()
+
+    def __iter__(self):
+        threading.Thread(target=self.produce, name='export',
+                         daemon=True).start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self.done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop.set()
+
+
+def stream_in_thread(chunks, queue_size=4):
+    """Отдает части chunks, которые готовит отдельный поток
+    (см. ThreadedStream)."""
+    return iter(ThreadedStream(chunks, queue_size))
+
+
+def get_existing(model, ids):
+    return set(model.objects.filter(pk__in=ids)
+               .values_list('pk', flat=True))
+
+
+def get_users(names):
+    return {user.username: user
+            for user in User.objects.filter(username__in=set(names))}
+
+
+def get_group_ids(slugs):
+    return dict(Group.objects.filter(slug__in=set(slugs) - {None})
+                .values_list('slug', 'pk'))
+
+
+def import_posts(rows):
+    """Создает записи, возвращает число созданных."""
+    existing = get_existing(Post, [row['id'] for row in rows])
+    rows = [row for row in rows if row['id'] not in existing]
+    authors = get_users(row['author'] for row in rows)
+    group_ids = get_group_ids(row['group'] for row in rows)
+    posts = [
+        Post(pk=row['id'], author=authors[row['author']],
+             group_id=group_ids.get(row['group']), text=row['text'],
+             image=row['image'] or '', pub_date=parse_datetime(
+                 row['pub_date']))
+        for row in rows if row['author'] in authors
+    ]
+    created = 0
+    posts.sort(key=lambda post: post.author_id)
+    for _, author_posts in groupby(posts, key=lambda post: post.author_id):
+        author_posts = list(author_posts)
+        bulk.create_posts(author_posts[0].author, author_posts,
+                          keep_dates=True)
+        created += len(author_posts)
+    return created
+
+
+def import_comments(rows):
+    existing = get_existing(Comment, [row['id'] for row in rows])
+    rows = [row for row in rows if row['id'] not in existing]
+    authors = get_users(row['author'] for row in rows)
+    post_ids = get_existing(Post, [row['post'] for row in rows])
+    comments = [
+        Comment(pk=row['id'], post_id=row['post'],
+                author=authors[row['author']], text=row['text'],
+                created=parse_datetime(row['created']))
+        for row in rows
+        if row['author'] in authors and row['post'] in post_ids
+    ]
+    return len(bulk.insert_comments(comments, keep_dates=True))
+
+
+def import_messages(rows):
+    existing = get_existing(Message, [row['id'] for row in rows])
+    rows = [row for row in rows if row['id'] not in existing]
+    users = get_users(row['user'] for row in rows)
+    group_ids = get_group_ids(row['group'] for row in rows)
+    messages = [
+        Message(pk=row['id'], group_id=group_ids[row['group']],
+                user=users[row['user']], text=row['text'],
+                date_added=parse_datetime(row['date_added']))
+        for row in rows
+        if row['user'] in users and row['group'] in group_ids
+    ]
+    return len(bulk.bulk_insert(Message, messages, keep_dates=True))
+
+
+IMPORTERS = {
+    'post': import_posts,
+    'comment': import_comments,
+    'message': import_messages,
+}
+
+
+def reset_sequences():
+    """Сдвигает последовательности id после вставки с явными id."""
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [export_type.model for export_type in TYPES.values()])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def import_lines(lines, batch_size=None):
+    """
+    Загружает строки NDJSON пачками по batch_size строк одного типа.
+
+    Объекты, чьи id уже есть в базе, и объекты, для которых не нашлись
+    автор, сообщество или запись, пропускаются. Возвращает
+    {тип: (прочитано, создано)}.
+    """
+    batch_size = batch_size or settings.EXPORT_CHUNK_SIZE
+    stats = {name: [0, 0] for name in TYPES}
+    batch, batch_type = [], None
+
+    def flush():
+        if batch:
+            with transaction.atomic():
+                stats[batch_type][1] += IMPORTERS[batch_type](batch)
+
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        name = row.pop('type', None)
+        if name not in TYPES:
+            raise ValueError(f'Неизвестный тип объекта: {name}.')
+        if name != batch_type or len(batch) == batch_size:
+            flush()
+            batch, batch_type = [], name
+        batch.append(row)
+        stats[name][0] += 1
+    flush()
+    reset_sequences()
+    cache.invalidate(cache.GLOBAL_NAMESPACE)
+    return {name: tuple(counts) for name, counts in stats.items()}
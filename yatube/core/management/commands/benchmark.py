@@ -0,0 +1,165 @@
+import json
+import statistics
+import subprocess
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import cache
+from posts.models import Group, Post
+from posts.paginators import CursorPaginator
+
+User = get_user_model()
+
+# Метрики, которые сравниваются с предыдущим запуском.
+COMPARED_METRICS = ('warm_time', 'cold_time', 'queries')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа, число и время SQL-запросов и размер '
+            'ответа основных страниц и API. Данные для замеров создает '
+            'команда generate_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Число повторных запросов к странице')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего запуска для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый относительный рост метрик при сравнении'
+        )
+
+    def get_targets(self):
+        """Возвращает [(название, url, нужна ли авторизация), ...]."""
+        post = Post.objects.order_by('-comments_count').first()
+        group = Group.objects.order_by('-posts_count').first()
+        if post is None or group is None:
+            raise CommandError('Нет данных, запустите generate_data.')
+        word = post.excerpt.split()[0].strip('*') if post.excerpt else 'a'
+        # Середина ленты API: по курсору и по смещению.
+        middle = Post.objects.count() // 2
+        middle_post = Post.objects.order_by('-pub_date', '-id')[middle]
+        cursor = CursorPaginator(Post.objects.none(), 1).encode_cursor(
+            CursorPaginator.NEXT, middle_post)
+        return [
+            ('index', reverse('posts:main'), False),
+            ('index_page_10', reverse('posts:main') + '?page=10', False),
+            ('follow_index', reverse('posts:follow_index'), True),
+            ('profile', reverse('posts:profile',
+                                args=(post.author.username,)), False),
+            ('group_posts', reverse('posts:group_list',
+                                    args=(group.slug,)), False),
+            ('post_detail', reverse('posts:post_detail',
+                                    args=(post.pk,)), False),
+            ('search', reverse('posts:search') + f'?text={word}', False),
+            ('api_posts', reverse('api:post-list'), False),
+            ('api_posts_cursor_middle', reverse('api:post-list')
+             + f'?cursor={cursor}', False),
+            ('api_posts_offset_middle', reverse('api:post-list')
+             + f'?offset={middle}', False),
+            ('api_groups', reverse('api:group-list'), False),
+            ('api_comments', reverse('api:comment-list',
+                                     args=(post.pk,)), False),
+        ]
+
+    def measure(self, client, url):
+        """Выполняет запрос и возвращает его метрики."""
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            wall_time = time.perf_counter() - start
+        if response.status_code != 200:
+            raise CommandError(f'{url}: код ответа {response.status_code}')
+        return {
+            'time': wall_time,
+            'queries': len(queries),
+            'query_time': sum(float(query['time'])
+                              for query in queries.captured_queries),
+            'size': len(response.content),
+        }
+
+    def run_target(self, client, url, repeat):
+        # Первый запрос после сброса кэша показывает худший случай,
+        # остальные - работу с заполненным кэшем.
+        cache.invalidate(cache.GLOBAL_NAMESPACE)
+        cold = self.measure(client, url)
+        warm = [self.measure(client, url) for _ in range(repeat)]
+        return {
+            'url': url,
+            'cold_time': cold['time'],
+            'warm_time': statistics.median(run['time'] for run in warm),
+            'queries': cold['queries'],
+            'warm_queries': max(run['queries'] for run in warm),
+            'query_time': cold['query_time'],
+            'size': cold['size'],
+        }
+
+    def get_revision(self):
+        try:
+            return subprocess.run(
+                ('git', 'rev-parse', '--short', 'HEAD'), capture_output=True,
+                text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, results, path, threshold):
+        """Возвращает список метрик, выросших больше чем на threshold."""
+        with open(path) as file:
+            previous = json.load(file)['results']
+        regressions = []
+        for name, metrics in results.items():
+            for metric in COMPARED_METRICS:
+                old = previous.get(name, {}).get(metric)
+                if not old:
+                    continue
+                change = (metrics[metric] - old) / old
+                if change > threshold:
+                    regressions.append(
+                        f'{name}.{metric}: {old:.4g} -> '
+                        f'{metrics[metric]:.4g} (+{change:.0%})')
+        return regressions
+
+    def handle(self, *args, **options):
+        user = (User.objects.annotate(follows=Count('follower'))
+                .order_by('-follows').first())
+        client = Client()
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+            results = {}
+            for name, url, login in self.get_targets():
+                if login:
+                    client.force_login(user)
+                else:
+                    client.logout()
+                metrics = self.run_target(client, url, options['repeat'])
+                results[name] = metrics
+                self.stdout.write(
+                    f'{name:23} cold {metrics["cold_time"] * 1000:8.1f} ms  '
+                    f'warm {metrics["warm_time"] * 1000:8.1f} ms  '
+                    f'queries {metrics["queries"]:3} '
+                    f'({metrics["query_time"] * 1000:.1f} ms)  '
+                    f'size {metrics["size"]}')
+        report = {
+            'revision': self.get_revision(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'posts': Post.objects.count(),
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+        if options['compare']:
+            regressions = self.compare(results, options['compare'],
+                                       options['threshold'])
+            if regressions:
+                raise CommandError('Ухудшение метрик:\n'
+                                   + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
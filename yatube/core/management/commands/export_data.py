@@ -0,0 +1,53 @@
+import gzip
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+
+
+class Command(BaseCommand):
+    help = ('Выгружает записи, комментарии и сообщения чата в NDJSON '
+            'потоком, пачками по id (см. core.export).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o',
+            help='Файл выгрузки (по умолчанию stdout); для имени с .gz '
+                 'выгрузка сжимается gzip')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Сжать выгрузку gzip')
+        parser.add_argument(
+            '--types', default='',
+            help='Типы объектов через запятую: post, comment, message')
+        parser.add_argument(
+            '--after', default='',
+            help='Водяной знак вида post:120,comment:560: выгрузить '
+                 'объекты с id больше указанных')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Размер пачки строк')
+
+    def open_output(self, path, compress):
+        if path is None:
+            if compress:
+                return gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8')
+            return nullcontext(self.stdout)
+        if compress or path.endswith('.gz'):
+            return gzip.open(path, 'wt', encoding='utf-8')
+        return open(path, 'w', encoding='utf-8')
+
+    def handle(self, *args, **options):
+        try:
+            names = export.parse_types(options['types'])
+            watermark = export.parse_watermark(options['after'])
+        except ValueError as error:
+            raise CommandError(error)
+        with self.open_output(options['output'], options['gzip']) as file:
+            for chunk in export.export(names, watermark,
+                                       options['chunk_size']):
+                file.write(chunk)
+        # Выгрузка может идти в stdout, поэтому итог пишется в stderr.
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгрузка завершена, продолжить с '
+            f'--after {export.format_watermark(watermark)}'))
@@ -0,0 +1,152 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat.models import Message
+from core.text import render_rows
+from posts import bulk, cache, counters, search, timeline
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+WORDS = ('жизнь', 'событие', 'город', 'утро', 'кот', 'друг', 'дорога',
+         'море', 'книга', 'работа', 'вечер', 'ёлка', 'python', 'django',
+         'погода', 'музыка', 'фото', 'поход', 'снег', 'солнце')
+# Число разных текстов записей.
+TEXTS_COUNT = 1000
+
+
+class Command(BaseCommand):
+    help = ('Быстро создает тестовые данные для замеров производительности: '
+            'пользователей, группы, подписки, записи, комментарии и '
+            'сообщения чата.')
+
+    def add_arguments(self, parser):
+        for name, default, help_text in (
+            ('users', 100, 'Число пользователей'),
+            ('groups', 10, 'Число групп'),
+            ('posts', 10000, 'Число записей'),
+            ('follows', 20, 'Число подписок на пользователя'),
+            ('comments', 20000, 'Число комментариев'),
+            ('messages', 5000, 'Число сообщений чата'),
+            ('batch-size', 1000, 'Размер пачки для bulk_create'),
+        ):
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=help_text)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Начальное значение генератора случайных '
+                                 'чисел')
+        parser.add_argument('--prefix', default='bench',
+                            help='Префикс имен пользователей и групп')
+
+    def make_text(self, words):
+        """Случайный текст с разметкой Markdown."""
+        sentences = [' '.join(self.random.choices(WORDS, k=words))
+                     for _ in range(self.random.randint(1, 4))]
+        sentences[0] = f'**{sentences[0]}**'
+        if self.random.random() < 0.3:
+            sentences.append(f'[ссылка](https://example.com/'
+                             f'{self.random.randint(1, 1000)})')
+        return '\n\n'.join(sentences)
+
+    def create_users(self, count, prefix, batch_size):
+        password = make_password(prefix)
+        start = User.objects.count()
+        return User.objects.bulk_create(
+            [User(username=f'{prefix}_user_{start + i}', password=password,
+                  first_name=self.random.choice(WORDS).capitalize())
+             for i in range(count)],
+            batch_size=batch_size
+        )
+
+    def create_groups(self, count, prefix, batch_size):
+        start = Group.objects.count()
+        return Group.objects.bulk_create(
+            [Group(title=f'{prefix} группа {start + i}',
+                   slug=f'{prefix}-group-{start + i}',
+                   description=self.make_text(10))
+             for i in range(count)],
+            batch_size=batch_size
+        )
+
+    def create_follows(self, users, per_user, batch_size):
+        follows = []
+        for user in users:
+            authors = [author for author in self.random.sample(
+                users, min(per_user + 1, len(users))) if author != user]
+            follows.extend(Follow(user=user, author=author)
+                           for author in authors[:per_user])
+        Follow.objects.bulk_create(follows, batch_size=batch_size,
+                                   ignore_conflicts=True)
+
+    def create_posts(self, count, users, groups, batch_size):
+        # Тексты берутся из ограниченного набора, чтобы Markdown
+        # отрисовывался один раз на текст, а не на запись.
+        texts = [self.make_text(self.random.randint(5, 40))
+                 for _ in range(min(count, TEXTS_COUNT))]
+        rendered = render_rows(enumerate(texts), settings.MARKDOWN_EXTENSIONS,
+                               settings.POST_EXCERPT_LENGTH)
+        # Записи создаются и индексируются пачками, чтобы не держать
+        # в памяти миллион объектов.
+        for start in range(0, count, batch_size):
+            posts = []
+            for _ in range(min(batch_size, count - start)):
+                index, text_html, excerpt = self.random.choice(rendered)
+                posts.append(Post(author=self.random.choice(users),
+                                  group=self.random.choice(groups + [None]),
+                                  text=texts[index], text_html=text_html,
+                                  excerpt=excerpt))
+            search.index_posts(bulk.bulk_insert(Post, posts))
+
+    def create_comments(self, count, users, batch_size):
+        post_ids = list(Post.objects.values_list('pk', flat=True))
+        Comment.objects.bulk_create(
+            [Comment(post_id=self.random.choice(post_ids),
+                     author=self.random.choice(users),
+                     text=self.make_text(8))
+             for _ in range(count)],
+            batch_size=batch_size
+        )
+
+    def create_messages(self, count, users, groups, batch_size):
+        Message.objects.bulk_create(
+            [Message(user=self.random.choice(users),
+                     group=self.random.choice(groups),
+                     text=' '.join(self.random.choices(WORDS, k=8)))
+             for _ in range(count)],
+            batch_size=batch_size
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        batch_size, prefix = options['batch_size'], options['prefix']
+        start = time.perf_counter()
+        with transaction.atomic():
+            self.create_users(options['users'], prefix, batch_size)
+            self.create_groups(options['groups'], prefix, batch_size)
+            users = list(User.objects.filter(
+                username__startswith=f'{prefix}_user_'))
+            groups = list(Group.objects.filter(
+                slug__startswith=f'{prefix}-group-'))
+            self.create_follows(users, options['follows'], batch_size)
+            self.create_posts(options['posts'], users, groups, batch_size)
+            self.create_comments(options['comments'], users, batch_size)
+            if groups:
+                self.create_messages(options['messages'], users, groups,
+                                     batch_size)
+            # bulk_create не вызывает сигналы, поэтому производные данные
+            # пересчитываются целиком.
+            timeline.rebuild()
+            counters.reconcile()
+        if connection.vendor == 'sqlite':
+            # Статистика для оценки числа записей (см. estimate_count).
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        cache.invalidate(cache.GLOBAL_NAMESPACE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.perf_counter() - start:.1f} с'))
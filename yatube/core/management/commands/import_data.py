@@ -0,0 +1,46 @@
+import gzip
+import sys
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class Command(BaseCommand):
+    help = ('Загружает выгрузку export_data в NDJSON (можно сжатую gzip). '
+            'Объекты с уже существующими id пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки или - для stdin')
+        parser.add_argument('--batch-size', type=int,
+                            help='Размер пачки для bulk_create')
+
+    @contextmanager
+    def open_input(self, path):
+        if path == '-':
+            file = sys.stdin.buffer
+        else:
+            file = open(path, 'rb')
+        try:
+            if file.peek(2)[:2] == GZIP_MAGIC:
+                with gzip.open(file) as unpacked:
+                    yield unpacked
+            else:
+                yield file
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+    def handle(self, *args, **options):
+        with self.open_input(options['path']) as file:
+            lines = (line.decode('utf-8') for line in file)
+            try:
+                stats = export.import_lines(lines, options['batch_size'])
+            except ValueError as error:
+                raise CommandError(error)
+        for name, (read, created) in stats.items():
+            self.stdout.write(f'{name}: прочитано {read}, создано {created}')
+        self.stdout.write(self.style.SUCCESS('Загрузка завершена'))
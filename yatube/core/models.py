@@ -0,0 +1,28 @@
+"""Общие части моделей приложений."""
+
+
+class ServerFieldsMixin:
+    """
+    Не дает полному save() затирать поля, которые пишет сервер.
+
+    Счетчики меняются выражениями F(), миниатюры пишет фоновый поток,
+    поэтому объект, загруженный раньше, хранит их устаревшие значения.
+    Если save() существующего объекта вызван без update_fields,
+    сохраняются все поля, кроме server_fields и отложенных. При создании
+    объекта и при явном update_fields поля пишутся как обычно.
+    """
+
+    server_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.server_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
@@ -0,0 +1,174 @@
+"""
+Профилирование отдельных запросов по требованию.
+
+ProfilingMiddleware профилирует запрос через cProfile, если он пришел с
+заголовком X-Profile или параметром _profile от пользователя, которому
+это разрешено (см. can_profile). Для каждого запроса в
+settings.PROFILING_ROOT сохраняются два файла с общим именем:
+- <name>.prof - статистика cProfile (pstats, открывается snakeviz и т.п.);
+- <name>.json - сводка: время ответа, SQL-запросы, время отрисовки
+  шаблонов и самые долгие функции.
+Список и файлы доступны администраторам на странице core:profiles.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+NAME_RE = re.compile(r'^[\w-]+$')
+
+_TEMPLATE_RENDER = (
+    Template.render.__code__.co_filename,
+    Template.render.__code__.co_firstlineno,
+    Template.render.__name__,
+)
+
+
+def can_profile(user):
+    """Профилировать разрешено персоналу и пользователям из
+    settings.PROFILING_USERS."""
+    return user.is_authenticated and (
+        user.is_staff or user.username in settings.PROFILING_USERS)
+
+
+class QueryLog:
+    """Обертка execute_wrapper, записывающая SQL-запросы и их время."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'time': time.perf_counter() - start,
+            })
+
+
+def get_template_time(stats):
+    """Суммарное время Template.render из статистики cProfile.
+
+    cProfile не учитывает повторно вложенные вызовы в cumulative time,
+    поэтому include внутри шаблона не считаются дважды.
+    """
+    entry = stats.stats.get(_TEMPLATE_RENDER)
+    return entry[3] if entry else 0.0
+
+
+def get_top_functions(stats, limit):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+def get_profile_path(name, extension):
+    if not NAME_RE.match(name) or extension not in ('prof', 'json'):
+        return None
+    return os.path.join(settings.PROFILING_ROOT, f'{name}.{extension}')
+
+
+def list_profiles():
+    """Возвращает сводки сохраненных профилей, новые первыми."""
+    if not os.path.isdir(settings.PROFILING_ROOT):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(settings.PROFILING_ROOT),
+                           reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(settings.PROFILING_ROOT, filename)) as file:
+            profiles.append(json.load(file))
+    return profiles
+
+
+def remove_old_profiles():
+    """Оставляет только settings.PROFILING_KEEP последних профилей."""
+    names = sorted({os.path.splitext(filename)[0]
+                    for filename in os.listdir(settings.PROFILING_ROOT)},
+                   reverse=True)
+    for name in names[settings.PROFILING_KEEP:]:
+        for extension in ('prof', 'json'):
+            path = get_profile_path(name, extension)
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+class ProfilingMiddleware:
+    """Профилирует запрос, если его об этом попросили (см. модуль).
+
+    Должен стоять после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_requested(self, request):
+        # request.user здесь не трогаем: пользователь загружается лениво,
+        # и его запросы должны попасть в профиль.
+        return (settings.PROFILING_ENABLED
+                and (PROFILE_HEADER in request.META
+                     or PROFILE_PARAM in request.GET))
+
+    def __call__(self, request):
+        if not self.is_requested(request):
+            return self.get_response(request)
+        query_log = QueryLog()
+        wrappers = [connection.execute_wrapper(query_log)
+                    for connection in connections.all()]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        try:
+            if not can_profile(request.user):
+                return self.get_response(request)
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                response = profiler.runcall(self.get_response, request)
+            finally:
+                total_time = time.perf_counter() - start
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+        name = self.save(request, response, profiler, query_log, total_time)
+        response['X-Profile-Id'] = name
+        return response
+
+    def save(self, request, response, profiler, query_log, total_time):
+        os.makedirs(settings.PROFILING_ROOT, exist_ok=True)
+        name = (time.strftime('%Y%m%d-%H%M%S-')
+                + f'{os.getpid()}-{id(request)}')
+        profiler.dump_stats(get_profile_path(name, 'prof'))
+        stats = pstats.Stats(profiler)
+        summary = {
+            'name': name,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'time': total_time,
+            'template_time': get_template_time(stats),
+            'query_count': len(query_log.queries),
+            'query_time': sum(query['time'] for query in query_log.queries),
+            'queries': query_log.queries,
+            'top_functions': get_top_functions(
+                stats, settings.PROFILING_TOP_FUNCTIONS),
+        }
+        with open(get_profile_path(name, 'json'), 'w') as file:
+            json.dump(summary, file, indent=2, ensure_ascii=False)
+        remove_old_profiles()
+        return name
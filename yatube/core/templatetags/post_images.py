@@ -0,0 +1,17 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(post, alias):
+    """Адрес готовой миниатюры картинки записи (см. posts.thumbnails)."""
+    return thumbnails.get_url(post, alias)
+
+
+@register.filter
+def with_thumbnails(posts):
+    """Вычисляет адреса миниатюр сразу для всей страницы записей."""
+    return thumbnails.resolve(list(posts))
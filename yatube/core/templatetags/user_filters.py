@@ -1,7 +1,8 @@
-import markdown
 from django import template
 from django.template.defaultfilters import stringfilter
 
+from core.text import render_markdown
+
 register = template.Library()
 
 
@@ -13,5 +14,10 @@ def addclass(field, css):
 @register.filter
 @stringfilter
 def convert_markdown(value):
-    return markdown.markdown(value,
-                             extensions=['markdown.extensions.fenced_code'])
+    return render_markdown(value)
+
+
+@register.filter
+def post_html(post):
+    """HTML текста записи; отрисовывает его, если он еще не сохранен."""
+    return post.text_html or render_markdown(post.text)
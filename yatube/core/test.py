@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from chat.models import Message
+from core import profiling
+from posts.models import Comment, Post, TimelineEntry
+
+User = get_user_model()
+
+
+class TestBenchmarkCommands(TestCase):
+    def test_generate_data_and_benchmark(self):
+        """generate_data создает данные, benchmark пишет отчет в JSON
+        и сообщает об ухудшении метрик."""
+        call_command('generate_data', users=5, groups=2, posts=30, follows=2,
+                     comments=10, messages=10, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertTrue(TimelineEntry.objects.exists())
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark', repeat=1, output=output,
+                         stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+            self.assertIn('index', report['results'])
+            for metrics in report['results'].values():
+                metrics['queries'] = 1
+            with open(output, 'w') as file:
+                json.dump(report, file)
+            with self.assertRaisesMessage(CommandError, 'queries'):
+                call_command('benchmark', repeat=1, compare=output,
+                             stdout=StringIO())
+
+
+class TestExportCommands(TestCase):
+    SNAPSHOT_FIELDS = {
+        Post: ('id', 'author_id', 'group_id', 'text', 'pub_date'),
+        Comment: ('id', 'post_id', 'author_id', 'text', 'created'),
+        Message: ('id', 'group_id', 'user_id', 'text', 'date_added'),
+    }
+
+    def get_snapshot(self):
+        return {model: list(model.objects.order_by('pk')
+                            .values_list(*fields))
+                for model, fields in self.SNAPSHOT_FIELDS.items()}
+
+    def test_export_and_import_round_trip(self):
+        """export_data выгружает все объекты пачками, import_data
+        восстанавливает их с прежними id и датами, выгрузка после водяного
+        знака пуста."""
+        call_command('generate_data', users=5, groups=2, posts=30, follows=2,
+                     comments=20, messages=10, stdout=StringIO())
+        snapshot = self.get_snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'export.ndjson.gz')
+            stderr = StringIO()
+            call_command('export_data', output=output, chunk_size=7,
+                         stderr=stderr)
+            watermark = stderr.getvalue().split('--after ')[1].strip()
+            Message.objects.all().delete()
+            Post.objects.all().delete()
+            call_command('import_data', output, batch_size=7,
+                         stdout=StringIO())
+        self.assertEqual(self.get_snapshot(), snapshot)
+        post = Post.objects.order_by('-comments_count').first()
+        self.assertEqual(post.comments_count, post.comments.count())
+        stdout = StringIO()
+        call_command('export_data', after=watermark, stdout=stdout,
+                     stderr=StringIO())
+        self.assertEqual(stdout.getvalue(), '')
+
+
+@override_settings(PROFILING_KEEP=1)
+class TestProfilingMiddleware(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='user')
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(
+            PROFILING_ROOT=self.directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+
+    def test_profile_saved_for_staff_only(self):
+        """Запрос с ?_profile профилируется только для разрешенных
+        пользователей, сохраняются .prof и сводка с SQL и шаблонами."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('posts:main') + '?_profile=1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        # Первый запрос заполнил кэш ленты: без сброса лента не
+        # обратится к базе.
+        cache.clear()
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('posts:main'),
+                                   HTTP_X_PROFILE='1')
+        name = response['X-Profile-Id']
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         [f'{name}.json', f'{name}.prof'])
+        summary = profiling.list_profiles()[0]
+        self.assertEqual(summary['path'], reverse('posts:main'))
+        self.assertEqual(summary['query_count'], len(summary['queries']))
+        self.assertGreater(summary['query_count'], 0)
+        self.assertGreater(summary['template_time'], 0)
+
+    def test_profiles_page_admin_only(self):
+        """Список и файлы профилей доступны только персоналу."""
+        self.client.force_login(self.staff)
+        name = self.client.get(
+            reverse('posts:main') + '?_profile=1')['X-Profile-Id']
+        download_url = reverse('core:profile_download', args=(name, 'prof'))
+        response = self.client.get(reverse('core:profiles'))
+        self.assertContains(response, download_url)
+        self.assertEqual(self.client.get(download_url).status_code, 200)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(download_url).status_code, 302)
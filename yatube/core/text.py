@@ -0,0 +1,83 @@
+"""Отрисовка Markdown в безопасный HTML и получение текстового отрывка."""
+import html
+import re
+from urllib.parse import urlsplit
+
+import markdown
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+SAFE_URL_SCHEMES = ('', 'http', 'https', 'mailto')
+# Пробелы и управляющие символы, которые браузер пропускает в схеме.
+IGNORED_URL_CHARACTERS = re.compile(r'[\x00-\x20\x7f-\x9f]')
+
+
+def get_url_scheme(url):
+    """
+    Схема адреса так, как ее увидит браузер, или None для неразборчивого
+    адреса.
+
+    В атрибуте адрес может быть записан сущностями HTML
+    (jav&#x61;script:), поэтому они раскрываются до разбора.
+    """
+    url = IGNORED_URL_CHARACTERS.sub('', html.unescape(url))
+    try:
+        return urlsplit(url).scheme.lower()
+    except ValueError:
+        return None
+
+
+class SafeLinksTreeprocessor(Treeprocessor):
+    """Удаляет ссылки и картинки с небезопасными схемами (javascript:)."""
+
+    def run(self, root):
+        for element in root.iter():
+            for attribute in ('href', 'src'):
+                url = element.get(attribute)
+                if url is None:
+                    continue
+                if get_url_scheme(url) not in SAFE_URL_SCHEMES:
+                    del element.attrib[attribute]
+
+
+class SafeMarkdownExtension(Extension):
+    """Запрещает сырой HTML в тексте и небезопасные ссылки."""
+
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+        md.treeprocessors.register(SafeLinksTreeprocessor(md), 'safe_links',
+                                   0)
+
+
+def render_markdown(text, extensions=None):
+    """Возвращает очищенный HTML для текста в разметке Markdown."""
+    if extensions is None:
+        extensions = settings.MARKDOWN_EXTENSIONS
+    return markdown.markdown(
+        text, extensions=[*extensions, SafeMarkdownExtension()])
+
+
+def make_excerpt(text_html, length=None):
+    """Возвращает начало текста без разметки."""
+    if length is None:
+        length = settings.POST_EXCERPT_LENGTH
+    text = ' '.join(html.unescape(strip_tags(text_html)).split())
+    return Truncator(text).chars(length)
+
+
+def render_rows(rows, extensions, length):
+    """
+    Отрисовывает пачку записей [(id, текст), ...].
+
+    Не обращается к настройкам Django, поэтому подходит для запуска
+    в отдельных процессах.
+    """
+    rendered = []
+    for pk, text in rows:
+        text_html = render_markdown(text, extensions)
+        rendered.append((pk, text_html, make_excerpt(text_html, length)))
+    return rendered
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'core'
+
+urlpatterns = [
+    path('', views.get_profiles_list, name='profiles'),
+    path(
+        '<str:name>.<str:extension>',
+        views.download_profile,
+        name='profile_download'
+    ),
+]
@@ -1,5 +1,11 @@
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
 from django.shortcuts import render
 
+from . import profiling
+
 
 def get_page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -13,3 +19,18 @@ def get_permission_denied(request, exception):
     context = {'path': request.path,
                'msg': exception}
     return render(request, 'core/403.html', context, status=403)
+
+
+@staff_member_required
+def get_profiles_list(request):
+    return render(request, 'core/profiles.html',
+                  {'profiles': profiling.list_profiles()})
+
+
+@staff_member_required
+def download_profile(request, name, extension):
+    path = profiling.get_profile_path(name, extension)
+    if path is None or not os.path.exists(path):
+        raise Http404('Профиль не найден')
+    return FileResponse(open(path, 'rb'), as_attachment=True,
+                        filename=os.path.basename(path))
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Записи'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .cache import check_versions_cache
+
+        checks.register(check_versions_cache, checks.Tags.caches)
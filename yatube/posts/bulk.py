@@ -0,0 +1,109 @@
+"""
+Массовое создание записей и комментариев одним INSERT.
+
+bulk_create не вызывает save() и сигналы, поэтому функции модуля сами
+обновляют то, что для одиночных объектов делают Post.save() и
+posts.signals: HTML текста, счетчики, ленты подписок, индекс поиска,
+миниатюры и кэш лент. Вызывать их нужно внутри transaction.atomic().
+"""
+from collections import Counter
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Max
+
+from . import cache, counters, search, thumbnails, timeline
+from .models import Comment, Post
+
+
+def lock_table(model):
+    """
+    Берет блокировку записи SQLite до конца транзакции.
+
+    Транзакции Django в SQLite отложенные: блокировка берется только
+    первой записью. Пустой UPDATE берет ее сразу, и до конца транзакции
+    другие соединения не могут вставлять строки.
+    """
+    connection = connections[model.objects.db]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {table} SET {column} = {column} WHERE 0')
+
+
+def bulk_insert(model, objects, keep_dates=False):
+    """
+    bulk_create, после которого у объектов заполнены id.
+
+    bulk_create записывает в поля auto_now_add текущее время; при
+    keep_dates в них возвращаются переданные значения (для загрузки
+    выгрузки, см. core.export).
+    """
+    date_fields = [field for field in model._meta.concrete_fields
+                   if keep_dates and getattr(field, 'auto_now_add', False)]
+    dates = [[getattr(obj, field.attname) for field in date_fields]
+             for obj in objects]
+    db = model.objects.db
+    # SQLite в Django 3.2 не возвращает id из bulk_create.
+    recover_ids = (objects and objects[0].pk is None
+                   and connections[db].vendor == 'sqlite')
+    with transaction.atomic(using=db):
+        if recover_ids:
+            # Под блокировкой записи все строки с id больше последнего -
+            # вставленные здесь, в порядке вставки.
+            lock_table(model)
+            last_pk = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        objects = model.objects.bulk_create(objects)
+        if recover_ids:
+            ids = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                       .values_list('pk', flat=True))
+            if len(ids) != len(objects):
+                raise DatabaseError(
+                    f'Вставлено {len(objects)} строк, найдено {len(ids)}.')
+            for obj, pk in zip(objects, ids):
+                obj.pk = pk
+        if date_fields:
+            for obj, values in zip(objects, dates):
+                for field, value in zip(date_fields, values):
+                    setattr(obj, field.attname, value)
+            model.objects.bulk_update(objects,
+                                      [field.name for field in date_fields])
+    return objects
+
+
+def create_posts(author, posts, keep_dates=False):
+    """Создает записи автора и обновляет производные данные."""
+    for post in posts:
+        post.author = author
+        post.render_text()
+    posts = bulk_insert(Post, posts, keep_dates)
+    counters.change_profile(author.pk, posts_count=len(posts))
+    group_counts = Counter(post.group_id for post in posts)
+    for group_id, count in group_counts.items():
+        counters.change_group(group_id, count)
+    follower_ids = timeline.push_posts(author.pk, posts)
+    search.index_posts(posts)
+    for post in posts:
+        thumbnails.schedule(post)
+    cache.invalidate(
+        'posts', f'author:{author.pk}',
+        *(f'group:{group_id}' for group_id in group_counts if group_id),
+        *(f'feed:{user_id}' for user_id in follower_ids)
+    )
+    return posts
+
+
+def create_comments(post, comments):
+    """Создает комментарии к записи и обновляет ее счетчик."""
+    for comment in comments:
+        comment.post = post
+    return insert_comments(comments)
+
+
+def insert_comments(comments, keep_dates=False):
+    """Создает комментарии к разным записям и обновляет их счетчики."""
+    comments = bulk_insert(Comment, comments, keep_dates)
+    post_counts = Counter(comment.post_id for comment in comments)
+    for post_id, count in post_counts.items():
+        counters.change_post(post_id, count)
+    cache.invalidate(*(f'post:{post_id}' for post_id in post_counts))
+    return comments
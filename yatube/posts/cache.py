@@ -0,0 +1,114 @@
+"""
+Поколенческая инвалидация кэша лент.
+
+У каждого пространства имен ('posts', 'group:<id>', 'author:<id>',
+'feed:<user_id>', 'post:<id>', 'comments') есть версия, которая
+хранится в кэше. 'comments' меняется с любым комментарием: от него
+зависит число комментариев в списке записей API.
+Ключи закэшированных значений содержат версии своих пространств, поэтому
+при изменении данных достаточно сменить версию: старые значения больше
+не читаются и вытесняются из кэша по таймауту.
+
+Те же версии служат валидаторами ETag страниц и API (см. make_etag):
+ответ 304 отдается без запросов к данным страницы и без отрисовки.
+
+Версии хранятся в отдельном кэше VERSIONS_CACHE, общем для всех
+процессов (в кэше процесса смена версии в одном процессе не видна
+остальным, см. check_versions_cache). Сами значения лежат в кэше по
+умолчанию: ключ со старой версией просто перестает читаться.
+"""
+import hashlib
+import uuid
+
+from django.core import checks
+from django.core.cache import caches
+
+VERSIONS_CACHE = 'versions'
+# Бэкенды, которые хранят данные в памяти одного процесса.
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+VERSION_KEY = 'ns-version:{}'
+# Пространство имен, от которого зависят все ключи. Его версия меняется,
+# когда нужно сбросить кэш всех лент, например после перерисовки текста
+# записей.
+GLOBAL_NAMESPACE = 'all'
+
+
+def new_version():
+    return uuid.uuid4().hex[:8]
+
+
+def get_versions(*namespaces):
+    """Возвращает строку с текущими версиями пространств имен."""
+    cache = caches[VERSIONS_CACHE]
+    keys = [VERSION_KEY.format(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return '.'.join(versions[key] for key in keys)
+
+
+def make_key(name, namespaces, *parts):
+    """Собирает ключ кэша, зависящий от версий пространств имен."""
+    parts = [str(part) for part in parts]
+    key = ':'.join(
+        [name, get_versions(GLOBAL_NAMESPACE, *namespaces), *parts])
+    if (len(key) > 200 or not key.isascii()
+            or any(char.isspace() for char in key)):
+        key = f'{name}:{hashlib.md5(key.encode()).hexdigest()}'
+    return key
+
+
+def make_etag(namespaces, user=None, parts=()):
+    """
+    Возвращает ETag для ответа, зависящего от пространств имен.
+
+    Если ответ разный для разных пользователей (кнопка подписки, ссылки
+    редактирования, имя в шапке), передается user: в ETag попадают его id
+    и хэш имени.
+    """
+    parts = [get_versions(GLOBAL_NAMESPACE, *namespaces),
+             *(str(part) for part in parts)]
+    if user is not None and user.is_authenticated:
+        name = f'{user.username}|{user.get_full_name()}'
+        parts.append(
+            f'{user.pk}-{hashlib.md5(name.encode()).hexdigest()[:8]}')
+    return ':'.join(parts)
+
+
+def invalidate(*namespaces):
+    """Меняет версии пространств имен, делая их кэш недействительным."""
+    caches[VERSIONS_CACHE].set_many(
+        {VERSION_KEY.format(namespace): new_version()
+         for namespace in namespaces},
+        None
+    )
+
+
+def invalidate_post(post, group_ids, follower_ids):
+    """Сбрасывает кэш всех лент, в которых выводится запись."""
+    invalidate(
+        'posts', f'author:{post.author_id}', f'post:{post.pk}',
+        *(f'group:{group_id}' for group_id in group_ids if group_id),
+        *(f'feed:{user_id}' for user_id in follower_ids)
+    )
+
+
+def check_versions_cache(app_configs, **kwargs):
+    """Предупреждает, если версии хранятся в памяти процесса."""
+    from django.conf import settings
+
+    backend = settings.CACHES.get(VERSIONS_CACHE, {}).get('BACKEND')
+    if backend is None or backend in LOCAL_BACKENDS:
+        return [checks.Warning(
+            f'Версии кэша лент хранятся в памяти процесса ({backend}).',
+            hint=(f'Укажите в CACHES["{VERSIONS_CACHE}"] кэш, общий для '
+                  f'всех процессов, иначе изменения в одном процессе не '
+                  f'сбрасывают кэш и ETag остальных.'),
+            id='posts.W001',
+        )]
+    return []
@@ -0,0 +1,110 @@
+"""
+Каталог сообществ в памяти процесса.
+
+Сообщества меняют только администраторы, а читаются они в каждом чате
+и в API, поэтому каждый процесс держит снимок всех сообществ
+(get_catalogue) и готовые представления, построенные по снимку один раз
+(Catalogue.derive, например JSON списка для API).
+
+Снимок помечен версией пространства имен 'groups' из общего кэша
+(см. posts.cache). Изменение сообщества меняет версию (invalidate), и
+остальные процессы перечитывают каталог, заметив новую версию. Версия
+проверяется не чаще раза в settings.GROUP_CATALOGUE_CHECK_INTERVAL
+секунд, поэтому обычно получение каталога - это чтение переменной модуля.
+
+Счетчик записей меняется с каждой записью, поэтому версию он не меняет:
+процесс перечитывает счетчики одним запросом не чаще раза в
+settings.GROUP_POSTS_COUNT_INTERVAL секунд и, если они изменились,
+заменяет снимок копией с новыми счетчиками (Catalogue.recount).
+"""
+import copy
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import cache
+from .models import Group
+
+NAMESPACE = 'groups'
+
+_catalogue = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+class Catalogue:
+    """Снимок всех сообществ и представлений, построенных по нему."""
+
+    def __init__(self, version, groups, counted):
+        self.version = version
+        self.groups = groups
+        self.by_slug = {group.slug: group for group in groups}
+        # Когда перечитывались счетчики записей, по time.monotonic().
+        self.counted = counted
+        self.posts_counts = {group.pk: group.posts_count for group in groups}
+        # Часть ETag, которая меняется вместе со счетчиками.
+        self.counts_stamp = hashlib.md5(
+            repr(sorted(self.posts_counts.items())).encode()
+        ).hexdigest()[:8]
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def recount(self, now):
+        """Снимок с текущими счетчиками записей (тот же, если не менялись)."""
+        counts = dict(Group.objects.values_list('pk', 'posts_count'))
+        if counts == self.posts_counts:
+            self.counted = now
+            return self
+        groups = [copy.copy(group) for group in self.groups]
+        for group in groups:
+            group.posts_count = counts.get(group.pk, group.posts_count)
+        return Catalogue(self.version, groups, now)
+
+    def derive(self, name, build):
+        """Значение build(groups), которое строится один раз на снимок."""
+        if name not in self._derived:
+            with self._lock:
+                if name not in self._derived:
+                    self._derived[name] = build(self.groups)
+        return self._derived[name]
+
+
+def get_catalogue():
+    """Возвращает актуальный снимок каталога сообществ."""
+    global _catalogue, _checked
+    catalogue = _catalogue
+    now = time.monotonic()
+    if (catalogue is not None
+            and now - _checked < settings.GROUP_CATALOGUE_CHECK_INTERVAL):
+        return catalogue
+    version = cache.get_versions(cache.GLOBAL_NAMESPACE, NAMESPACE)
+    with _lock:
+        if _catalogue is None or _catalogue.version != version:
+            # Версия прочитана до сообществ, поэтому снимок не старше ее.
+            _catalogue = Catalogue(version,
+                                   list(Group.objects.order_by('pk')), now)
+        elif now - _catalogue.counted >= settings.GROUP_POSTS_COUNT_INTERVAL:
+            _catalogue = _catalogue.recount(now)
+        _checked = now
+        return _catalogue
+
+
+def _reset():
+    global _catalogue
+    cache.invalidate(NAMESPACE)
+    _catalogue = None
+
+
+def invalidate():
+    """
+    Сбрасывает каталог во всех процессах.
+
+    Версия меняется сразу и еще раз после фиксации транзакции: иначе
+    другой процесс мог бы успеть перечитать незафиксированные данные
+    под новой версией и хранить устаревший снимок до следующего изменения.
+    """
+    _reset()
+    transaction.on_commit(_reset)
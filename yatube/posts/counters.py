@@ -0,0 +1,74 @@
+"""
+Денормализованные счетчики записей, комментариев и подписок.
+
+Счетчики меняются атомарно выражениями F() в сигналах (см. posts.signals),
+поэтому страницы и API выводят их без агрегирующих запросов. Если счетчики
+разошлись с данными (например, после правки базы вручную), их пересчитывает
+команда reconcile_counters.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import UserProfile
+
+from .models import Comment, Follow, Group, Post, User
+
+
+def change(queryset, **deltas):
+    """Прибавляет deltas к счетчикам строк queryset, не опускаясь ниже 0."""
+    queryset.update(**{field: Greatest(F(field) + delta, 0)
+                       for field, delta in deltas.items()})
+
+
+def change_profile(user_id, **deltas):
+    change(UserProfile.objects.filter(user_id=user_id), **deltas)
+
+
+def change_group(group_id, delta):
+    if group_id:
+        change(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def change_post(post_id, delta):
+    change(Post.objects.filter(pk=post_id), comments_count=delta)
+
+
+def count_by(queryset, field, outer='pk'):
+    """Подзапрос с числом строк queryset, у которых field = OuterRef(outer)."""
+    counts = (queryset.filter(**{field: OuterRef(outer)}).order_by()
+              .values(field).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def fix(queryset, field, actual):
+    """Исправляет счетчик field там, где он отличается от actual."""
+    return queryset.exclude(**{field: actual}).update(**{field: actual})
+
+
+def reconcile():
+    """
+    Пересчитывает все счетчики по данным.
+
+    Создает недостающие профили пользователей. Возвращает словарь
+    {счетчик: число исправленных строк}.
+    """
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id) for user_id in
+         User.objects.filter(profile__isnull=True)
+         .values_list('pk', flat=True)],
+        batch_size=500
+    )
+    profiles = UserProfile.objects.all()
+    fixed = {
+        'posts_count': fix(profiles, 'posts_count',
+                           count_by(Post.objects, 'author', 'user_id')),
+        'followers_count': fix(profiles, 'followers_count',
+                               count_by(Follow.objects, 'author', 'user_id')),
+        'following_count': fix(profiles, 'following_count',
+                               count_by(Follow.objects, 'user', 'user_id')),
+        'comments_count': fix(Post.objects.all(), 'comments_count',
+                              count_by(Comment.objects, 'post')),
+        'group_posts_count': fix(Group.objects.all(), 'posts_count',
+                                 count_by(Post.objects, 'group')),
+    }
+    return fixed
@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts import cache, thumbnails
+from posts.models import Post
+
+
+def generate_in_thread(image_name):
+    try:
+        return thumbnails.generate(image_name)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = ('Создает миниатюры всех размеров из '
+            'settings.THUMBNAIL_GEOMETRIES для картинок всех записей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число потоков для создания миниатюр'
+        )
+
+    def handle(self, *args, **options):
+        image_names = (Post.objects.exclude(image='').order_by()
+                       .values_list('image', flat=True).distinct())
+        total = errors = 0
+        # Pillow отпускает GIL при обработке картинок, поэтому потоков
+        # достаточно.
+        with ThreadPoolExecutor(max(options['workers'], 1)) as executor:
+            futures = {executor.submit(generate_in_thread, name): name
+                       for name in image_names.iterator()}
+            for future, name in futures.items():
+                try:
+                    # Манифесты записываются из основного потока.
+                    thumbnails.save_manifest(name, future.result())
+                    total += 1
+                except Exception as error:
+                    errors += 1
+                    self.stderr.write(f'{name}: {error}')
+        cache.invalidate(cache.GLOBAL_NAMESPACE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {total}, ошибок: {errors}'))
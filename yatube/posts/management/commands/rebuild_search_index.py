@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import cache, search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс полнотекстового поиска по всем записям.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = search.rebuild_index()
+        # Число найденных записей кэшируется в пространстве 'posts'.
+        cache.invalidate('posts')
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс поиска перестроен, записей: {count}'))
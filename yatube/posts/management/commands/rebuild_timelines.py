@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок по таблице Follow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пользователи, чьи ленты нужно пересобрать (по умолчанию все)'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(
+                username__in=options['usernames']).values_list('pk',
+                                                               flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError('Не все пользователи найдены.')
+        rebuilt = timeline.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано лент подписок: {rebuilt}'))
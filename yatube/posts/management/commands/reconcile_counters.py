@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики записей, комментариев и подписок '
+            'по данным в базе.')
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile()
+        for name, count in fixed.items():
+            self.stdout.write(f'{name}: исправлено {count}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
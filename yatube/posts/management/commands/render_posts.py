@@ -0,0 +1,73 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.text import render_rows
+from posts import cache
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Перерисовывает HTML и начало текста всех записей. '
+            'Нужно запускать после изменения settings.MARKDOWN_EXTENSIONS '
+            'и после миграции posts 0014, которая добавляет эти поля.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов для отрисовки'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Число записей, которое получает процесс за раз'
+        )
+
+    def get_chunks(self, chunk_size):
+        rows = Post.objects.order_by('pk').values_list('pk', 'text')
+        chunk = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def save(self, rendered):
+        posts = [Post(pk=pk, text_html=text_html, excerpt=excerpt)
+                 for pk, text_html, excerpt in rendered]
+        Post.objects.bulk_update(posts, ('text_html', 'excerpt'))
+        return len(posts)
+
+    def render_in_pool(self, chunks, arguments, workers):
+        """
+        Отрисовывает пачки в workers процессах, отдает результаты по порядку.
+
+        В работе не больше двух пачек на процесс: остальные пачки еще не
+        прочитаны из базы, и текст всех записей не попадает в память.
+        """
+        with ProcessPoolExecutor(workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(render_rows, chunk, *arguments))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def handle(self, *args, **options):
+        arguments = (settings.MARKDOWN_EXTENSIONS,
+                     settings.POST_EXCERPT_LENGTH)
+        chunks = self.get_chunks(options['chunk_size'])
+        if options['workers'] > 1:
+            rendered = self.render_in_pool(chunks, arguments,
+                                           options['workers'])
+        else:
+            rendered = (render_rows(chunk, *arguments) for chunk in chunks)
+        total = sum(self.save(rows) for rows in rendered)
+        cache.invalidate(cache.GLOBAL_NAMESPACE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Перерисовано записей: {total}'))
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db import migrations
+
+FTS_TABLE = 'posts_post_fts'
+AUTHOR = "{user}.username || ' ' || {user}.first_name || ' ' || {user}.last_name"
+
+
+def fold(expression):
+    """Заменяет "ё" на "е": unicode61 не снимает диакритику с кириллицы."""
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def get_statements(user_table):
+    author = fold(AUTHOR.format(user=user_table))
+    # Индекс дальше поддерживают сигналы (posts.search): триггеры на
+    # posts_post SQLite теряет, когда пересоздает таблицу при изменении
+    # схемы.
+    return [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"text, author, tokenize = 'unicode61 remove_diacritics 2')",
+        # Совпадение в тексте весит больше, чем совпадение в имени автора.
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) "
+        f"VALUES ('rank', 'bm25(2.0, 1.0)')",
+        f'INSERT INTO {FTS_TABLE}(rowid, text, author) '
+        f'SELECT posts_post.id, {fold("posts_post.text")}, {author} '
+        f'FROM posts_post JOIN {user_table} '
+        f'ON {user_table}.id = posts_post.author_id',
+    ]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    for statement in get_statements(user_table):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_post_text_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
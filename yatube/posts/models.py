@@ -1,12 +1,16 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models import CheckConstraint, F, Q, UniqueConstraint
 from django.urls import reverse
 
+from core.models import ServerFieldsMixin
+from core.text import make_excerpt, render_markdown
+
 User = get_user_model()
 
 
-class Post(models.Model):
+class Post(ServerFieldsMixin, models.Model):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста',
@@ -37,12 +41,50 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    text_html = models.TextField(
+        verbose_name='Текст поста в HTML',
+        blank=True,
+        editable=False
+    )
+    excerpt = models.CharField(
+        verbose_name='Начало текста',
+        max_length=settings.POST_EXCERPT_LENGTH,
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Число комментариев',
+        default=0,
+        editable=False
+    )
+    thumbnails = models.JSONField(
+        verbose_name='Миниатюры картинки',
+        default=dict,
+        blank=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ('-pub_date', '-id')
         verbose_name = 'Запись'
         verbose_name_plural = 'Записи'
 
+    # Счетчик меняют сигналы комментариев (см. posts.counters), миниатюры
+    # записывает фоновый поток (см. posts.thumbnails).
+    server_fields = ('comments_count', 'thumbnails')
+
+    def save(self, *args, **kwargs):
+        self.render_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'text_html', 'excerpt'}
+        super().save(*args, **kwargs)
+
+    def render_text(self):
+        """Сохраняет в модели HTML текста и его начало без разметки."""
+        self.text_html = render_markdown(self.text)
+        self.excerpt = make_excerpt(self.text_html)
+
     def get_absolute_url(self):
         return reverse('posts:post_detail', kwargs={'post_id': self.pk})
 
@@ -50,15 +92,22 @@ class Post(models.Model):
         return self.text[:15]
 
 
-class Group(models.Model):
+class Group(ServerFieldsMixin, models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     slug = models.SlugField(unique=True)
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число записей',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Группа'
         verbose_name_plural = 'Группы'
 
+    server_fields = ('posts_count',)
+
     def get_absolute_url(self):
         return reverse('posts:group_list', kwargs={'slug': self.slug})
 
@@ -92,6 +141,10 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(fields=('post', 'created', 'id'),
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -123,3 +176,37 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
+
+
+class TimelineEntry(models.Model):
+    """Запись в предрассчитанной ленте подписок пользователя."""
+
+    user = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    post = models.ForeignKey(
+        to='Post',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Запись',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post_id')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        indexes = [
+            models.Index(fields=('user', '-pub_date', '-post'),
+                         name='timeline_user_pub_date_idx'),
+        ]
+        constraints = [
+            UniqueConstraint(fields=('user', 'post'),
+                             name='unique_timeline_user_and_post')
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.post_id}'
@@ -0,0 +1,288 @@
+import binascii
+import collections.abc
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class PostIdList:
+    """
+    Ленивая последовательность записей по заранее рассчитанному списку id.
+
+    Подходит как object_list для Paginator: при получении страницы
+    из базы загружаются только записи этой страницы, порядок берется
+    из списка id.
+    """
+
+    def __init__(self, ids, queryset, entries=None):
+        self.ids = ids
+        self.queryset = queryset
+        # Строки с полями pub_date и post_id, по которым работает
+        # CursorPaginator (например, записи TimelineEntry).
+        self.entries = entries
+
+    def count(self):
+        if isinstance(self.ids, QuerySet):
+            return self.ids.count()
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        ids = list(self.ids[key])
+        posts = self.queryset.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def estimate_count(queryset):
+    """
+    Возвращает примерное число строк таблицы из статистики СУБД.
+
+    Оценка возможна только для запроса без фильтров; если статистики нет,
+    возвращает None.
+    """
+    if queryset.query.where:
+        return None
+    table = queryset.model._meta.db_table
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'sqlite':
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+    try:
+        with transaction.atomic(using=queryset.db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [table])
+                row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class CachedPaginator(Paginator):
+    """
+    Paginator, который кэширует число записей и id записей страницы.
+
+    Записи страницы загружаются лениво, поэтому если страница уже
+    отрисована и лежит в кэше шаблона, запросов к базе не будет.
+    Актуальность кэша обеспечивает версия в cache_key.
+
+    Точное число записей считается не больше чем до
+    settings.PAGINATOR_EXACT_COUNT_LIMIT и сбрасывается при изменении данных.
+    Для больших списков используется оценка из статистики СУБД (или точный
+    подсчет, если оценки нет или она меньше этого предела), которая
+    хранится под ключом count_key без версии и обновляется раз в
+    settings.PAGINATOR_COUNT_TIMEOUT секунд.
+    """
+
+    def __init__(self, object_list, per_page, cache_key, count_key=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.count_key = count_key or f'{cache_key}:estimate'
+
+    @cached_property
+    def count(self):
+        exact_key = f'{self.cache_key}:count'
+        counts = cache.get_many((exact_key, self.count_key))
+        if exact_key in counts:
+            return counts[exact_key]
+        if self.count_key in counts:
+            return counts[self.count_key]
+        if isinstance(self.object_list, PostIdList):
+            # Длина ленты подписок ограничена settings.TIMELINE_LENGTH.
+            count, limit = self.object_list.count(), None
+        else:
+            limit = settings.PAGINATOR_EXACT_COUNT_LIMIT
+            count = self.object_list.values('pk')[:limit].count()
+        if limit is None or count < limit:
+            cache.set(exact_key, count, settings.FEED_CACHE_TIMEOUT)
+            return count
+        # Статистика обновляется только ANALYZE и может сильно отставать:
+        # оценка меньше уже насчитанного limit заведомо устарела.
+        count = estimate_count(self.object_list)
+        if count is None or count < limit:
+            count = super().count
+        cache.set(self.count_key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+        return count
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        key = f'{self.cache_key}:page:{number}'
+        ids = cache.get(key)
+        if ids is None:
+            ids = self.get_ids(bottom, top)
+            cache.set(key, ids, settings.FEED_CACHE_TIMEOUT)
+        return self._get_page(PostIdList(ids, self.queryset), number, self)
+
+    @property
+    def queryset(self):
+        if isinstance(self.object_list, PostIdList):
+            return self.object_list.queryset
+        return self.object_list
+
+    def get_ids(self, bottom, top):
+        if isinstance(self.object_list, PostIdList):
+            return list(self.object_list.ids[bottom:top])
+        return list(self.object_list.values_list('pk', flat=True)
+                    [bottom:top])
+
+
+class CursorPage(collections.abc.Sequence):
+    """
+    Страница CursorPaginator.
+
+    В number хранится курсор страницы: он отличает страницы друг от друга
+    в ключах кэша шаблонов так же, как номер страницы у Paginator.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, number, next_cursor, previous_cursor,
+                 paginator):
+        self.object_list = object_list
+        self.number = number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.paginator = paginator
+
+    def __repr__(self):
+        return f'<CursorPage {self.number or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class CursorPaginator:
+    """
+    Постраничный вывод по ключу (дата, id) вместо OFFSET.
+
+    По умолчанию порядок совпадает с Post.Meta.ordering ('-pub_date',
+    '-id'); для других моделей передаются поле даты date_field и
+    направление descending (например, комментарии от старых к новым).
+    Курсор содержит ключ крайней записи страницы и направление, поэтому
+    любая страница стоит столько же, сколько первая, и не требует COUNT.
+    """
+
+    NEXT, PREVIOUS = 'n', 'p'
+
+    def __init__(self, object_list, per_page, date_field='pub_date',
+                 descending=True):
+        self.per_page = int(per_page)
+        self.date_field = date_field
+        self.descending = descending
+        if isinstance(object_list, PostIdList):
+            self.queryset = object_list.queryset
+            self.entries = object_list.entries
+            self.id_field = 'post_id'
+        else:
+            self.queryset = object_list
+            self.entries = None
+            self.id_field = 'pk'
+        self.object_list = object_list
+
+    @cached_property
+    def count(self):
+        if self.entries is not None:
+            return self.entries.count()
+        return self.queryset.count()
+
+    def encode_cursor(self, direction, obj):
+        date = getattr(obj, self.date_field)
+        value = f'{direction}|{date.isoformat()}|{obj.pk}'
+        return urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает (направление, дата, id) или None."""
+        if not cursor:
+            return None
+        try:
+            value = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, date, pk = value.decode().split('|')
+            date, pk = parse_datetime(date), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        if direction not in (self.NEXT, self.PREVIOUS) or date is None:
+            return None
+        return direction, date, pk
+
+    def fetch(self, condition, forward, limit):
+        """Первые limit объектов по условию в прямом порядке списка или,
+        при forward=False, в обратном."""
+        date_field, id_field = self.date_field, self.id_field
+        ordering = ((f'-{date_field}', f'-{id_field}')
+                    if forward == self.descending
+                    else (date_field, id_field))
+        if self.entries is None:
+            return list(self.queryset.filter(condition)
+                        .order_by(*ordering)[:limit])
+        ids = list(self.entries.filter(condition).order_by(*ordering)
+                   .values_list(id_field, flat=True)[:limit])
+        return PostIdList(ids, self.queryset)[:]
+
+    def get_condition(self, direction, date, pk):
+        # (дата < date) OR (дата = date AND id < pk) в виде диапазона по
+        # дате с исключением: с OR SQLite не использует индекс по дате
+        # и сортирует все подходящие строки.
+        before = (direction == self.NEXT) == self.descending
+        date_lookup, id_lookup = ('lte', 'gte') if before else ('gte', 'lte')
+        return (Q(**{f'{self.date_field}__{date_lookup}': date})
+                & ~Q(**{self.date_field: date,
+                        f'{self.id_field}__{id_lookup}': pk}))
+
+    def get_page(self, cursor):
+        """Возвращает страницу по курсору, при неверном курсоре - первую."""
+        position = self.decode_cursor(cursor)
+        limit = self.per_page + 1
+        if position is None:
+            objects = self.fetch(Q(), True, limit)
+            has_next, has_previous = len(objects) == limit, False
+        elif position[0] == self.NEXT:
+            objects = self.fetch(self.get_condition(*position), True, limit)
+            has_next, has_previous = len(objects) == limit, True
+        else:
+            objects = self.fetch(self.get_condition(*position), False, limit)
+            has_next, has_previous = True, len(objects) == limit
+            objects = objects[:self.per_page][::-1]
+        objects = objects[:self.per_page]
+        next_cursor = previous_cursor = None
+        if objects and has_next:
+            next_cursor = self.encode_cursor(self.NEXT, objects[-1])
+        if objects and has_previous:
+            previous_cursor = self.encode_cursor(self.PREVIOUS, objects[0])
+        return CursorPage(objects, cursor or '', next_cursor,
+                          previous_cursor, self)
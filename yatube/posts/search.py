@@ -0,0 +1,124 @@
+"""
+Полнотекстовый поиск по записям.
+
+В SQLite используется виртуальная таблица FTS5 posts_post_fts (см. миграцию
+0015_post_fts): rowid совпадает с id записи, колонки - текст записи и имена
+автора. Таблицу поддерживают в актуальном состоянии сигналы на Post и User
+(см. posts.signals); триггеры не подходят, потому что SQLite пересоздает
+posts_post при изменении схемы и теряет их. Массовые операции в обход
+save() должны вызывать index_posts/unindex_posts сами, а если индекс
+разошелся с данными (например, после правки базы вручную), его
+перестраивает команда rebuild_search_index.
+Токенизатор unicode61 приводит к нижнему регистру любые алфавиты, включая
+кириллицу; "ё" заменяется на "е" и в индексе, и в запросе. Результаты
+упорядочены по BM25.
+
+На других СУБД поиск выполняется через icontains без ранжирования.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+AUTHOR = ("{user}.username || ' ' || {user}.first_name || ' ' "
+          "|| {user}.last_name")
+
+
+def fold(text):
+    """Заменяет "ё" на "е": unicode61 не снимает диакритику с кириллицы."""
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fold_sql(expression):
+    """То же, что fold, для выражения SQL."""
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def get_author_text(user):
+    return fold(f'{user.username} {user.first_name} {user.last_name}')
+
+
+def index_posts(posts):
+    """Добавляет записи в индекс или обновляет их."""
+    if connection.vendor != 'sqlite' or not posts:
+        return
+    unindex_posts([post.pk for post in posts])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE}(rowid, text, author) '
+            f'VALUES (%s, %s, %s)',
+            [(post.pk, fold(post.text), get_author_text(post.author))
+             for post in posts]
+        )
+
+
+def unindex_posts(post_ids):
+    """Удаляет записи из индекса."""
+    if connection.vendor != 'sqlite' or not post_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [(post_id,) for post_id in post_ids])
+
+
+def reindex_author(user):
+    """Обновляет имя автора у всех его записей в индексе."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {FTS_TABLE} SET author = %s WHERE rowid IN '
+            f'(SELECT id FROM posts_post WHERE author_id = %s)',
+            [get_author_text(user), user.pk]
+        )
+
+
+def rebuild_index():
+    """Перестраивает индекс по всем записям, возвращает их число."""
+    if connection.vendor != 'sqlite':
+        return 0
+    post_table = Post._meta.db_table
+    user_table = Post._meta.get_field('author').related_model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, text, author) '
+            f'SELECT {post_table}.id, {fold_sql(f"{post_table}.text")}, '
+            f'{fold_sql(AUTHOR.format(user=user_table))} '
+            f'FROM {post_table} JOIN {user_table} '
+            f'ON {user_table}.id = {post_table}.author_id'
+        )
+        return cursor.rowcount
+
+
+def make_match_query(text):
+    """
+    Превращает строку поиска в запрос FTS5.
+
+    Каждое слово ищется по префиксу, слова соединяются через AND.
+    Кавычки вокруг слов не дают пользователю использовать синтаксис FTS5.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', fold(text)))
+
+
+def search_posts(queryset, text):
+    """Возвращает записи queryset, подходящие под строку поиска text."""
+    query = make_match_query(text)
+    if not query:
+        return queryset.none()
+    if connections[queryset.db].vendor != 'sqlite':
+        return queryset.filter(Q(text__icontains=text)
+                               | Q(author__username__icontains=text)
+                               | Q(author__first_name__icontains=text)
+                               | Q(author__last_name__icontains=text))
+    post_table = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {post_table}.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[query],
+        order_by=[f'{FTS_TABLE}.rank', f'-{post_table}.pub_date'],
+    )
@@ -0,0 +1,126 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from users.models import UserProfile
+
+from . import cache, catalogue, counters, search, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    saved = (Post.objects.filter(pk=instance.pk)
+             .values_list('group_id', 'author_id', 'image').first()
+             if instance.pk else None)
+    (instance._saved_group_id, instance._saved_author_id,
+     instance._saved_image) = saved or (None, None, '')
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        counters.change_profile(instance.author_id, posts_count=1)
+        counters.change_group(instance.group_id, 1)
+        follower_ids = timeline.push_post(instance)
+    else:
+        update_post_counters(instance)
+        follower_ids = (Follow.objects.filter(author_id=instance.author_id)
+                        .values_list('user_id', flat=True))
+    search.index_posts([instance])
+    if instance.image and instance.image.name != getattr(
+            instance, '_saved_image', ''):
+        thumbnails.schedule(instance)
+    cache.invalidate_post(
+        instance,
+        (instance.group_id, getattr(instance, '_saved_group_id', None)),
+        follower_ids)
+
+
+def update_post_counters(post):
+    """Переносит запись в счетчиках, если у нее сменились группа или автор."""
+    saved_group_id = getattr(post, '_saved_group_id', None)
+    if saved_group_id != post.group_id:
+        counters.change_group(saved_group_id, -1)
+        counters.change_group(post.group_id, 1)
+    saved_author_id = getattr(post, '_saved_author_id', None)
+    if saved_author_id and saved_author_id != post.author_id:
+        counters.change_profile(saved_author_id, posts_count=-1)
+        counters.change_profile(post.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    counters.change_profile(instance.author_id, posts_count=-1)
+    counters.change_group(instance.group_id, -1)
+    search.unindex_posts([instance.pk])
+    follower_ids = (Follow.objects.filter(author_id=instance.author_id)
+                    .values_list('user_id', flat=True))
+    cache.invalidate_post(instance, (instance.group_id,), follower_ids)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+    cache.invalidate('comments', f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.change_post(instance.post_id, -1)
+    cache.invalidate('comments', f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    cache.invalidate('posts', f'group:{instance.pk}')
+    catalogue.invalidate()
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        counters.change_profile(instance.user_id, following_count=1)
+        counters.change_profile(instance.author_id, followers_count=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+    cache.invalidate(f'feed:{instance.user_id}',
+                     f'author:{instance.author_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def clean_timeline(sender, instance, **kwargs):
+    counters.change_profile(instance.user_id, following_count=-1)
+    counters.change_profile(instance.author_id, followers_count=-1)
+    timeline.remove_author(instance.user_id, instance.author_id)
+    cache.invalidate(f'feed:{instance.user_id}',
+                     f'author:{instance.author_id}')
+
+
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_user_name(sender, instance, update_fields=None, **kwargs):
+    instance._saved_name = None
+    if instance.pk and (update_fields is None
+                        or set(NAME_FIELDS) & set(update_fields)):
+        instance._saved_name = (User.objects.filter(pk=instance.pk)
+                                .values_list(*NAME_FIELDS).first())
+
+
+@receiver(post_save, sender=User)
+def reindex_author(sender, instance, created, **kwargs):
+    saved_name = getattr(instance, '_saved_name', None)
+    name = tuple(getattr(instance, field) for field in NAME_FIELDS)
+    if created or saved_name is None or saved_name == name:
+        return
+    search.reindex_author(instance)
+    # Имя автора выводится в карточках всех лент и на страницах его
+    # записей, поэтому сбрасывается кэш всех лент.
+    cache.invalidate(cache.GLOBAL_NAMESPACE, f'author:{instance.pk}')
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile(sender, instance, **kwargs):
+    cache.invalidate(f'author:{instance.user_id}')
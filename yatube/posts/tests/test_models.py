@@ -1,7 +1,14 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
 from django.urls import reverse
 
+from core.text import render_markdown
+
+from .. import bulk
 from ..models import Comment, Follow, Group, Post
 
 User = get_user_model()
@@ -86,3 +93,108 @@ class PostModelTest(TestCase):
         }
         for model, expected_url in expected_urls_by_method.items():
             self.assertEqual(model.get_absolute_url(), expected_url)
+
+    def test_post_text_rendered_on_save(self):
+        """При сохранении записи текст отрисовывается в безопасный HTML."""
+        post = Post.objects.create(
+            author=self.user,
+            text='**bold** <script>alert(1)</script> [x](javascript:alert(1))'
+        )
+        self.assertIn('<strong>bold</strong>', post.text_html)
+        self.assertNotIn('<script>', post.text_html)
+        self.assertNotIn('javascript:', post.text_html)
+        self.assertTrue(post.excerpt.startswith('bold <script>'))
+        post.text = 'new'
+        post.save(update_fields=('text',))
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, '<p>new</p>')
+        self.assertEqual(post.excerpt, 'new')
+
+    def test_encoded_unsafe_links_removed(self):
+        """Схемы, записанные сущностями HTML и с управляющими символами,
+        тоже удаляются, безопасные ссылки остаются."""
+        for url in ('jav&#x61;script:alert(1)', '&#106;avascript:alert(1)',
+                    'javascript&colon;alert(1)', 'java\tscript:alert(1)',
+                    '&#x01;javascript:alert(1)', 'data:text/html,x'):
+            with self.subTest(url=url):
+                text_html = render_markdown(f'[x]({url}) ![y]({url})')
+                self.assertNotIn('href', text_html)
+                self.assertNotIn('src', text_html)
+        self.assertIn('href="https://example.com/?a=1&amp;b=2"',
+                      render_markdown('[x](https://example.com/?a=1&b=2)'))
+
+    def test_render_posts_command(self):
+        """Команда render_posts перерисовывает HTML всех записей."""
+        Post.objects.create(author=self.user, text='second')
+        for workers in (1, 2):
+            Post.objects.update(text_html='', excerpt='')
+            call_command('render_posts', workers=workers, chunk_size=1,
+                         stdout=StringIO())
+            self.post.refresh_from_db()
+            with self.subTest(workers=workers):
+                self.assertEqual(self.post.text_html,
+                                 f'<p>{self.post.text}</p>')
+                self.assertFalse(Post.objects.filter(text_html='').exists())
+
+    def test_counters_follow_data(self):
+        """Счетчики меняются при создании и удалении записей, комментариев
+        и подписок, команда reconcile_counters исправляет расхождения."""
+        profile, following_profile = (self.user.profile,
+                                      self.following_user.profile)
+        for obj, field, expected in (
+            (profile, 'posts_count', 1),
+            (profile, 'following_count', 1),
+            (following_profile, 'followers_count', 1),
+            (self.post, 'comments_count', 1),
+            (self.group, 'posts_count', 1),
+        ):
+            obj.refresh_from_db()
+            with self.subTest(obj=obj, field=field):
+                self.assertEqual(getattr(obj, field), expected)
+        post = Post.objects.create(author=self.user, text='new')
+        post.group = self.group
+        post.save()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 2)
+        post.delete()
+        self.group.refresh_from_db()
+        profile.refresh_from_db()
+        self.assertEqual((self.group.posts_count, profile.posts_count), (1, 1))
+        Post.objects.update(comments_count=10)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_bulk_insert_sets_ids(self):
+        """bulk_insert заполняет id вставленных объектов по порядку."""
+        Post.objects.create(author=self.user, text='deleted').delete()
+        with transaction.atomic():
+            posts = bulk.bulk_insert(Post, [
+                Post(author=self.user, text=f'bulk_{number}')
+                for number in range(3)
+            ])
+        self.assertEqual(
+            [Post.objects.get(pk=post.pk).text for post in posts],
+            ['bulk_0', 'bulk_1', 'bulk_2'])
+
+    def test_full_save_keeps_counters(self):
+        """Правка записи, сообщества и профиля, загруженных до нового
+        комментария и записи, не затирает счетчики."""
+        post = Post.objects.get(pk=self.post.pk)
+        group = Group.objects.get(pk=self.group.pk)
+        profile = User.objects.get(pk=self.user.pk).profile
+        Comment.objects.create(post=self.post, author=self.user, text='new')
+        Post.objects.create(author=self.user, text='new', group=self.group)
+        post.text = 'edited'
+        post.save()
+        group.title = 'edited'
+        group.save()
+        profile.timezone = 'Europe/Moscow'
+        profile.save()
+        post.refresh_from_db()
+        group.refresh_from_db()
+        profile.refresh_from_db()
+        self.assertEqual((post.text, post.comments_count), ('edited', 2))
+        self.assertEqual((group.title, group.posts_count), ('edited', 2))
+        self.assertEqual((profile.timezone, profile.posts_count),
+                         ('Europe/Moscow', 2))
@@ -0,0 +1,92 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from .. import thumbnails
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class TestThumbnails(TestCase):
+    @staticmethod
+    def get_image_for_test(name):
+        with BytesIO() as output:
+            Image.new('RGB', (1280, 1024), color=1).save(output, 'BMP')
+            return SimpleUploadedFile(name=name, content=output.getvalue(),
+                                      content_type='image')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_thumbnails_generated_after_save(self):
+        """Миниатюры создаются после сохранения записи, до этого шаблон
+        получает адрес исходной картинки."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Post.objects.create(
+                author=self.author, text='text',
+                image=self.get_image_for_test('post.bmp'))
+        self.assertEqual(thumbnails.get_url(post, 'card'), post.image.url)
+        for callback in callbacks:
+            callback()
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.thumbnails['source'], post.image.name)
+        with self.assertNumQueries(0):
+            url = thumbnails.get_url(post, 'card')
+        self.assertNotEqual(url, post.image.url)
+        self.assertTrue(url.startswith(settings.MEDIA_URL))
+
+    def test_edit_keeps_thumbnails(self):
+        """Правка записи, загруженной до создания миниатюр, не затирает
+        их."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Post.objects.create(
+                author=self.author, text='text',
+                image=self.get_image_for_test('post.bmp'))
+        for callback in callbacks:
+            callback()
+        post.text = 'edited'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'edited')
+        self.assertEqual(post.thumbnails['source'], post.image.name)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class TestGenerateThumbnails(TransactionTestCase):
+    # Потоки команды пишут в базу (KVStore sorl-thumbnail) через свои
+    # соединения, поэтому тест не может держать транзакцию открытой.
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+
+    def test_generate_thumbnails_command(self):
+        """generate_thumbnails создает миниатюры загруженных картинок."""
+        post = Post.objects.create(
+            author=self.author, text='text',
+            image=TestThumbnails.get_image_for_test('old.bmp'))
+        call_command('generate_thumbnails', workers=2, stdout=StringIO())
+        post = Post.objects.get(pk=post.pk)
+        self.assertTrue(thumbnails.is_ready(post))
+        self.assertNotEqual(thumbnails.get_url(post, 'card'), post.image.url)
@@ -0,0 +1,113 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import timeline
+from ..models import Follow, Post, TimelineEntry
+
+User = get_user_model()
+
+
+class TestTimeline(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='follower')
+        cls.author = User.objects.create_user(username='author')
+        cls.other_author = User.objects.create_user(username='other_author')
+        cls.old_post = Post.objects.create(author=cls.author, text='old')
+
+    def get_timeline(self):
+        return list(timeline.get_timeline_ids(self.user))
+
+    def test_follow_backfills_and_unfollow_cleans_timeline(self):
+        """После подписки в ленте появляются старые записи автора,
+        после отписки они удаляются."""
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.get_timeline(), [self.old_post.pk])
+        follow.delete()
+        self.assertEqual(self.get_timeline(), [])
+
+    def test_new_post_pushed_to_followers_only(self):
+        """Новая запись попадает только в ленты подписчиков автора."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(author=self.author, text='new')
+        Post.objects.create(author=self.other_author, text='other')
+        self.assertEqual(self.get_timeline(), [post.pk, self.old_post.pk])
+        post.delete()
+        self.assertEqual(self.get_timeline(), [self.old_post.pk])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_timeline_trimmed_to_length(self):
+        """Лента обрезается до settings.TIMELINE_LENGTH записей."""
+        Follow.objects.create(user=self.user, author=self.author)
+        new_posts = [Post.objects.create(author=self.author, text=str(i))
+                     for i in range(3)]
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(),
+                         2)
+        self.assertEqual(self.get_timeline(),
+                         [new_posts[2].pk, new_posts[1].pk])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_push_trims_all_timelines_in_constant_queries(self):
+        """Публикация обрезает ленты всех подписчиков, число запросов
+        не зависит от числа подписчиков."""
+        Follow.objects.create(user=self.user, author=self.author)
+        with CaptureQueriesContext(connection) as one_follower:
+            Post.objects.create(author=self.author, text='first')
+        followers = [User.objects.create_user(username=f'follower{i}')
+                     for i in range(3)]
+        Follow.objects.bulk_create(
+            [Follow(user=user, author=self.author) for user in followers])
+        Post.objects.create(author=self.author, text='second')
+        with CaptureQueriesContext(connection) as many_followers:
+            post = Post.objects.create(author=self.author, text='third')
+        self.assertEqual(len(many_followers), len(one_follower))
+        for user in (self.user, *followers):
+            entries = TimelineEntry.objects.filter(user=user)
+            with self.subTest(user=user.username):
+                self.assertEqual(entries.count(), 2)
+                self.assertEqual(entries.first().post_id, post.pk)
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_unfollow_refills_trimmed_timeline(self):
+        """После отписки обрезанная лента дополняется более старыми
+        записями остальных авторов."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user, author=self.other_author)
+        older = [Post.objects.create(author=self.other_author, text=str(i))
+                 for i in range(2)]
+        newer = [Post.objects.create(author=self.author, text=str(i))
+                 for i in range(2)]
+        self.assertEqual(self.get_timeline(), [newer[1].pk, newer[0].pk])
+        Follow.objects.get(user=self.user, author=self.author).delete()
+        self.assertEqual(self.get_timeline(), [older[1].pk, older[0].pk])
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленты из Follow."""
+        Follow.objects.create(user=self.user, author=self.author)
+        TimelineEntry.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_timelines', stdout=out)
+        self.assertEqual(self.get_timeline(), [self.old_post.pk])
+        self.assertIn('1', out.getvalue())
+
+    @override_settings(POSTS_PER_PAGE=1)
+    def test_follow_page_with_cursor_pagination(self):
+        """Лента подписок листается по курсору."""
+        Follow.objects.create(user=self.user, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='new')
+        client = Client()
+        client.force_login(self.user)
+        url = reverse('posts:follow_index')
+        page_obj = client.get(url + '?cursor=').context['page_obj']
+        self.assertEqual(list(page_obj), [new_post])
+        page_obj = client.get(
+            f'{url}?cursor={page_obj.next_cursor}').context['page_obj']
+        self.assertEqual(list(page_obj), [self.old_post])
+        self.assertFalse(page_obj.has_next())
@@ -1,13 +1,15 @@
 import shutil
 import tempfile
 from http import HTTPStatus
-from io import BytesIO
+from io import BytesIO, StringIO
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from PIL import Image
@@ -78,6 +80,32 @@ class TestPostsPages(TestCase):
         self.auth_lonely_user.force_login(self.lonely_user)
         self.not_auth_user = Client()
 
+    def test_conditional_get_returns_not_modified(self):
+        """
+        Тестирование ETag страниц.
+
+        Повторный запрос с If-None-Match получает 304, пока данные
+        не изменились; ETag зависит от пользователя и от новых записей.
+        """
+        urls = (
+            reverse('posts:main'),
+            reverse('posts:group_list', kwargs={'slug': self.group_1.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post_3.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.auth_user.get(url)['ETag']
+                response = self.auth_user.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertNotEqual(self.not_auth_user.get(url)['ETag'], etag)
+        url = reverse('posts:main')
+        etag = self.not_auth_user.get(url)['ETag']
+        Post.objects.create(author=self.user, text='new')
+        response = self.not_auth_user.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
     def test_auth_user_can_follow_and_unfollow(self):
         """
         Тестирование функции follow_index.
@@ -156,19 +184,43 @@ class TestPostsPages(TestCase):
         """
         Тестирование работы кэша на главной странице.
 
-        Удаленная запись сохраняется в кэше и выводится на главную страницу.
+        Страница берется из кэша, пока записи не изменились.
+        После удаления записи кэш сразу становится недействительным.
         """
         new_post = Post.objects.create(author=self.user, text='test_cache')
         response = self.auth_user.get(reverse('posts:main'))
         content_before_the_del = response.content
-        new_post.delete()
+        # update() не отправляет сигналы, поэтому версия кэша не меняется.
+        Post.objects.filter(pk=new_post.pk).update(text='changed')
         response = self.auth_user.get(reverse('posts:main'))
-        content_after_the_del = response.content
-        self.assertEqual(content_after_the_del, content_before_the_del)
-        cache.clear()
+        self.assertEqual(response.content, content_before_the_del)
+        self.auth_user.get('/search/?text=test')
         response = self.auth_user.get(reverse('posts:main'))
-        content_after_clear_cache = response.content
-        self.assertNotEqual(content_after_clear_cache, content_before_the_del)
+        self.assertEqual(response.content, content_before_the_del)
+        new_post.delete()
+        response = self.auth_user.get(reverse('posts:main'))
+        self.assertNotEqual(response.content, content_before_the_del)
+        self.assertNotIn(new_post.text, response.content.decode())
+
+    def test_follow_page_cache_is_per_user(self):
+        """Лента подписок из кэша не показывается другим пользователям."""
+        Follow.objects.create(user=self.user, author=self.following_user)
+        response = self.auth_user.get(reverse('posts:follow_index'))
+        self.assertIn(self.post_2, response.context['page_obj'])
+        response = self.auth_lonely_user.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.assertNotIn(self.post_2.text, response.content.decode())
+
+    def test_author_rename_invalidates_cached_cards(self):
+        """После смены имени автора закэшированные ленты показывают
+        новое имя."""
+        url = reverse('posts:main')
+        self.assertNotIn('Новое Имя', self.auth_user.get(url)
+                         .content.decode())
+        author = User.objects.get(pk=self.following_user.pk)
+        author.first_name, author.last_name = 'Новое', 'Имя'
+        author.save()
+        self.assertIn('Новое Имя', self.auth_user.get(url).content.decode())
 
     def test_pages_with_page_obj_has_image(self):
         """
@@ -209,6 +261,37 @@ class TestPostsPages(TestCase):
             response.context.get('comment_form').fields.get('text'),
             forms.CharField)
 
+    @override_settings(COMMENTS_PER_PAGE=2)
+    def test_post_detail_comments_paginated_by_cursor(self):
+        """
+        Тестирование постраничного вывода комментариев.
+
+        На странице записи выводится первая страница комментариев,
+        остальные подгружаются по курсору с posts:post_comments в выбранном
+        порядке.
+        """
+        comments = [self.comment] + [
+            Comment.objects.create(post=self.post_3, author=self.lonely_user,
+                                   text=f'comment_{number}')
+            for number in range(3)
+        ]
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post_3.id})
+        page = self.not_auth_user.get(url).context['comments']
+        self.assertEqual(list(page), comments[:2])
+        self.assertTrue(page.has_next())
+        fragment = self.not_auth_user.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post_3.id}),
+            {'cursor': page.next_cursor})
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertEqual(list(fragment.context['comments']), comments[2:])
+        self.assertFalse(fragment.context['comments'].has_next())
+        newest = self.not_auth_user.get(url, {'ordering': '-created'})
+        self.assertEqual(list(newest.context['comments']),
+                         comments[:1:-1])
+        missing = self.not_auth_user.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0}))
+        self.assertEqual(missing.status_code, HTTPStatus.NOT_FOUND)
+
     def test_pages_uses_correct_template(self):
         """
         Тестирование имен шаблонов во вью функциях.
@@ -404,9 +487,36 @@ class TestPostsPages(TestCase):
         self.assertEqual(response.context.get('title'), 'Результаты поиска')
         self.assertEqual(count_posts, 1)
 
+    def test_text_search_ranked_and_case_insensitive(self):
+        """Поиск не зависит от регистра, релевантные записи выше."""
+        weak = Post.objects.create(author=self.user,
+                                   text='Кот и много других слов ' * 5)
+        strong = Post.objects.create(author=self.user, text='кот')
+        response = self.auth_user.get('/search/?text=КОТ')
+        self.assertEqual(list(response.context['page_obj']), [strong, weak])
+        weak.text = 'собака'
+        weak.save()
+        response = self.auth_user.get('/search/?text=кот')
+        self.assertEqual(list(response.context['page_obj']), [strong])
+
+    def test_rebuild_search_index(self):
+        """Команда rebuild_search_index индексирует записи, измененные
+        в обход save()."""
+        post = Post.objects.create(author=self.user, text='кот')
+        Post.objects.filter(pk=post.pk).update(text='ёжик')
+        response = self.auth_user.get('/search/?text=ежик')
+        self.assertEqual(list(response.context['page_obj']), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.auth_user.get('/search/?text=ежик')
+        self.assertEqual(list(response.context['page_obj']), [post])
+        response = self.auth_user.get('/search/?text=кот')
+        self.assertEqual(list(response.context['page_obj']), [])
+
 
 @override_settings(CACHES={
-    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache', }})
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache', },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', }})
 class TestPaginatorViews(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -448,3 +558,96 @@ class TestPaginatorViews(TestCase):
                     self.posts_on_page)
                 self.assertEqual(len(response_page_2.context['page_obj']),
                                  self.posts_on_second_page)
+
+    def test_cursor_paginator_for_pages(self):
+        """
+        Тестирование CursorPaginator.
+
+        Страницы по курсору выводят те же записи, что и по номерам,
+        и позволяют вернуться на более новую страницу.
+        """
+        pages_with_paginator = (
+            reverse('posts:main'),
+            reverse('posts:group_list', kwargs={'slug': self.group_1.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username})
+        )
+        for page in pages_with_paginator:
+            with self.subTest(page=page):
+                first_page = self.anon_user.get(page + '?cursor=')
+                page_obj = first_page.context['page_obj']
+                self.assertEqual(len(page_obj), self.posts_on_page)
+                self.assertFalse(page_obj.has_previous())
+                self.assertEqual(
+                    list(page_obj),
+                    list(self.anon_user.get(page).context['page_obj']))
+                second_page = self.anon_user.get(
+                    f'{page}?cursor={page_obj.next_cursor}')
+                second_page_obj = second_page.context['page_obj']
+                self.assertEqual(len(second_page_obj),
+                                 self.posts_on_second_page)
+                self.assertFalse(second_page_obj.has_next())
+                back_page = self.anon_user.get(
+                    f'{page}?cursor={second_page_obj.previous_cursor}')
+                self.assertEqual(list(back_page.context['page_obj']),
+                                 list(page_obj))
+                self.assertIn('Старше', first_page.content.decode())
+
+    @override_settings(POSTS_PER_PAGE=1)
+    def test_paginator_shows_elided_page_range(self):
+        """
+        Тестирование функции get_page_obj_paginator.
+
+        В навигации выводятся первая, последняя и соседние с текущей
+        страницы, остальные заменяются многоточием.
+        """
+        response = self.anon_user.get(reverse('posts:main') + '?page=6')
+        page_range = response.context['page_obj'].elided_page_range
+        ellipsis = response.context['page_obj'].paginator.ELLIPSIS
+        self.assertEqual(page_range,
+                         [1, ellipsis, 4, 5, 6, 7, 8, ellipsis, 11])
+        self.assertNotIn('?page=2"', response.content.decode())
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=20)
+    def test_paginator_ignores_stale_estimate(self):
+        """
+        Тестирование CachedPaginator.
+
+        Устаревшая статистика СУБД, по которой записей меньше
+        PAGINATOR_EXACT_COUNT_LIMIT, не прячет последние страницы.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Post.objects.bulk_create(
+            Post(text=f'post_{number}', author=self.user)
+            for number in range(60))
+        total = Post.objects.count()
+        response = self.anon_user.get(reverse('posts:main'))
+        self.assertEqual(response.context['page_obj'].paginator.count, total)
+        last_page = response.context['page_obj'].paginator.num_pages
+        response = self.anon_user.get(
+            reverse('posts:main') + f'?page={last_page}')
+        self.assertEqual(response.context['page_obj'].number, last_page)
+        self.assertGreater(last_page, 1)
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=5, CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_paginator_count_cached_for_large_lists(self):
+        """
+        Тестирование CachedPaginator.
+
+        Для длинной ленты число записей считается один раз и берется
+        из кэша, пока не истечет PAGINATOR_COUNT_TIMEOUT.
+        """
+        cache.clear()
+        url = reverse('posts:main')
+        response = self.anon_user.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count,
+                         self.total_posts)
+        Post.objects.create(text='new_post', author=self.user)
+        response = self.anon_user.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count,
+                         self.total_posts)
+        cache.clear()
@@ -0,0 +1,139 @@
+"""
+Заблаговременное создание миниатюр картинок записей.
+
+Все размеры миниатюр описаны в settings.THUMBNAIL_GEOMETRIES:
+{название: (геометрия, опции sorl-thumbnail)}. Миниатюры создаются сразу
+после сохранения записи с новой картинкой (см. posts.signals) в пуле из
+settings.THUMBNAIL_WORKERS потоков, для уже загруженных картинок - командой
+generate_thumbnails.
+
+Имена готовых миниатюр сохраняются в Post.thumbnails вместе с именем
+исходной картинки: {'source': 'posts/a.jpg', 'card': 'cache/..../b.jpg'}.
+Адрес миниатюры получается из этих данных без обращений к хранилищу
+и KVStore sorl-thumbnail (см. resolve), поэтому отрисовка ленты не делает
+лишних запросов на каждую картинку. Пока миниатюра не готова, вместо нее
+выводится исходная картинка. После изменения геометрии существующего
+размера нужно запустить generate_thumbnails.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+
+from . import cache
+from .models import Follow, Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS,
+                                       thread_name_prefix='thumbnails')
+    return _executor
+
+
+def generate(image_name):
+    """Создает все миниатюры картинки и возвращает их манифест."""
+    manifest = {'source': image_name}
+    for alias, (geometry, options) in settings.THUMBNAIL_GEOMETRIES.items():
+        manifest[alias] = get_thumbnail(image_name, geometry, **options).name
+    return manifest
+
+
+def save_manifest(image_name, manifest):
+    """Сохраняет манифест всем записям, у которых еще эта картинка."""
+    return Post.objects.filter(image=image_name).update(thumbnails=manifest)
+
+
+def process(post):
+    """Создает миниатюры картинки записи и сбрасывает кэш лент с ней:
+    в закэшированных лентах могла остаться исходная картинка."""
+    save_manifest(post.image.name, generate(post.image.name))
+    follower_ids = (Follow.objects.filter(author_id=post.author_id)
+                    .values_list('user_id', flat=True))
+    cache.invalidate_post(post, (post.group_id,), follower_ids)
+
+
+def _process_in_worker(post):
+    try:
+        process(post)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры %s', post.image.name)
+    finally:
+        _pending.discard(post.image.name)
+        # Соединения потоков пула не закрывает обработчик запросов.
+        close_old_connections()
+
+
+def _submit(post):
+    with _executor_lock:
+        if post.image.name in _pending:
+            return
+        _pending.add(post.image.name)
+        executor = get_executor()
+    executor.submit(_process_in_worker, post)
+
+
+def schedule(post):
+    """Ставит создание миниатюр записи в очередь после фиксации транзакции.
+
+    При settings.THUMBNAIL_WORKERS = 0 миниатюры создаются сразу в том же
+    потоке.
+    """
+    if not post.image:
+        return
+    # Поток получает копию только с нужными полями, а не изменяемый объект.
+    post = Post(pk=post.pk, image=post.image.name, author_id=post.author_id,
+                group_id=post.group_id)
+    if settings.THUMBNAIL_WORKERS:
+        transaction.on_commit(lambda: _submit(post))
+    else:
+        transaction.on_commit(lambda: process(post))
+
+
+def is_ready(post):
+    """Есть ли у записи все миниатюры ее текущей картинки."""
+    manifest = post.thumbnails or {}
+    return (manifest.get('source') == post.image.name
+            and all(alias in manifest
+                    for alias in settings.THUMBNAIL_GEOMETRIES))
+
+
+def resolve(posts):
+    """Сохраняет в post.thumbnail_urls адреса миниатюр записей страницы.
+
+    Адреса вычисляются из Post.thumbnails, хранилище не опрашивается.
+    Для записей без готовых миниатюр подставляется исходная картинка,
+    а создание миниатюр ставится в очередь.
+    """
+    for post in posts:
+        if not post.image:
+            post.thumbnail_urls = {}
+        elif is_ready(post):
+            post.thumbnail_urls = {
+                alias: default.storage.url(post.thumbnails[alias])
+                for alias in settings.THUMBNAIL_GEOMETRIES
+            }
+        else:
+            post.thumbnail_urls = dict.fromkeys(
+                settings.THUMBNAIL_GEOMETRIES, post.image.url)
+            if settings.THUMBNAIL_WORKERS:
+                schedule(post)
+    return posts
+
+
+def get_url(post, alias):
+    """Адрес миниатюры картинки записи, а если она еще не создана -
+    исходной картинки."""
+    if not hasattr(post, 'thumbnail_urls'):
+        resolve([post])
+    return post.thumbnail_urls.get(alias, '')
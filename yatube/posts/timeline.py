@@ -0,0 +1,159 @@
+"""
+Предрассчитанные ленты подписок (fan-out-on-write).
+
+При публикации запись раскладывается по лентам всех подписчиков автора,
+поэтому страница подписок читает готовый список id из одной таблицы
+вместо соединения Post и Follow с сортировкой.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q, Value, Window
+from django.db.models.functions import RowNumber
+
+from .models import Follow, Post, TimelineEntry
+
+
+def get_entries(user):
+    """Возвращает записи ленты пользователя, новые первыми."""
+    return TimelineEntry.objects.filter(user=user)
+
+
+def get_timeline_ids(user):
+    """Возвращает ленивый список id записей в ленте пользователя."""
+    return (get_entries(user).values_list('post_id', flat=True)
+            [:settings.TIMELINE_LENGTH])
+
+
+def trim(user_ids):
+    """Обрезает ленты пользователей до settings.TIMELINE_LENGTH записей."""
+    with connections[TimelineEntry.objects.db].cursor() as cursor:
+        cursor.execute(*get_trim_sql(user_ids))
+
+
+def get_trim_sql(user_ids):
+    """
+    Возвращает DELETE, обрезающий ленты пользователей одним запросом.
+
+    Записи каждой ленты нумеруются от новых к старым (ROW_NUMBER по
+    индексу ленты), удаляются записи с номером больше длины ленты.
+    user_ids - список id или подзапрос.
+    """
+    entries = (TimelineEntry.objects.filter(user_id__in=user_ids)
+               .annotate(timeline_position=Window(
+                   RowNumber(), partition_by=[F('user_id')],
+                   order_by=[F('pub_date').desc(), F('post_id').desc()]))
+               .order_by().values_list('pk', 'timeline_position'))
+    sql, params = entries.query.sql_with_params()
+    meta = TimelineEntry._meta
+    pk = meta.pk.column
+    return (f'DELETE FROM {meta.db_table} WHERE {pk} IN ('
+            f'SELECT {pk} FROM ({sql}) WHERE timeline_position > %s)',
+            (*params, settings.TIMELINE_LENGTH))
+
+
+def push_post(post):
+    """Добавляет новую запись в ленты всех подписчиков автора."""
+    return push_posts(post.author_id, [post])
+
+
+def push_posts(author_id, posts):
+    """Добавляет новые записи автора в ленты всех его подписчиков."""
+    follower_ids = list(Follow.objects.filter(author_id=author_id)
+                        .values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post.pk,
+                       pub_date=post.pub_date)
+         for user_id in follower_ids for post in posts],
+        ignore_conflicts=True
+    )
+    trim(Follow.objects.filter(author_id=author_id).values('user_id'))
+    return follower_ids
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние записи автора после подписки."""
+    posts = (Post.objects.filter(author_id=author_id)
+             .values_list('pk', 'pub_date')[:settings.TIMELINE_LENGTH])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts],
+        ignore_conflicts=True
+    )
+    trim((user_id,))
+
+
+def remove_author(user_id, author_id):
+    """Убирает из ленты записи автора после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+    refill(user_id)
+
+
+def refill(user_id):
+    """
+    Дополняет ленту до settings.TIMELINE_LENGTH записей.
+
+    После отписки в обрезанной ленте может не хватать записей: их место
+    занимают записи остальных авторов старше самой старой записи ленты
+    (более новые в ленте уже есть).
+    """
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    missing = settings.TIMELINE_LENGTH - entries.count()
+    if missing <= 0:
+        return
+    author_ids = Follow.objects.filter(user_id=user_id).values('author_id')
+    posts = Post.objects.filter(author_id__in=author_ids)
+    oldest = entries.values_list('pub_date', 'post_id').last()
+    if oldest is not None:
+        pub_date, post_id = oldest
+        posts = posts.filter(Q(pub_date__lt=pub_date)
+                             | Q(pub_date=pub_date, pk__lt=post_id))
+    posts = (posts.order_by('-pub_date', '-pk')
+             .values_list('pk', 'pub_date')[:missing])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts],
+        ignore_conflicts=True
+    )
+
+
+def rebuild(user_ids=None):
+    """
+    Пересобирает ленты по таблице Follow.
+
+    Если user_ids не передан, пересобираются ленты всех пользователей.
+    Возвращает число пересобранных лент.
+    """
+    follows = Follow.objects.all()
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    rebuilt = 0
+    user_ids = (follows.order_by('user_id').values_list('user_id', flat=True)
+                .distinct())
+    with connections[TimelineEntry.objects.db].cursor() as cursor:
+        for user_id in list(user_ids):
+            cursor.execute(*get_rebuild_sql(user_id))
+            rebuilt += 1
+    return rebuilt
+
+
+def get_rebuild_sql(user_id):
+    """
+    Возвращает INSERT ... SELECT, заполняющий ленту пользователя.
+
+    Строки не проходят через Python, поэтому пересборка больших лент
+    не создает тысячи объектов TimelineEntry.
+    """
+    author_ids = Follow.objects.filter(user_id=user_id).values('author_id')
+    posts = (Post.objects.filter(author_id__in=author_ids)
+             .annotate(timeline_user_id=Value(user_id))
+             .values_list('pk', 'pub_date', 'timeline_user_id')
+             [:settings.TIMELINE_LENGTH])
+    sql, params = posts.query.sql_with_params()
+    meta = TimelineEntry._meta
+    columns = ', '.join(meta.get_field(name).column
+                        for name in ('post', 'pub_date', 'user'))
+    return f'INSERT INTO {meta.db_table} ({columns}) {sql}', params
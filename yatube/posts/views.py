@@ -1,68 +1,141 @@
-import time
-from functools import wraps
-
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import get_user_model
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
-from django.db.models import Count, Q
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import condition
 
+from . import timeline
+from .cache import make_etag, make_key
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, User
+from .paginators import CachedPaginator, CursorPaginator, PostIdList
+from .search import search_posts
 
 User = get_user_model()
 
 
-# Декоратор для тестирования скорости выполнения функций
-def execute_time(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start = time.time()
-        res = func(*args, **kwargs)
-        stop = time.time()
-        print(stop - start)
-        return res
-    return wrapper
+def get_page_obj_paginator(request, post_list, cache_name=None,
+                           namespaces=()):
+    """
+    Возвращает контекст со страницей записей.
+
+    Если передан cache_name, число записей, id записей страницы и сама
+    отрисованная страница кэшируются до изменения данных в пространствах
+    имен namespaces (см. posts.cache). Для длинных лент число записей
+    приблизительное (см. CachedPaginator). Номера страниц выводятся
+    сокращенно: первая, последняя и несколько вокруг текущей.
+    При settings.POSTS_CURSOR_PAGINATION или параметре cursor в запросе
+    страницы выбираются по курсору (см. CursorPaginator).
+    """
+    cache_key = cache_name and make_key(cache_name, namespaces)
+    if settings.POSTS_CURSOR_PAGINATION or 'cursor' in request.GET:
+        paginator = CursorPaginator(post_list, settings.POSTS_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    else:
+        if cache_key:
+            paginator = CachedPaginator(
+                post_list, settings.POSTS_PER_PAGE, cache_key,
+                count_key=make_key(f'count:{cache_name}', ()))
+        else:
+            paginator = Paginator(post_list, settings.POSTS_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        page_obj.elided_page_range = list(paginator.get_elided_page_range(
+            page_obj.number, on_each_side=2, on_ends=1))
+    cache_timeout = settings.FEED_CACHE_TIMEOUT if cache_key else 0
+    return {'page_obj': page_obj, 'cache_key': cache_key,
+            'cache_timeout': cache_timeout}
+
+
+def get_comments_page(request, post_id):
+    """
+    Возвращает страницу комментариев записи по курсору.
+
+    По умолчанию комментарии идут от старых к новым, при ?ordering=-created
+    - от новых к старым. Авторы загружаются тем же запросом.
+    """
+    ordering = request.GET.get('ordering')
+    paginator = CursorPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        settings.COMMENTS_PER_PAGE, date_field='created',
+        descending=ordering == '-created')
+    page = paginator.get_page(request.GET.get('cursor'))
+    page.ordering = '-created' if paginator.descending else 'created'
+    return page
+
+
+def index_etag(request):
+    return make_etag(('posts',), request.user)
+
+
+def group_posts_etag(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('pk', flat=True).first())
+    if group_id is None:
+        return None
+    return make_etag((f'group:{group_id}',), request.user)
 
 
-def get_page_obj_paginator(request, post_list):
-    paginator = Paginator(post_list, settings.POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return {'page_obj': page_obj}
+def profile_etag(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('pk', flat=True).first())
+    if author_id is None:
+        return None
+    return make_etag((f'author:{author_id}',), request.user)
 
 
-# @cache_page(20, key_prefix='index_page')
-# @vary_on_cookie
-# @execute_time
+def post_detail_etag(request, post_id):
+    post = (Post.objects.filter(pk=post_id)
+            .values_list('author_id', 'group_id').first())
+    if post is None:
+        return None
+    author_id, group_id = post
+    namespaces = [f'post:{post_id}', f'author:{author_id}']
+    if group_id:
+        namespaces.append(f'group:{group_id}')
+    return make_etag(namespaces, request.user)
+
+
+def post_comments_etag(request, post_id):
+    return make_etag((f'post:{post_id}',))
+
+
+def follow_index_etag(request):
+    return make_etag((f'feed:{request.user.pk}',), request.user)
+
+
+@condition(etag_func=index_etag)
 def index(request):
-    posts_list = cache.get('posts_list')
-    if not posts_list:
-        posts_list = (Post.objects.select_related('author')
-                      .select_related('group').all())
-        cache.set('posts_list', posts_list, 20)
-    context = get_page_obj_paginator(request, posts_list)
+    posts_list = (Post.objects.select_related('author')
+                  .select_related('group').all())
+    context = get_page_obj_paginator(request, posts_list, 'index',
+                                     ('posts',))
     context.update({'title': 'Последние записи'})
     return render(request, template_name='posts/index.html', context=context)
 
 
-# @execute_time
+@condition(etag_func=group_posts_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     group_post_list = group.posts.select_related('author').all()
-    context = get_page_obj_paginator(request, group_post_list)
+    context = get_page_obj_paginator(request, group_post_list,
+                                     f'group:{group.pk}',
+                                     (f'group:{group.pk}',))
     context.update({'group': group})
     return render(request, template_name='posts/group_list.html',
                   context=context)
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('profile'),
+                               username=username)
     user_posts = author.posts.select_related('group').all()
-    context = get_page_obj_paginator(request, user_posts)
+    context = get_page_obj_paginator(request, user_posts,
+                                     f'profile:{author.pk}',
+                                     (f'author:{author.pk}',))
     following = (request.user.is_authenticated
                  and Follow.objects.filter(user=request.user,
                                            author=author).exists())
@@ -70,17 +143,27 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@condition(etag_func=post_detail_etag)
 def post_detail(request, post_id):
-    post = (get_object_or_404(Post.objects.select_related('author')
-                              .annotate(count=Count('author__posts')),
-                              id=post_id))
-    comments = post.comments.select_related('author').all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__profile', 'group'), id=post_id)
+    comments = get_comments_page(request, post.pk)
     comment_form = CommentForm()
     context = {'post': post, 'comments': comments,
                'comment_form': comment_form}
     return render(request, 'posts/post_detail.html', context)
 
 
+@condition(etag_func=post_comments_etag)
+def post_comments(request, post_id):
+    """Следующая страница комментариев для кнопки "Показать еще"."""
+    comments = get_comments_page(request, post_id)
+    if not comments and not Post.objects.filter(pk=post_id).exists():
+        raise Http404('Запись не найдена')
+    context = {'comments': comments, 'post_id': post_id}
+    return render(request, 'posts/includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -130,16 +213,15 @@ def add_comment(request, post_id):
 
 
 @login_required
-# @cache_page(20, key_prefix='follow_page')
-# @vary_on_cookie
+@condition(etag_func=follow_index_etag)
 def follow_index(request):
-    follow_posts = cache.get('follow_posts')
-    if not follow_posts:
-        follow_posts = (
-            (Post.objects.select_related('author').select_related('group')
-             .filter(author__following__user=request.user)))
-        cache.set('follow_posts', follow_posts, 20)
-    context = get_page_obj_paginator(request, follow_posts)
+    follow_posts = PostIdList(
+        timeline.get_timeline_ids(request.user),
+        Post.objects.select_related('author').select_related('group'),
+        entries=timeline.get_entries(request.user))
+    context = get_page_obj_paginator(request, follow_posts,
+                                     f'follow:{request.user.pk}',
+                                     (f'feed:{request.user.pk}',))
     return render(request, 'posts/follow.html', context)
 
 
@@ -150,7 +232,7 @@ def profile_follow(request, username):
     if user == author:
         raise PermissionDenied()
     Follow.objects.get_or_create(user=request.user, author=author)
-    return render(request, 'posts/follow.html')
+    return redirect('posts:follow_index')
 
 
 @login_required
@@ -164,18 +246,14 @@ def profile_unfollow(request, username):
 def get_search_result(request):
     text = request.GET.get('text')
     if not text:
-        return render(request, 'posts/index.html',
-                      {'title': 'Введите текст в строку поиска'})
-    posts_search = (
-        Post.objects.select_related('author').select_related('group')
-        .filter(Q(text__contains=text)
-                | Q(text__contains=text.lower())
-                | Q(text__contains=text.capitalize())
-                | Q(author__username__contains=text)
-                | Q(author__first_name__contains=text)))
-    context = get_page_obj_paginator(request, posts_search)
-    count_posts = context['page_obj'].paginator.count
-    title = 'Результаты поиска' if count_posts else 'Ничего не найдено'
+        context = get_page_obj_paginator(request, Post.objects.none())
+        context.update({'title': 'Введите текст в строку поиска'})
+        return render(request, 'posts/index.html', context)
+    posts_search = search_posts(
+        Post.objects.select_related('author').select_related('group'), text)
+    context = get_page_obj_paginator(request, posts_search,
+                                     f'search:{text}', ('posts',))
+    found = len(context['page_obj']) or context['page_obj'].has_previous()
+    title = 'Результаты поиска' if found else 'Ничего не найдено'
     context.update({'title': title})
-    cache.clear()
     return render(request, 'posts/index.html', context)
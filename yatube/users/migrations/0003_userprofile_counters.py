@@ -0,0 +1,62 @@
+# Generated by Django 3.2 on 2026-10-18 02:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_by(queryset, field, outer):
+    counts = (queryset.filter(**{field: OuterRef(outer)}).order_by()
+              .values(field).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserProfile = apps.get_model('users', 'UserProfile')
+    Post = apps.get_model('posts', 'Post')
+    Group = apps.get_model('posts', 'Group')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id) for user_id in
+         User.objects.filter(profile__isnull=True)
+         .values_list('pk', flat=True)],
+        batch_size=500
+    )
+    UserProfile.objects.update(
+        posts_count=count_by(Post.objects, 'author', 'user_id'),
+        followers_count=count_by(Follow.objects, 'author', 'user_id'),
+        following_count=count_by(Follow.objects, 'user', 'user_id'),
+    )
+    Post.objects.update(comments_count=count_by(Comment.objects, 'post', 'pk'))
+    Group.objects.update(posts_count=count_by(Post.objects, 'group', 'pk'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_auto_20230310_0151'),
+        ('posts', '0016_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число подписок'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число записей'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -2,12 +2,14 @@ import pytz
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from core.models import ServerFieldsMixin
+
 TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
 
 User = get_user_model()
 
 
-class UserProfile(models.Model):
+class UserProfile(ServerFieldsMixin, models.Model):
     user = models.OneToOneField(
         to=User,
         verbose_name='Пользователь',
@@ -20,3 +22,21 @@ class UserProfile(models.Model):
         default='UTC',
         blank=False
     )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число записей',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Число подписчиков',
+        default=0,
+        editable=False
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Число подписок',
+        default=0,
+        editable=False
+    )
+
+    # Счетчики меняют сигналы записей и подписок (см. posts.counters).
+    server_fields = ('posts_count', 'followers_count', 'following_count')
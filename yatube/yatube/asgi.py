@@ -5,6 +5,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 import chat.routing
+from chat.lifespan import lifespan
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
@@ -14,5 +15,6 @@ application = ProtocolTypeRouter({
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
-    )
+    ),
+    "lifespan": lifespan,
 })
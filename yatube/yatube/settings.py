@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -116,12 +117,27 @@ TEMPLATES = [
 WSGI_APPLICATION = 'yatube.wsgi.application'
 ASGI_APPLICATION = 'yatube.asgi.application'
 
+# Слой в памяти работает в одном процессе. Чтобы запустить несколько
+# процессов daphne на одном сервере без Redis, используется слой
+# "chat.layers.SQLiteChannelLayer" с общей базой SQLite, путь к ней
+# задается в "CONFIG": {"path": ...} (см. chat.layers).
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
 }
 
+# Сообщения чата записываются в базу пачками: когда набралось
+# CHAT_BUFFER_SIZE сообщений или прошло CHAT_FLUSH_INTERVAL секунд.
+# При CHAT_DURABLE_MESSAGES сообщение рассылается только после записи.
+CHAT_BUFFER_SIZE = 100
+CHAT_FLUSH_INTERVAL = 0.05
+CHAT_DURABLE_MESSAGES = False
+# История чата отдается страницами до известного сообщения (chat.history):
+# по умолчанию CHAT_HISTORY_PAGE_SIZE, не больше CHAT_HISTORY_MAX_PAGE_SIZE.
+CHAT_HISTORY_PAGE_SIZE = 20
+CHAT_HISTORY_MAX_PAGE_SIZE = 100
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -184,12 +200,95 @@ LOGIN_REDIRECT_URL = 'posts:main'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Версии пространств имен кэша лент (см. posts.cache) должны быть общими
+# для всех процессов: в "versions" нужен общий кэш (файлы на одном
+# сервере, memcached или Redis на нескольких), а значения могут лежать
+# в кэше процесса.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        # Каталог в проекте, а не в общем /tmp: FileBasedCache читает
+        # файлы через pickle, и чужой каталог позволил бы подложить их.
+        'LOCATION': os.path.join(BASE_DIR, 'cache_versions'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
 CSRF_FAILURE_VIEW = 'core.views.get_csrf_failure'
 
 POSTS_PER_PAGE = 10
+# Комментарии выводятся по курсору, кнопка "Показать еще" подгружает
+# следующую страницу (posts:post_comments).
+COMMENTS_PER_PAGE = 20
+
+# Расширения Markdown для текста записей. После изменения списка нужно
+# перерисовать записи командой render_posts.
+MARKDOWN_EXTENSIONS = ['markdown.extensions.fenced_code']
+POST_EXCERPT_LENGTH = 200
+
+# Постраничный вывод лент по курсору вместо номеров страниц.
+# Включается и для отдельного запроса параметром ?cursor=
+POSTS_CURSOR_PAGINATION = False
+
+# Время жизни кэша лент. Кэш сбрасывается при изменении данных
+# (см. posts.cache), таймаут лишь вытесняет устаревшие версии.
+FEED_CACHE_TIMEOUT = 60 * 60
+
+# До этого значения число записей в ленте считается точно, для более
+# длинных лент используется оценка, обновляемая раз в
+# PAGINATOR_COUNT_TIMEOUT секунд.
+PAGINATOR_EXACT_COUNT_LIMIT = 10000
+PAGINATOR_COUNT_TIMEOUT = 60 * 5
+
+# Как часто процесс сверяет свой снимок каталога сообществ с версией
+# в общем кэше (см. posts.catalogue), в секундах.
+GROUP_CATALOGUE_CHECK_INTERVAL = 1
+
+# Как часто процесс перечитывает счетчики записей сообществ в каталоге,
+# в секундах: счетчики в списке сообществ API отстают не больше чем на это
+# время.
+GROUP_POSTS_COUNT_INTERVAL = 60
+
+# Максимальная длина предрассчитанной ленты подписок
+TIMELINE_LENGTH = 1000
+
+# Профилирование запросов по заголовку X-Profile или параметру ?_profile
+# (см. core.profiling). Доступно персоналу и пользователям из
+# PROFILING_USERS, результаты - на странице /profiles/.
+PROFILING_ENABLED = True
+PROFILING_USERS = []
+PROFILING_ROOT = os.path.join(BASE_DIR, 'profiles')
+PROFILING_KEEP = 100
+PROFILING_TOP_FUNCTIONS = 40
+
+# Размеры миниатюр картинок записей: {название: (геометрия, опции)}.
+# Миниатюры создаются заранее в THUMBNAIL_WORKERS потоках (см.
+# posts.thumbnails), для загруженных ранее картинок - командой
+# generate_thumbnails. При THUMBNAIL_WORKERS = 0 они создаются сразу
+# после сохранения записи.
+THUMBNAIL_GEOMETRIES = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+THUMBNAIL_WORKERS = 2
+
+# Наибольшее число объектов в одном запросе к api/v1/.../bulk/ и число
+# потоков для параллельной загрузки картинок по ссылкам из такого запроса.
+API_BULK_MAX_ITEMS = 1000
+API_IMAGE_FETCH_WORKERS = 8
+
+# Размер пачки строк при выгрузке в NDJSON и загрузке выгрузки
+# (api/v1/export/, команды export_data и import_data).
+EXPORT_CHUNK_SIZE = 1000
+
+# Картинки записей в API (см. api.images): схемы ссылок, таймауты
+# соединения и чтения, общее время загрузки и наибольший размер картинки
+# по ссылке или в base64. При API_IMAGE_FETCH_DEFERRED запись сохраняется
+# сразу, а картинка прикрепляется к ней после загрузки в фоне.
+API_IMAGE_URL_SCHEMES = ('https',)
+API_IMAGE_FETCH_TIMEOUT = (3.05, 10)
+API_IMAGE_FETCH_DEADLINE = 30
+API_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+API_IMAGE_FETCH_DEFERRED = False
@@ -12,6 +12,7 @@ urlpatterns = [
     path('about/', include('about.urls', namespace='about')),
     path('chat/', include('chat.urls', namespace='chat')),
     path('api/', include('api.urls', namespace='api')),
+    path('profiles/', include('core.urls', namespace='core')),
 ]
 
 if settings.DEBUG: